@@ -0,0 +1,313 @@
+import atexit
+import base64
+import io
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from websockets.sync.client import connect
+
+logger = logging.getLogger(__name__)
+
+CHROMIUM_PATH = os.getenv("CHROME_BIN", "/usr/bin/chromium")
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+BROWSER_RENDER_TIMEOUT = float(os.getenv("BROWSER_RENDER_TIMEOUT", "30"))
+# A browser is restarted after this many renders, so memory a long-lived page leaks stays bounded
+BROWSER_MAX_RENDERS = int(os.getenv("BROWSER_MAX_RENDERS", "500"))
+CHROMIUM_FLAGS = [
+    "--headless", "--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu", "--hide-scrollbars",
+    "--mute-audio", "--no-first-run", "--no-default-browser-check", "--allow-file-access-from-files",
+]
+DEVTOOLS_URL_PATTERN = re.compile(r"DevTools listening on (ws://\S+)")
+
+
+class BrowserError(Exception):
+    pass
+
+
+class ChromiumBrowser:
+    def __init__(self, executable: str = CHROMIUM_PATH, timeout: float = BROWSER_RENDER_TIMEOUT):
+        """
+        A headless Chromium process driven over the DevTools protocol, with a single page
+        that is navigated to every slide in turn.
+
+        Not thread safe: ``BrowserPool`` hands a browser to one thread at a time.
+
+        :param executable: Path of the Chromium binary.
+        :param timeout: Seconds a start or a render may take before the browser is
+                        considered hung.
+        """
+        self.timeout = timeout
+        self.renders = 0
+        self._next_id = 0
+        self._events: List[dict] = []
+        self._viewport: Optional[Tuple[int, int]] = None
+        self._socket = None
+        self._profile_dir = tempfile.mkdtemp(prefix="chromium-")
+        self._process = subprocess.Popen(
+            [executable, *CHROMIUM_FLAGS, "--remote-debugging-port=0",
+             f"--user-data-dir={self._profile_dir}", "about:blank"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            self._socket = connect(self._devtools_url(), open_timeout=timeout, max_size=None)
+            target = self._send("Target.createTarget", {"url": "about:blank"})
+            self._session = self._send("Target.attachToTarget", {"targetId": target["targetId"], "flatten": True})["sessionId"]
+            self._send("Page.enable", session=True)
+        except Exception:
+            self.close()
+            raise
+        logger.info(f"Started headless Chromium (pid {self._process.pid})")
+
+    def _devtools_url(self) -> str:
+        for line in self._process.stderr:
+            match = DEVTOOLS_URL_PATTERN.search(line)
+            if match:
+                # Keep draining stderr, a full pipe would block the browser
+                threading.Thread(target=self._drain_stderr, daemon=True).start()
+                return match.group(1)
+        raise BrowserError(f"Chromium exited with code {self._process.wait()} before opening DevTools.")
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            logger.debug(f"chromium: {line.rstrip()}")
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def _receive(self, deadline: float) -> dict:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BrowserError("Timed out waiting for Chromium.")
+        try:
+            return json.loads(self._socket.recv(timeout=remaining))
+        except TimeoutError:
+            raise BrowserError("Timed out waiting for Chromium.")
+
+    def _send(self, method: str, params: Optional[dict] = None, session: bool = False,
+              deadline: Optional[float] = None) -> dict:
+        self._next_id += 1
+        message = {"id": self._next_id, "method": method, "params": params or {}}
+        if session:
+            message["sessionId"] = self._session
+        self._socket.send(json.dumps(message))
+
+        deadline = deadline or time.monotonic() + self.timeout
+        while True:
+            reply = self._receive(deadline)
+            if reply.get("id") != message["id"]:
+                if "method" in reply:
+                    self._events.append(reply)
+                continue
+            if "error" in reply:
+                raise BrowserError(f"{method} failed: {reply['error'].get('message')}")
+            return reply.get("result", {})
+
+    def _wait_event(self, method: str, deadline: float) -> dict:
+        while True:
+            for event in self._events:
+                if event["method"] == method and event.get("sessionId") == self._session:
+                    self._events.clear()
+                    return event
+            self._events.clear()
+            event = self._receive(deadline)
+            if "method" in event:
+                self._events.append(event)
+
+    def render(self, html: str, size: Tuple[int, int] = (1920, 1080), base_dir: Optional[str] = None) -> bytes:
+        """
+        Render an HTML document and return the screenshot of the viewport as PNG bytes.
+
+        :param html: The document to render.
+        :param size: Width and height of the viewport.
+        :param base_dir: Directory the document is loaded from, which relative URLs in it
+                         resolve against.
+        """
+        width, height = size
+        deadline = time.monotonic() + self.timeout
+        if self._viewport != size:
+            self._send("Emulation.setDeviceMetricsOverride",
+                       {"width": width, "height": height, "deviceScaleFactor": 1, "mobile": False},
+                       session=True, deadline=deadline)
+            self._viewport = size
+
+        # Loaded from a file rather than set as content, so file:// images in it are allowed
+        fd, html_path = tempfile.mkstemp(suffix=".html", dir=base_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(html)
+            self._events.clear()
+            result = self._send("Page.navigate", {"url": Path(html_path).resolve().as_uri()},
+                                session=True, deadline=deadline)
+            if result.get("errorText"):
+                raise BrowserError(f"Failed to load the slide: {result['errorText']}")
+            self._wait_event("Page.loadEventFired", deadline)
+            screenshot = self._send("Page.captureScreenshot", {
+                "format": "png",
+                "clip": {"x": 0, "y": 0, "width": width, "height": height, "scale": 1},
+            }, session=True, deadline=deadline)
+        finally:
+            os.remove(html_path)
+
+        self.renders += 1
+        return base64.b64decode(screenshot["data"])
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except Exception:
+                pass
+        if self.alive:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+        shutil.rmtree(self._profile_dir, ignore_errors=True)
+
+
+def png_to_rgb(png: bytes) -> np.ndarray:
+    """
+    Decode PNG bytes into an ``(height, width, 3)`` uint8 RGB array.
+    """
+    with Image.open(io.BytesIO(png)) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+class BrowserPool:
+    def __init__(self, size: int = BROWSER_POOL_SIZE, executable: str = CHROMIUM_PATH,
+                 max_renders: int = BROWSER_MAX_RENDERS):
+        """
+        A fixed number of warm headless browsers shared by every slide render of the
+        process, so a slide costs a page navigation instead of a browser start.
+
+        Browsers are started on first use and kept running. One that fails a render, dies
+        or reaches ``max_renders`` is closed and its slot is refilled by the next render.
+
+        :param size: Maximum number of browsers, i.e. of slides rendered at the same time.
+        """
+        self.size = max(1, size)
+        self.executable = executable
+        self.max_renders = max_renders
+        # Last in, first out: warm browsers are reused before an empty slot starts a new one
+        self._slots: "queue.LifoQueue[Optional[ChromiumBrowser]]" = queue.LifoQueue()
+        for _ in range(self.size):
+            self._slots.put(None)
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="slide-render")
+        self._closed = False
+
+    def _checkout(self) -> ChromiumBrowser:
+        browser = self._slots.get()
+        if browser is not None:
+            return browser
+        try:
+            return ChromiumBrowser(self.executable)
+        except Exception:
+            self._slots.put(None)
+            raise
+
+    def _checkin(self, browser: ChromiumBrowser, healthy: bool):
+        if healthy and not self._closed and browser.alive and browser.renders < self.max_renders:
+            self._slots.put(browser)
+            return
+        browser.close()
+        self._slots.put(None)
+
+    def warm(self, count: Optional[int] = None):
+        """
+        Start ``count`` browsers ahead of the first render, all of them by default.
+        """
+        browsers = []
+        try:
+            for _ in range(min(count or self.size, self.size)):
+                browsers.append(self._checkout())
+        finally:
+            # Also when starting one of them failed, so the others are not left checked out
+            for browser in browsers:
+                self._checkin(browser, True)
+
+    def render_png(self, html: str, size: Tuple[int, int] = (1920, 1080), base_dir: Optional[str] = None) -> bytes:
+        """
+        Render an HTML document to PNG bytes, see ``ChromiumBrowser.render``. A render that
+        fails because of the browser is retried once on a fresh one.
+        """
+        for attempt in range(2):
+            browser = self._checkout()
+            healthy = False
+            try:
+                png = browser.render(html, size, base_dir)
+                healthy = True
+                return png
+            except Exception as e:
+                browser_failed = isinstance(e, (BrowserError, OSError)) or not browser.alive
+                if attempt or not browser_failed:
+                    raise
+                logger.warning(f"Slide render failed, retrying on a new browser: {e}")
+            finally:
+                self._checkin(browser, healthy)
+
+    def render_rgb(self, html: str, size: Tuple[int, int] = (1920, 1080), base_dir: Optional[str] = None) -> np.ndarray:
+        """
+        Render an HTML document to an ``(height, width, 3)`` uint8 RGB array.
+        """
+        return png_to_rgb(self.render_png(html, size, base_dir))
+
+    def render_many(self, htmls: Sequence[str], size: Tuple[int, int] = (1920, 1080),
+                    base_dir: Optional[str] = None, rgb: bool = False) -> List:
+        """
+        Render several documents at once, on as many browsers as the pool holds.
+
+        :param rgb: Return RGB arrays instead of PNG bytes.
+        :return: PNG bytes or RGB arrays in the order of ``htmls``.
+        """
+        render = self.render_rgb if rgb else self.render_png
+        return list(self._executor.map(lambda html: render(html, size, base_dir), htmls))
+
+    def close(self):
+        self._closed = True
+        self._executor.shutdown(wait=False)
+        while True:
+            try:
+                browser = self._slots.get_nowait()
+            except queue.Empty:
+                break
+            if browser is not None:
+                browser.close()
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+        return _pool
+
+
+@atexit.register
+def close_browser_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from tts_service import TTS_MODEL_CHARACTER
+
+logger = logging.getLogger(__name__)
+
+DECKS_DIR = os.getenv("DECKS_DIR", "decks")
+TEMPLATES_DIR = "templates"
+MANIFEST_FILE = "manifest.json"
+ASSETS_DIR = "assets"
+
+IMAGE = "image"
+AUDIO = "audio"
+DEEPFAKE = "deepfake"
+RENDER = "slide"
+SEGMENT = "segment"
+
+_template_digests: Dict[tuple, str] = {}
+_deck_locks: Dict[str, asyncio.Lock] = {}
+
+
+def content_hash(payload) -> str:
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def template_digest(template_name: str) -> str:
+    """
+    SHA-256 of a slide template, memoised on its size and modification time, so editing a
+    template re-renders the slides that use it.
+    """
+    path = os.path.join(TEMPLATES_DIR, template_name)
+    stat = os.stat(path)
+    signature = (path, stat.st_size, stat.st_mtime)
+    digest = _template_digests.get(signature)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _template_digests[signature] = digest
+    return digest
+
+
+def is_main_slide(slide: dict) -> bool:
+    """
+    Whether a slide is laid out as a main slide, with an image: every slide that is not the
+    introduction or the conclusion, including one whose ``type`` is missing or unknown.
+    """
+    return slide.get("type") not in ("introduction", "conclusion")
+
+
+def slide_template(slide: dict, main_template: Optional[str]) -> str:
+    if slide.get("type") == "introduction":
+        return "intro.html"
+    if slide.get("type") == "conclusion":
+        return "conclusion.html"
+    return main_template
+
+
+def slide_keys(slide: dict, character: str, template_name: str, segment_settings: dict) -> Dict[str, Optional[str]]:
+    """
+    Content hash of the inputs of every asset of a slide. Each key includes the keys of the
+    assets it is built from, so a change propagates to everything downstream of it and
+    nothing else: a new script re-synthesises the audio, the deepfake and the segment, but
+    reuses the image and the rendered slide.
+    """
+    is_main = is_main_slide(slide)
+    image_key = content_hash({
+        "title": slide.get("title", ""),
+        "image_prompt": slide.get("image_prompt"),
+    }) if is_main else None
+
+    script = slide.get("script")
+    audio_key = content_hash({"script": script, "voice": TTS_MODEL_CHARACTER}) if script else None
+    deepfake_key = content_hash({"audio": audio_key, "character": character}) if script else None
+
+    render_key = content_hash({
+        "type": slide.get("type"),
+        "title": slide.get("title", ""),
+        "subtitle": slide.get("subtitle", ""),
+        "bullet_points": slide.get("bullet_points"),
+        "template": template_name,
+        "template_digest": template_digest(template_name),
+        "image": image_key,
+    })
+    segment_key = content_hash({"slide": render_key, "deepfake": deepfake_key, "settings": segment_settings})
+
+    return {IMAGE: image_key, AUDIO: audio_key, DEEPFAKE: deepfake_key, RENDER: render_key, SEGMENT: segment_key}
+
+
+@dataclass
+class SlideRecord:
+    content: dict
+    template: str
+    keys: Dict[str, Optional[str]]
+    assets: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class DeckManifest:
+    """
+    Record of a generated deck: every slide's content, the content hash of the inputs of
+    each of its assets, and the stored assets themselves.
+
+    Assets are kept in the deck's ``assets`` directory under ``<kind>-<key>`` names, so a
+    rebuild finds the ones whose inputs did not change by key alone, including the
+    encoded video segment of every slide.
+    """
+    character: str
+    deck_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    slides: List[SlideRecord] = field(default_factory=list)
+    video: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: Optional[float] = None
+    reused: int = 0
+    built: int = 0
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(DECKS_DIR, self.deck_id)
+
+    @property
+    def assets_dir(self) -> str:
+        return os.path.join(self.directory, ASSETS_DIR)
+
+    def plan_slide(self, idx: int, slide: dict, template_name: str, segment_settings: dict) -> SlideRecord:
+        """
+        Compute the keys of the slide at ``idx`` and make it the deck's slide at that index.
+        """
+        record = SlideRecord(
+            content=slide,
+            template=template_name,
+            keys=slide_keys(slide, self.character, template_name, segment_settings),
+        )
+        if idx < len(self.slides):
+            self.slides[idx] = record
+        else:
+            self.slides.append(record)
+        return record
+
+    def _asset_path(self, kind: str, key: str, extension: str) -> str:
+        return os.path.join(self.assets_dir, f"{kind}-{key}{extension}")
+
+    def asset(self, kind: str, key: Optional[str]) -> Optional[str]:
+        """
+        Absolute path of the stored asset of this kind and key, or None if it must be built.
+        """
+        if not key or not os.path.isdir(self.assets_dir):
+            return None
+        prefix = f"{kind}-{key}"
+        for name in os.listdir(self.assets_dir):
+            if os.path.splitext(name)[0] == prefix:
+                return os.path.abspath(os.path.join(self.assets_dir, name))
+        return None
+
+    def store(self, kind: str, key: str, path: str) -> str:
+        """
+        Copy a freshly built asset into the deck and return its stored path.
+        """
+        os.makedirs(self.assets_dir, exist_ok=True)
+        stored_path = self._asset_path(kind, key, os.path.splitext(path)[1])
+        tmp_path = f"{stored_path}.tmp-{uuid.uuid4().hex}"
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, stored_path)
+        return os.path.abspath(stored_path)
+
+    def finish(self, slide_count: int, video_path: str):
+        """
+        Move the built video into the deck, drop the slides past ``slide_count`` and the
+        assets no slide refers to any more, then save the manifest.
+        """
+        del self.slides[slide_count:]
+        os.makedirs(self.directory, exist_ok=True)
+        self.video = os.path.abspath(os.path.join(self.directory, "presentation.mp4"))
+        shutil.move(video_path, self.video)
+        self.updated_at = time.time()
+
+        referenced = {
+            f"{kind}-{key}" for record in self.slides for kind, key in record.keys.items() if key
+        }
+        if os.path.isdir(self.assets_dir):
+            for name in os.listdir(self.assets_dir):
+                if os.path.splitext(name)[0] not in referenced:
+                    os.remove(os.path.join(self.assets_dir, name))
+        self.save()
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, deck_id: str) -> Optional["DeckManifest"]:
+        path = os.path.join(DECKS_DIR, os.path.basename(deck_id), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data["slides"] = [SlideRecord(**record) for record in data.get("slides", [])]
+        return cls(**data)
+
+
+def deck_lock(deck_id: str) -> asyncio.Lock:
+    """
+    Lock serialising the builds of a deck, so two updates never write its assets at once.
+    """
+    lock = _deck_locks.get(deck_id)
+    if lock is None:
+        lock = _deck_locks[deck_id] = asyncio.Lock()
+    return lock
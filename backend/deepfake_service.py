@@ -1,76 +1,281 @@
-import requests
+import aiofiles
+import asyncio
+import hashlib
+import httpx
 from pathlib import Path
-from typing import List
+from typing import AsyncIterator, List, Optional, Set, Tuple
 import logging
+import os
 import time
 
+from http_clients import DEEPFAKE, get_client
+from multipart_stream import MultipartStreamParser, boundary_from_content_type
+
 DEEPFAKE_SERVICE_URL = "http://37.189.137.45:7000"
+DEEPFAKE_BATCH = os.getenv("DEEPFAKE_BATCH", "true").lower() in ("1", "true", "yes")
+# Seconds a batch waits for more slides' audio after the first one is ready
+DEEPFAKE_BATCH_WINDOW = float(os.getenv("DEEPFAKE_BATCH_WINDOW", "5"))
+# Ask the service to pipe the video into the response while it is being encoded
+DEEPFAKE_STREAMING = os.getenv("DEEPFAKE_STREAMING", "true").lower() in ("1", "true", "yes")
+DEEPFAKE_READ_SIZE = 1024 * 1024
+# Ask the service for an already generated clip of the same audio before uploading it
+DEEPFAKE_CLIP_LOOKUP = os.getenv("DEEPFAKE_CLIP_LOOKUP", "true").lower() in ("1", "true", "yes")
+VIDEOS_DIR = "videos"
 
 logging.basicConfig(level=logging.DEBUG)
 
-async def generate_deepfake_videos(character: str, audio_file_paths: List[str]) -> List[str]:
+async def generate_deepfake_videos(character: str, audio_file_paths: List[str], output_dir: str = VIDEOS_DIR) -> List[str]:
     generated_video_paths = []
-    generate_deepfake_url = f"{DEEPFAKE_SERVICE_URL}/generate-deepfake"
 
     logging.info(f"Starting deepfake video generation for character: {character}")
+
+    batch_video_paths: List[Optional[str]] = [None] * len(audio_file_paths)
+    if DEEPFAKE_BATCH and len(audio_file_paths) > 1:
+        try:
+            async for position, video_path in stream_deepfake_batch(character, audio_file_paths, output_dir):
+                batch_video_paths[position] = video_path
+        except Exception as e:
+            logging.error(f"Deepfake batch failed, falling back to one request per audio file: {e}")
+
+    for audio_file_path, video_path in zip(audio_file_paths, batch_video_paths):
+        if video_path is None:
+            video_path = await generate_deepfake_video(character, audio_file_path, output_dir)
+        if video_path:
+            generated_video_paths.append(video_path)
+
+    logging.info(f"Deepfake video generation completed. Total videos generated: {len(generated_video_paths)}")
+    logging.debug(f"Generated video paths: {generated_video_paths}")
+
+    return generated_video_paths
+
+async def generate_deepfake_video(character: str, audio_file_path: str, output_dir: str = VIDEOS_DIR) -> Optional[str]:
+    """
+    Lip-sync a single audio file onto the character video.
+
+    :param character: Name of the character video on the deepfake service.
+    :param audio_file_path: Path of the audio file to lip-sync.
+    :param output_dir: Directory where the video is written.
+    :return: Path of the saved video, or None if the deepfake could not be generated.
+    """
+    generate_deepfake_url = f"{DEEPFAKE_SERVICE_URL}/generate-deepfake"
     logging.debug(f"Deepfake Service URL: {generate_deepfake_url}")
-    
-    output_directory = Path("videos")
+
+    output_directory = Path(output_dir)
     output_directory.mkdir(parents=True, exist_ok=True)
     logging.info(f"Output directory created or already exists: {output_directory.resolve()}")
 
-    for audio_file_path in audio_file_paths:
-        logging.debug(f"Processing audio file: {audio_file_path}")
+    logging.debug(f"Processing audio file: {audio_file_path}")
+    audio_filename = Path(audio_file_path).name
+    output_video_filename = output_directory / f"deepfake_{character}_{audio_filename}.mp4"
+
+    logging.info(f"Target output video file: {output_video_filename.resolve()}")
+
+    if not Path(audio_file_path).exists():
+        logging.error(f"Audio file does not exist: {audio_file_path}")
+        return None
+
+    try:
+        async with aiofiles.open(audio_file_path, 'rb') as audio_file:
+            audio_content = await audio_file.read()
+
+        if DEEPFAKE_CLIP_LOOKUP and await fetch_cached_deepfake(character, audio_content, output_video_filename):
+            return str(output_video_filename)
+
+        files = {'audio': (audio_filename, audio_content, 'audio/wav')}
+        data = {'character': character}
+        if DEEPFAKE_STREAMING:
+            data['stream'] = 'true'
+
+        logging.info(f"Sending request to deepfake service for audio file: {audio_filename}")
+        start_time = time.time()
+        client = get_client(DEEPFAKE)
+        async with client.stream("POST", generate_deepfake_url, data=data, files=files) as response:
+            end_time = time.time()
+
+            logging.debug(f"Request duration: {end_time - start_time:.2f} seconds")
+            logging.debug(f"HTTP Response Status Code: {response.status_code}")
+            if response.status_code == 200:
+                logging.info(f"Response received successfully for: {audio_filename}")
+                logging.debug(f"Response Headers: {response.headers}")
+
+                logging.info(f"Saving deepfake video to: {output_video_filename.resolve()}")
+                async with aiofiles.open(output_video_filename, 'wb') as f:
+                    async for chunk in response.aiter_bytes(chunk_size=DEEPFAKE_READ_SIZE):
+                        if chunk:
+                            await f.write(chunk)
+
+                logging.info(f"Deepfake video saved: {output_video_filename.resolve()}")
+                return str(output_video_filename)
+            else:
+                await response.aread()
+                logging.error(f"Failed to generate deepfake for {audio_filename}")
+                logging.error(f"Response Text: {response.text}")
+
+    except httpx.ConnectError as e:
+        logging.error(f"Connection error while accessing the deepfake service: {e}")
+    except httpx.TimeoutException as e:
+        logging.error(f"Request timed out for audio file {audio_filename}: {e}")
+    except httpx.HTTPError as e:
+        logging.error(f"An HTTP request error occurred for {audio_filename}: {e}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while processing {audio_filename}: {e}")
+
+    # A stream the service aborted midway leaves a truncated video behind
+    output_video_filename.unlink(missing_ok=True)
+    return None
+
+async def fetch_cached_deepfake(character: str, audio_content: bytes, output_video_filename: Path) -> bool:
+    """
+    Download the clip from the deepfake service's clip cache if it already lip-synced this
+    audio onto the character, which skips both the upload and the inference.
+
+    :return: True if the cached clip was saved to ``output_video_filename``.
+    """
+    audio_sha256 = hashlib.sha256(audio_content).hexdigest()
+    clip_url = f"{DEEPFAKE_SERVICE_URL}/clips/{character}/{audio_sha256}"
+    try:
+        client = get_client(DEEPFAKE)
+        async with client.stream("GET", clip_url) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return False
+            async with aiofiles.open(output_video_filename, 'wb') as f:
+                async for chunk in response.aiter_bytes(chunk_size=DEEPFAKE_READ_SIZE):
+                    await f.write(chunk)
+    except httpx.HTTPError as e:
+        logging.warning(f"Clip cache lookup failed, uploading the audio instead: {e}")
+        return False
+
+    logging.info(f"Deepfake video served from the clip cache: {output_video_filename.resolve()}")
+    return True
+
+
+async def stream_deepfake_batch(character: str, audio_file_paths: List[str],
+                                output_dir: str = VIDEOS_DIR) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Lip-sync several audio files onto the character with a single request to the batch
+    endpoint, which runs them through the model together. Clips the service already has
+    in its clip cache are downloaded on their own and their audio is not uploaded.
+
+    :return: Async iterator of ``(position in audio_file_paths, video path)`` as the videos arrive.
+    :raises RuntimeError: If the service rejects the batch or the response is cut short.
+    """
+    generate_batch_url = f"{DEEPFAKE_SERVICE_URL}/generate-deepfake-batch"
+    output_directory = Path(output_dir)
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    files = []
+    uploaded_positions = []
+    for position, audio_file_path in enumerate(audio_file_paths):
         audio_filename = Path(audio_file_path).name
+        async with aiofiles.open(audio_file_path, 'rb') as audio_file:
+            audio_content = await audio_file.read()
+
         output_video_filename = output_directory / f"deepfake_{character}_{audio_filename}.mp4"
+        if DEEPFAKE_CLIP_LOOKUP and await fetch_cached_deepfake(character, audio_content, output_video_filename):
+            yield position, str(output_video_filename)
+            continue
+        files.append(('audio', (audio_filename, audio_content, 'audio/wav')))
+        uploaded_positions.append(position)
 
-        logging.info(f"Target output video file: {output_video_filename.resolve()}")
+    if not files:
+        return
 
-        if not Path(audio_file_path).exists():
-            logging.error(f"Audio file does not exist: {audio_file_path}")
-            continue
+    logging.info(f"Sending {len(files)} audio files to the deepfake service in one batch")
+    start_time = time.time()
+    client = get_client(DEEPFAKE)
+    async with client.stream("POST", generate_batch_url, data={'character': character}, files=files) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise RuntimeError(f"Deepfake batch failed with status {response.status_code}: {response.text}")
+        parser = MultipartStreamParser(boundary_from_content_type(response.headers["content-type"]))
 
+        async for chunk in response.aiter_bytes(chunk_size=DEEPFAKE_READ_SIZE):
+            for headers, body in parser.feed(chunk):
+                position = uploaded_positions[int(headers["x-audio-index"])]
+                audio_filename = Path(audio_file_paths[position]).name
+                output_video_filename = output_directory / f"deepfake_{character}_{audio_filename}.mp4"
+                async with aiofiles.open(output_video_filename, 'wb') as f:
+                    await f.write(body)
+                logging.info(f"Deepfake video saved: {output_video_filename.resolve()}")
+                yield position, str(output_video_filename)
+
+    if not parser.done:
+        raise RuntimeError("Deepfake batch response ended before all videos were received.")
+    logging.debug(f"Batch request duration: {time.time() - start_time:.2f} seconds")
+
+
+class DeepfakeBatch:
+    def __init__(self, character: str, expected: int, window: float = DEEPFAKE_BATCH_WINDOW,
+                 output_dir: str = VIDEOS_DIR):
+        """
+        Groups the per-slide deepfake tasks of a presentation into batch requests.
+
+        Every slide hands in its audio as soon as its speech is ready. A batch is sent once
+        all ``expected`` slides have done so, or ``window`` seconds after the first slide of
+        the batch, so one slow or failed audio does not hold back the others. Slides whose
+        batch fails fall back to one request each.
+
+        :param character: Character used for the deepfake videos.
+        :param expected: Number of slides that will ask for a video.
+        :param output_dir: Directory where the videos are written.
+        """
+        self.character = character
+        self.output_dir = output_dir
+        self.window = window
+        self._remaining = expected
+        self._waiting: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, audio_file_path: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.append((audio_file_path, future))
+        if len(self._waiting) >= self._remaining:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._waiting = self._waiting, []
+        if not batch:
+            return
+        self._remaining -= len(batch)
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in list(self._tasks):
+            task.cancel()
+        for _, future in self._waiting:
+            future.cancel()
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
         try:
-            with open(audio_file_path, 'rb') as audio_file:
-                files = {'audio': (audio_filename, audio_file, 'audio/wav')}
-                data = {'character': character}
-
-                logging.info(f"Sending request to deepfake service for audio file: {audio_filename}")
-                start_time = time.time()
-                response = requests.post(generate_deepfake_url, data=data, files=files, stream=True)
-                end_time = time.time()
-
-                logging.debug(f"Request duration: {end_time - start_time:.2f} seconds")
-                logging.debug(f"HTTP Response Status Code: {response.status_code}")
-                if response.status_code == 200:
-                    logging.info(f"Response received successfully for: {audio_filename}")
-                    logging.debug(f"Response Headers: {response.headers}")
-
-                    logging.info(f"Saving deepfake video to: {output_video_filename.resolve()}")
-                    with open(output_video_filename, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-
-                    logging.info(f"Deepfake video saved: {output_video_filename.resolve()}")
-                    generated_video_paths.append(str(output_video_filename))
-                else:
-                    logging.error(f"Failed to generate deepfake for {audio_filename}")
-                    logging.error(f"Response Text: {response.text}")
-
-        except requests.exceptions.ConnectionError as e:
-            logging.error(f"Connection error while accessing the deepfake service: {e}")
-        except requests.exceptions.Timeout as e:
-            logging.error(f"Request timed out for audio file {audio_filename}: {e}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"An HTTP request error occurred for {audio_filename}: {e}")
-        except Exception as e:
-            logging.error(f"An unexpected error occurred while processing {audio_filename}: {e}")
+            if len(batch) > 1:
+                try:
+                    async for position, video_path in stream_deepfake_batch(self.character, [path for path, _ in batch], self.output_dir):
+                        batch[position][1].set_result(video_path)
+                except Exception as e:
+                    logging.error(f"Deepfake batch failed, falling back to one request per slide: {e}")
 
-    logging.info(f"Deepfake video generation completed. Total videos generated: {len(generated_video_paths)}")
-    logging.debug(f"Generated video paths: {generated_video_paths}")
+            for audio_file_path, future in batch:
+                if not future.done():
+                    future.set_result(await generate_deepfake_video(self.character, audio_file_path, self.output_dir))
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Deepfake batch was cancelled."))
 
-    return generated_video_paths
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,106 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+LLM = "llm"
+STABLE_DIFFUSION = "stable_diffusion"
+TTS = "tts"
+DEEPFAKE = "deepfake"
+
+
+@dataclass
+class ServiceClientConfig:
+    max_connections: int
+    max_keepalive_connections: int
+    read_timeout: Optional[float]
+    connect_timeout: float = 10.0
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+
+    @classmethod
+    def from_env(cls, name: str, default: "ServiceClientConfig") -> "ServiceClientConfig":
+        """
+        Override the defaults of a service with ``<NAME>_HTTP_*`` environment variables,
+        e.g. ``LLM_HTTP_MAX_CONNECTIONS=20`` or ``DEEPFAKE_HTTP_READ_TIMEOUT=900``.
+        """
+        prefix = f"{name.upper()}_HTTP_"
+        read_timeout = os.getenv(prefix + "READ_TIMEOUT")
+        return cls(
+            max_connections=int(os.getenv(prefix + "MAX_CONNECTIONS", default.max_connections)),
+            max_keepalive_connections=int(os.getenv(prefix + "MAX_KEEPALIVE", default.max_keepalive_connections)),
+            read_timeout=float(read_timeout) if read_timeout else default.read_timeout,
+            connect_timeout=float(os.getenv(prefix + "CONNECT_TIMEOUT", default.connect_timeout)),
+            keepalive_expiry=float(os.getenv(prefix + "KEEPALIVE_EXPIRY", default.keepalive_expiry)),
+            http2=os.getenv(prefix + "HTTP2", str(default.http2)).lower() in ("1", "true", "yes"),
+        )
+
+
+# The upstreams are served by uvicorn and gunicorn, which only speak HTTP/1.1, so HTTP/2
+# is off by default and can be switched on per service once an upstream supports it.
+DEFAULT_SERVICE_CONFIGS = {
+    LLM: ServiceClientConfig(max_connections=16, max_keepalive_connections=8, read_timeout=300.0),
+    STABLE_DIFFUSION: ServiceClientConfig(max_connections=16, max_keepalive_connections=8, read_timeout=120.0),
+    TTS: ServiceClientConfig(max_connections=16, max_keepalive_connections=8, read_timeout=120.0),
+    DEEPFAKE: ServiceClientConfig(max_connections=4, max_keepalive_connections=4, read_timeout=900.0),
+}
+
+
+class ClientRegistry:
+    def __init__(self, configs: Dict[str, ServiceClientConfig]):
+        """
+        Holds one pooled ``httpx.AsyncClient`` per upstream service so that every call
+        reuses keep-alive connections instead of opening a new TCP connection.
+
+        :param configs: Pool and timeout settings keyed by service name.
+        """
+        self.configs = configs
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create_client(self, name: str) -> httpx.AsyncClient:
+        config = ServiceClientConfig.from_env(name, self.configs[name])
+        logger.info(
+            f"Creating HTTP client for {name}: {config.max_connections} connections, "
+            f"read timeout {config.read_timeout}s, http2={config.http2}"
+        )
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+            http2=config.http2,
+        )
+
+    def start(self):
+        for name in self.configs:
+            self.get(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """
+        Return the client of a service, creating it on first use so that the service
+        modules also work outside the FastAPI lifespan (e.g. their ``__main__`` blocks).
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create_client(name)
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        for name, client in self._clients.items():
+            await client.aclose()
+            logger.info(f"Closed HTTP client for {name}")
+        self._clients = {}
+
+
+registry = ClientRegistry(DEFAULT_SERVICE_CONFIGS)
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    return registry.get(name)
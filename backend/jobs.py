@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from llm_service import LLM_STREAMING, generate_presentation_content, stream_presentation_content
+from pipeline import NODE_DONE, NODE_FAILED, NODE_PENDING, NODE_RUNNING, PresentationPipeline
+from storage import get_storage_service
+from workspace import Workspace
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "10"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "100"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+CONTENT_STAGE = "content"
+UPLOAD_STAGE = "upload"
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+@dataclass
+class PresentationJob:
+    text_content: str
+    duration: int
+    detail_level: str
+    character: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = JOB_QUEUED
+    stages: Dict[str, str] = field(default_factory=dict)
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def progress(self) -> float:
+        if self.status == JOB_COMPLETED:
+            return 1.0
+        if not self.stages:
+            return 0.0
+        done = sum(1 for status in self.stages.values() if status == NODE_DONE)
+        return round(done / len(self.stages), 3)
+
+    def set_stage(self, name: str, status: str):
+        self.stages[name] = status
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE,
+                 history_size: int = JOB_HISTORY_SIZE):
+        """
+        Runs presentation jobs in the background with a bounded queue.
+
+        :param workers: Number of presentations generated at the same time.
+        :param queue_size: Maximum number of jobs waiting for a worker; submissions beyond
+                           this are rejected instead of piling up on the host.
+        :param history_size: Number of jobs kept in memory for status polling.
+        """
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.jobs: "OrderedDict[str, PresentationJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker(idx)) for idx in range(self.workers)]
+        logger.info(f"Started {self.workers} presentation job workers (queue size {self.queue_size})")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, text_content: str, duration: int, detail_level: str, character: str) -> PresentationJob:
+        if self._queue is None:
+            raise RuntimeError("Job manager has not been started.")
+
+        job = PresentationJob(text_content, duration, detail_level, character)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(f"Job queue is full ({self.queue_size} jobs waiting).")
+
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history_size:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status in (JOB_QUEUED, JOB_RUNNING):
+                break
+            self.jobs.pop(oldest_id)
+
+        logger.info(f"Queued presentation job {job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[PresentationJob]:
+        return self.jobs.get(job_id)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self, worker_idx: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run_job(job)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    async def _stream_slides(job: PresentationJob):
+        async for slide in stream_presentation_content(job.text_content, job.duration, job.detail_level, job.character):
+            yield slide
+        job.set_stage(CONTENT_STAGE, NODE_DONE)
+
+    async def _run_job(self, job: PresentationJob):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.set_stage(CONTENT_STAGE, NODE_RUNNING)
+        logger.info(f"Running presentation job {job.id}")
+
+        workspace = Workspace(job.id)
+        try:
+            output_dir = workspace.path
+            job.set_stage(UPLOAD_STAGE, NODE_PENDING)
+            if LLM_STREAMING:
+                pipeline = PresentationPipeline(None, job.character, output_dir, on_event=job.set_stage)
+                final_video_path = await pipeline.run_streaming(self._stream_slides(job))
+            else:
+                presentation_content = await generate_presentation_content(
+                    job.text_content, job.duration, job.detail_level, job.character
+                )
+                presentation_content = json.loads(presentation_content)
+                job.set_stage(CONTENT_STAGE, NODE_DONE)
+
+                pipeline = PresentationPipeline(presentation_content, job.character, output_dir, on_event=job.set_stage)
+                final_video_path = await pipeline.run()
+
+            job.set_stage(UPLOAD_STAGE, NODE_RUNNING)
+            storage_service = get_storage_service()
+            job.video_url = await asyncio.to_thread(
+                storage_service.upload_video, final_video_path, f"{job.id}.mp4"
+            )
+            job.set_stage(UPLOAD_STAGE, NODE_DONE)
+            job.status = JOB_COMPLETED
+            logger.info(f"Presentation job {job.id} completed: {job.video_url}")
+        except Exception as e:
+            logger.exception(f"Presentation job {job.id} failed.")
+            for name, status in job.stages.items():
+                if status == NODE_RUNNING:
+                    job.stages[name] = NODE_FAILED
+            job.status = JOB_FAILED
+            job.error = str(e)
+        finally:
+            workspace.cleanup()
+            job.finished_at = time.time()
+
+
+job_manager = JobManager()
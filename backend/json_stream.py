@@ -0,0 +1,86 @@
+import json
+import re
+from typing import List
+
+SLIDES_ARRAY_PATTERN = re.compile(r'"slides"\s*:\s*\[')
+
+
+class SlideStreamParser:
+    def __init__(self):
+        """
+        Incremental parser for the presentation JSON produced by the LLM.
+
+        Text is fed as it streams in, and every object of the top-level ``slides`` array is
+        returned as soon as its closing brace arrives, without waiting for the rest of the
+        document. Anything before the array (prose, code fences, the ``parameters`` object)
+        is skipped.
+        """
+        self._buffer = ""
+        self._pos = 0
+        self._array_found = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+        self.slides: List[dict] = []
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: str) -> List[dict]:
+        """
+        Add a chunk of text and return the slides completed by it.
+        """
+        self._buffer += chunk
+        completed = []
+
+        if not self._array_found:
+            match = SLIDES_ARRAY_PATTERN.search(self._buffer)
+            if not match:
+                return completed
+            self._array_found = True
+            self._pos = match.end()
+
+        buffer = self._buffer
+        while self._pos < len(buffer) and not self._done:
+            char = buffer[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0 and char == "{":
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0 and char == "]":
+                    self._done = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and char == "}":
+                        slide = self._parse_slide(buffer[self._object_start:self._pos + 1])
+                        self.slides.append(slide)
+                        completed.append(slide)
+                        self._object_start = None
+
+            self._pos += 1
+
+        return completed
+
+    def _parse_slide(self, raw: str) -> dict:
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Slide {len(self.slides)} is not valid JSON: {e}") from e
@@ -1,10 +1,22 @@
 import json
 import logging
-from typing import Dict
+import os
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional
 
 import httpx
 
+from http_clients import LLM, get_client
+from json_stream import SlideStreamParser
+
 LLM_SERVICE_URL = "http://llama_container:9000/chat"
+LLM_STREAM_URL = "http://llama_container:9000/chat/stream"
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").lower() in ("1", "true", "yes")
+PRESENTATION_TEMPLATE_PATH = "prompts/presentation_content.prompt"
+STABLE_DIFFUSION_TEMPLATE_PATH = "prompts/stable_diffusion_prompt_builder.prompt"
+STABLE_DIFFUSION_BATCH_TEMPLATE_PATH = "prompts/stable_diffusion_batch_prompt_builder.prompt"
+STABLE_DIFFUSION_BATCH_RETRIES = int(os.getenv("STABLE_DIFFUSION_BATCH_RETRIES", "2"))
+STABLE_DIFFUSION_TOKENS_PER_PROMPT = int(os.getenv("STABLE_DIFFUSION_TOKENS_PER_PROMPT", "250"))
 
 # Configure logging
 logging.basicConfig(
@@ -19,34 +31,59 @@ logging.basicConfig(
 async def generate_presentation_content(topic: str, duration: int, detail_level: str, impersonation: str) -> str:
     payload = {
         "input_text": _build_presentation_text_prompt_from_template(topic, duration, detail_level, impersonation),
-        "duration": duration
+        "duration_minutes": duration
     }
     logging.debug("Sending payload to LLM service for presentation content: %s", payload)
-    async with httpx.AsyncClient(timeout=None) as client:
-        try:
-            response = await client.post(LLM_SERVICE_URL, json=payload)
-            response.raise_for_status()
-            logging.info("Received response from LLM service for presentation content")
-            return response.json()["response_text"]
-        except httpx.HTTPError as e:
-            logging.error("HTTP error occurred while calling LLM service: %s", e)
-            raise
-        except Exception as e:
-            logging.error("Unexpected error occurred: %s", e)
-            raise
-
-def _build_presentation_text_prompt_from_template(topic, duration, detail_level, impersonation):
+    client = get_client(LLM)
     try:
-        with open("prompts/presentation_content.prompt", 'r', encoding='utf-8') as file:
-            template_content = file.read()
-            logging.info("Successfully read presentation template")
-    except FileNotFoundError:
-        logging.error("Template file not found at: prompts/presentation_content.prompt")
-        raise FileNotFoundError("Template file not found at: prompts/presentation_content.prompt")
+        response = await client.post(LLM_SERVICE_URL, json=payload)
+        response.raise_for_status()
+        logging.info("Received response from LLM service for presentation content")
+        return response.json()["response_text"]
+    except httpx.HTTPError as e:
+        logging.error("HTTP error occurred while calling LLM service: %s", e)
+        raise
     except Exception as e:
-        logging.error("An error occurred while reading the template file: %s", e)
+        logging.error("Unexpected error occurred: %s", e)
         raise
 
+async def stream_presentation_content(topic: str, duration: int, detail_level: str,
+                                      impersonation: str) -> AsyncIterator[dict]:
+    """
+    Stream the presentation from the LLM service and yield every slide as soon as its
+    JSON object is complete, while the model is still writing the following slides.
+    """
+    payload = {
+        "input_text": _build_presentation_text_prompt_from_template(topic, duration, detail_level, impersonation),
+        "duration_minutes": duration
+    }
+    logging.debug("Streaming payload to LLM service for presentation content: %s", payload)
+    parser = SlideStreamParser()
+    client = get_client(LLM)
+    try:
+        async with client.stream("POST", LLM_STREAM_URL, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["type"] == "delta":
+                    for slide in parser.feed(event["text"]):
+                        yield slide
+                elif event["type"] == "error":
+                    raise RuntimeError(f"LLM stream failed: {event.get('detail')}")
+                elif event["type"] == "done":
+                    logging.info("LLM stream finished: %s, usage %s", event.get("stop_reason"), event.get("usage"))
+    except httpx.HTTPError as e:
+        logging.error("HTTP error occurred while streaming from LLM service: %s", e)
+        raise
+
+    if not parser.done:
+        logging.warning("LLM stream ended before the slides array was closed")
+
+def _build_presentation_text_prompt_from_template(topic, duration, detail_level, impersonation):
+    template_content = _read_template(PRESENTATION_TEMPLATE_PATH)
+
     placeholders = {
         '[Your Topic]': topic,
         '[Desired Duration]': str(duration),
@@ -63,38 +100,30 @@ def _build_presentation_text_prompt_from_template(topic, duration, detail_level,
 async def generate_stable_diffusion_prompt(title: str):
     payload = {
         "input_text": _build_stable_diffusion_prompt_from_template(title),
+        "max_tokens": STABLE_DIFFUSION_TOKENS_PER_PROMPT,
     }
     logging.debug("Sending payload to LLM service for stable diffusion prompt: %s", payload)
-    async with httpx.AsyncClient(timeout=None) as client:
-        try:
-            response = await client.post(LLM_SERVICE_URL, json=payload)
-            response.raise_for_status()
-            logging.info("Received response from LLM service for stable diffusion prompt")
-            text = response.json()["response_text"]
-            dictionary = json.loads(text)
-            return {
-                "prompt": dictionary["prompt"],
-                "negative_prompt": dictionary["negative_prompt"]
-            }
-        except httpx.HTTPError as e:
-            logging.error("HTTP error occurred while calling LLM service: %s", e)
-            raise
-        except Exception as e:
-            logging.error("Unexpected error occurred: %s", e)
-            raise
-
-def _build_stable_diffusion_prompt_from_template(title):
+    client = get_client(LLM)
     try:
-        with open("prompts/stable_diffusion_prompt_builder.prompt", 'r', encoding='utf-8') as file:
-            template_content = file.read()
-            logging.info("Successfully read stable diffusion template")
-    except FileNotFoundError:
-        logging.error("Template file not found at: prompts/stable_diffusion_prompt_builder.prompt")
-        raise FileNotFoundError("Template file not found at: prompts/stable_diffusion_prompt_builder.prompt")
+        response = await client.post(LLM_SERVICE_URL, json=payload)
+        response.raise_for_status()
+        logging.info("Received response from LLM service for stable diffusion prompt")
+        text = response.json()["response_text"]
+        dictionary = json.loads(text)
+        return {
+            "prompt": dictionary["prompt"],
+            "negative_prompt": dictionary["negative_prompt"]
+        }
+    except httpx.HTTPError as e:
+        logging.error("HTTP error occurred while calling LLM service: %s", e)
+        raise
     except Exception as e:
-        logging.error("An error occurred while reading the template file: %s", e)
+        logging.error("Unexpected error occurred: %s", e)
         raise
 
+def _build_stable_diffusion_prompt_from_template(title):
+    template_content = _read_template(STABLE_DIFFUSION_TEMPLATE_PATH)
+
     placeholders = {
         '[Slide Title]': title
     }
@@ -105,6 +134,102 @@ def _build_stable_diffusion_prompt_from_template(title):
     logging.debug("Built stable diffusion prompt: %s", template_content)
     return template_content
 
+async def generate_stable_diffusion_prompts(titles: List[str],
+                                            max_retries: int = STABLE_DIFFUSION_BATCH_RETRIES) -> List[Optional[Dict[str, str]]]:
+    """
+    Generate the stable diffusion prompts of every slide title with a single LLM call.
+
+    The LLM answers with a JSON array of {prompt, negative_prompt} objects in the order of
+    the titles. Items that are missing or malformed are requested again in a smaller batch
+    containing only those titles, up to ``max_retries`` times.
+
+    :return: One prompt dictionary per title, or None for titles that never got a valid answer.
+    """
+    prompts: List[Optional[Dict[str, str]]] = [None] * len(titles)
+    pending = list(range(len(titles)))
+
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt:
+            logging.warning("Retrying stable diffusion prompts for %d of %d titles", len(pending), len(titles))
+
+        batch_titles = [titles[idx] for idx in pending]
+        payload = {
+            "input_text": _build_stable_diffusion_batch_prompt_from_template(batch_titles),
+            "max_tokens": min(4000, STABLE_DIFFUSION_TOKENS_PER_PROMPT * len(batch_titles) + 100),
+        }
+        logging.debug("Sending payload to LLM service for stable diffusion prompts: %s", payload)
+        client = get_client(LLM)
+        try:
+            response = await client.post(LLM_SERVICE_URL, json=payload)
+            response.raise_for_status()
+            logging.info("Received response from LLM service for %d stable diffusion prompts", len(batch_titles))
+            items = _parse_json_array(response.json()["response_text"])
+        except httpx.HTTPError as e:
+            logging.error("HTTP error occurred while calling LLM service: %s", e)
+            continue
+        except (KeyError, ValueError) as e:
+            logging.error("Invalid batch response from LLM service: %s", e)
+            continue
+
+        still_pending = []
+        for position, idx in enumerate(pending):
+            item = items[position] if position < len(items) else None
+            prompt = _validate_stable_diffusion_prompt(item)
+            if prompt:
+                prompts[idx] = prompt
+            else:
+                still_pending.append(idx)
+        pending = still_pending
+
+    if pending:
+        logging.error("No valid stable diffusion prompt for titles: %s", [titles[idx] for idx in pending])
+
+    return prompts
+
+def _parse_json_array(text: str) -> list:
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end < start:
+        raise ValueError("Response does not contain a JSON array.")
+    items = json.loads(text[start:end + 1])
+    if not isinstance(items, list):
+        raise ValueError("Response is not a JSON array.")
+    return items
+
+def _validate_stable_diffusion_prompt(item) -> Optional[Dict[str, str]]:
+    if not isinstance(item, dict):
+        return None
+    prompt, negative_prompt = item.get("prompt"), item.get("negative_prompt")
+    if not isinstance(prompt, str) or not prompt.strip() or not isinstance(negative_prompt, str):
+        return None
+    return {
+        "prompt": prompt,
+        "negative_prompt": negative_prompt
+    }
+
+def _build_stable_diffusion_batch_prompt_from_template(titles: List[str]):
+    template_content = _read_template(STABLE_DIFFUSION_BATCH_TEMPLATE_PATH)
+    slide_titles = "\n".join(f'{idx + 1}. "{title}"' for idx, title in enumerate(titles))
+    template_content = template_content.replace('[Slide Titles]', slide_titles)
+
+    logging.debug("Built stable diffusion batch prompt: %s", template_content)
+    return template_content
+
+@lru_cache(maxsize=None)
+def _read_template(path: str) -> str:
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            template_content = file.read()
+            logging.info("Successfully read template %s", path)
+            return template_content
+    except FileNotFoundError:
+        logging.error("Template file not found at: %s", path)
+        raise FileNotFoundError(f"Template file not found at: {path}")
+    except Exception as e:
+        logging.error("An error occurred while reading the template file: %s", e)
+        raise
+
 if __name__ == "__main__":
     import asyncio
 
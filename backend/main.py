@@ -1,7 +1,14 @@
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from routes import router
+from jobs import job_manager
+from http_clients import registry
+from workspace import remove_stale_workspaces
+from browser_pool import close_browser_pool, get_browser_pool
+from slide_renderer import SLIDE_RENDER_BACKEND
 import os
 from dotenv import load_dotenv
 
@@ -10,16 +17,36 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.start()
+    remove_stale_workspaces()
+    if SLIDE_RENDER_BACKEND == "browser_pool":
+        asyncio.get_running_loop().run_in_executor(None, _warm_browser_pool)
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    await registry.aclose()
+    await asyncio.to_thread(close_browser_pool)
+
+def _warm_browser_pool():
+    try:
+        get_browser_pool().warm()
+    except Exception as e:
+        logger.warning(f"Could not start the slide rendering browsers ahead of time: {e}")
+
 app = FastAPI(
     title="AI Presentation Generator",
     description="Generates AI-powered presentations based on user input.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.include_router(router)
 
 if os.getenv("STORAGE_BACKEND") != "s3":
     videos_dir = os.path.join(os.path.dirname(__file__), "videos")
+    os.makedirs(videos_dir, exist_ok=True)
     app.mount("/videos", StaticFiles(directory=videos_dir), name="videos")
     logger.info(f"Serving videos from {videos_dir}")
 else:
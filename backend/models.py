@@ -1,3 +1,5 @@
+from typing import Dict, List, Optional
+
 from pydantic import BaseModel, HttpUrl
 
 class PresentationRequest(BaseModel):
@@ -7,3 +9,20 @@ class PresentationRequest(BaseModel):
 
 class PresentationResponse(BaseModel):
     video_url: HttpUrl
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    progress: float
+    stages: Dict[str, str]
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+
+class DeckUpdateRequest(BaseModel):
+    slides: Optional[List[dict]] = None
+    edits: Optional[Dict[int, dict]] = None
+    character: Optional[str] = None
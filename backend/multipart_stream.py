@@ -0,0 +1,75 @@
+from typing import Dict, List, Optional, Tuple
+
+HEADER_END = b"\r\n\r\n"
+
+
+class MultipartStreamParser:
+    def __init__(self, boundary: str):
+        """
+        Incremental parser for a ``multipart/mixed`` body whose parts all carry a
+        ``Content-Length``, as sent by the TTS batch endpoint.
+
+        Bytes are fed as they arrive and every part is returned as soon as its body is
+        complete, so the caller can act on it while the rest is still streaming.
+        """
+        self._delimiter = f"--{boundary}".encode("utf-8")
+        self._buffer = b""
+        self._headers: Optional[Dict[str, str]] = None
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def feed(self, chunk: bytes) -> List[Tuple[Dict[str, str], bytes]]:
+        """
+        Add a chunk of the body and return the ``(headers, body)`` of the parts completed by it.
+        Header names are lower-cased.
+        """
+        self._buffer += chunk
+        completed = []
+
+        while not self._done:
+            if self._headers is None:
+                if not self._parse_headers():
+                    break
+            else:
+                length = int(self._headers.get("content-length", -1))
+                if length < 0:
+                    raise ValueError("Multipart part without a Content-Length.")
+                if len(self._buffer) < length:
+                    break
+                completed.append((self._headers, self._buffer[:length]))
+                self._buffer = self._buffer[length:]
+                self._headers = None
+
+        return completed
+
+    def _parse_headers(self) -> bool:
+        stripped = self._buffer.lstrip(b"\r\n")
+        if stripped.startswith(self._delimiter + b"--"):
+            self._done = True
+            return False
+
+        end = stripped.find(HEADER_END)
+        if end == -1:
+            return False
+        if not stripped.startswith(self._delimiter):
+            raise ValueError("Multipart part does not start with the boundary.")
+
+        headers = {}
+        for line in stripped[len(self._delimiter):end].decode("utf-8").split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        self._headers = headers
+        self._buffer = stripped[end + len(HEADER_END):]
+        return True
+
+
+def boundary_from_content_type(content_type: str) -> str:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"')
+    raise ValueError(f"No multipart boundary in content type: {content_type}")
@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from deck_manifest import (
+    AUDIO, DEEPFAKE, IMAGE, RENDER, SEGMENT, DeckManifest, SlideRecord, is_main_slide, slide_template,
+)
+from deepfake_service import DEEPFAKE_BATCH, VIDEOS_DIR, DeepfakeBatch, generate_deepfake_video
+from presentation_builder import PresentationBuilder, concat_segments
+from slide_renderer import SlideRenderer, render_slides
+from llm_service import generate_stable_diffusion_prompts
+from stable_diffusion_service import (
+    IMAGES_DIR, STABLE_DIFFUSION_BATCH_PROMPTS, STABLE_DIFFUSION_CONCURRENCY, generate_image
+)
+from tts_service import AUDIO_DIR, TTS_BATCH, AudioBatch, generate_audio_script
+
+logger = logging.getLogger(__name__)
+
+MAIN_SLIDE_TEMPLATES = ["slide_1.html", "slide_2.html"]
+VIDEO_POSITION = ("right", "bottom")
+VIDEO_SIZE = (400, None)
+PRESENTATION_FPS = 24
+SEGMENT_CONCURRENCY = int(os.getenv("SEGMENT_CONCURRENCY", "2"))
+FINAL_NODE = "final"
+PROMPTS_NODE = "prompts"
+
+NODE_PENDING = "pending"
+NODE_RUNNING = "running"
+NODE_DONE = "done"
+NODE_FAILED = "failed"
+
+
+class TaskGraph:
+    def __init__(self, on_event: Optional[Callable[[str, str], None]] = None):
+        """
+        A minimal asyncio dependency graph.
+
+        Every node is an async callable that receives the results of its dependencies
+        as positional arguments, in the order they were declared. Nodes start as soon
+        as all of their dependencies have finished, so independent branches run
+        concurrently.
+
+        :param on_event: Optional callback invoked with ``(node_name, status)`` whenever a
+                         node starts, finishes or fails.
+        """
+        self._nodes: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._on_event = on_event
+        self._started = False
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def _emit(self, name: str, status: str):
+        if self._on_event:
+            try:
+                self._on_event(name, status)
+            except Exception as e:
+                logger.warning(f"Pipeline event listener failed for {name}: {e}")
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], deps: Optional[List[str]] = None):
+        """
+        Register a node in the graph. Nodes added after ``start`` are scheduled right away,
+        so their dependencies must already be part of the graph.
+
+        :param name: Unique name of the node.
+        :param func: Async callable invoked with the results of ``deps``.
+        :param deps: Names of the nodes this node depends on.
+        """
+        if name in self._nodes:
+            raise ValueError(f"Node {name} is already part of the graph.")
+        self._nodes[name] = (func, list(deps or []))
+        self._emit(name, NODE_PENDING)
+        if self._started:
+            self._check_deps(name)
+            self._tasks[name] = asyncio.create_task(self._run_node(name))
+
+    def _check_deps(self, name: str):
+        missing = [dep for dep in self._nodes[name][1] if dep not in self._nodes]
+        if missing:
+            raise ValueError(f"Node {name} depends on unknown nodes: {missing}")
+
+    async def _run_node(self, name: str):
+        func, deps = self._nodes[name]
+        results = await asyncio.gather(*(self._tasks[dep] for dep in deps))
+        logger.debug(f"Starting pipeline node {name}")
+        self._emit(name, NODE_RUNNING)
+        try:
+            result = await func(*results)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._emit(name, NODE_FAILED)
+            raise
+        logger.debug(f"Finished pipeline node {name}")
+        self._emit(name, NODE_DONE)
+        return result
+
+    def start(self):
+        """
+        Schedule every registered node. Nodes can keep being added afterwards.
+        """
+        for name in self._nodes:
+            self._check_deps(name)
+        self._tasks = {name: asyncio.create_task(self._run_node(name)) for name in self._nodes}
+        self._started = True
+
+    async def wait(self) -> Dict[str, Any]:
+        """
+        Wait for every scheduled node and return their results keyed by node name.
+        The first failing node cancels the remaining ones and its exception is re-raised.
+        """
+        try:
+            await asyncio.gather(*self._tasks.values())
+        except BaseException:
+            await self.cancel()
+            raise
+
+        return {name: task.result() for name, task in self._tasks.items()}
+
+    async def cancel(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Run every node of the graph and return their results keyed by node name.
+        """
+        self.start()
+        return await self.wait()
+
+
+class PresentationPipeline:
+    def __init__(self, presentation_content: Optional[dict], character: str, output_dir: str = "output",
+                 on_event: Optional[Callable[[str, str], None]] = None, manifest: Optional[DeckManifest] = None):
+        """
+        Builds the per-slide dependency graph of a presentation.
+
+        For every slide the graph contains:
+          - ``audio:N``    text to speech of the slide script; in batch mode every script
+                           goes out in one TTS call and the node waits only for its own part
+          - ``deepfake:N`` lip-sync of the character, waits only for ``audio:N``; in batch
+                           mode the audio of several slides goes out in one deepfake call
+          - ``image:N``    stable diffusion image, main slides only; in batch prompt mode it
+                           waits for a shared ``prompts`` node that builds every prompt at once
+          - ``slide:N``    HTML render of the slide, waits only for ``image:N``
+        and a single ``final`` node that waits for every slide and deepfake.
+
+        With a deck ``manifest`` every slide also gets a ``segment:N`` node that encodes the
+        slide on its own, and ``final`` only joins the segments. Every node first looks for
+        the deck's stored asset with the same input hash and returns it instead of doing the
+        work, so rebuilding an edited deck only redoes what the edit touched.
+
+        :param presentation_content: The parsed presentation JSON returned by the LLM, or None
+                                     when the slides are streamed in with ``run_streaming``.
+        :param character: Character used for the deepfake videos.
+        :param output_dir: Workspace of this presentation; every intermediate file and the
+                           final video are written under it, so concurrent presentations
+                           each need their own, see ``workspace.Workspace``.
+        :param on_event: Optional progress callback, see ``TaskGraph``.
+        :param manifest: Deck whose stored assets are reused and which records the new ones.
+        """
+        self.slides = []
+        self.character = character
+        self.output_dir = output_dir
+        self._images_dir = os.path.join(output_dir, IMAGES_DIR)
+        self._audio_dir = os.path.join(output_dir, AUDIO_DIR)
+        self._videos_dir = os.path.join(output_dir, VIDEOS_DIR)
+        self.graph = TaskGraph(on_event)
+        self._prompt_semaphore = asyncio.Semaphore(STABLE_DIFFUSION_CONCURRENCY)
+        self._image_semaphore = asyncio.Semaphore(STABLE_DIFFUSION_CONCURRENCY)
+        self._image_deps = []
+        self._main_idx = 0
+        self._slide_nodes = []
+        self._deepfake_nodes = []
+        self._audio_batch: Optional[AudioBatch] = None
+        self._deepfake_batch: Optional[DeepfakeBatch] = None
+        self._prompt_positions: Dict[int, int] = {}
+        self.manifest = manifest
+        self._records: Dict[int, SlideRecord] = {}
+        self._segment_nodes = []
+        self._segment_semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+        self._segment_settings = PresentationBuilder(VIDEO_POSITION, VIDEO_SIZE).segment_settings(PRESENTATION_FPS)
+        if manifest is not None:
+            manifest.reused = manifest.built = 0
+
+        if presentation_content is not None:
+            slides = presentation_content.get("slides", [])
+            self._plan_slides(slides)
+            scripts = {
+                idx: slide["script"] for idx, slide in enumerate(slides)
+                if slide.get("script") and not self._stored(idx, AUDIO)
+            }
+            if TTS_BATCH and scripts:
+                self._audio_batch = AudioBatch(scripts, self._audio_dir)
+            deepfakes = [idx for idx, slide in enumerate(slides) if slide.get("script") and not self._stored(idx, DEEPFAKE)]
+            if DEEPFAKE_BATCH and len(deepfakes) > 1:
+                self._deepfake_batch = DeepfakeBatch(character, len(deepfakes), output_dir=self._videos_dir)
+            main_slides = [(idx, slide) for idx, slide in enumerate(slides) if is_main_slide(slide)]
+            titles = []
+            for main_idx, (idx, slide) in enumerate(main_slides):
+                if not self._stored(idx, IMAGE):
+                    self._prompt_positions[main_idx] = len(titles)
+                    titles.append(slide.get("title", ""))
+            if STABLE_DIFFUSION_BATCH_PROMPTS and titles:
+                self.graph.add(PROMPTS_NODE, self._prompts_task(titles))
+                self._image_deps = [PROMPTS_NODE]
+            for slide in slides:
+                self.add_slide(slide)
+            self._add_final()
+
+    def _plan_slides(self, slides: List[dict]):
+        """
+        Compute the input hashes of every slide up front, so the shared batch nodes only
+        ask for the assets the deck does not have yet.
+        """
+        if self.manifest is None:
+            return
+        main_idx = 0
+        for idx, slide in enumerate(slides):
+            template_name = None
+            if is_main_slide(slide):
+                template_name = MAIN_SLIDE_TEMPLATES[main_idx % len(MAIN_SLIDE_TEMPLATES)]
+                main_idx += 1
+            self._plan_slide(idx, slide, template_name)
+
+    def _plan_slide(self, idx: int, slide: dict, template_name: Optional[str]) -> Optional[SlideRecord]:
+        if self.manifest is None:
+            return None
+        if idx not in self._records:
+            self._records[idx] = self.manifest.plan_slide(
+                idx, slide, slide_template(slide, template_name), self._segment_settings
+            )
+        return self._records[idx]
+
+    def _stored(self, idx: int, kind: str) -> Optional[str]:
+        record = self._records.get(idx)
+        return self.manifest.asset(kind, record.keys[kind]) if record else None
+
+    def _reusable(self, record: Optional[SlideRecord], kind: str, func: Callable[..., Awaitable[Any]],
+                  complete: Optional[Callable[..., bool]] = None):
+        """
+        Wrap a node so it returns the deck's stored asset when one exists for its input hash,
+        and stores what it builds otherwise.
+
+        :param complete: Called with the node's arguments; when it returns False the asset
+                         was built from a failed input (e.g. a slide without its image) and
+                         is used for this run but not stored.
+        """
+        if record is None:
+            return func
+
+        async def run(*args):
+            key = record.keys[kind]
+            stored_path = self.manifest.asset(kind, key)
+            if stored_path:
+                self.manifest.reused += 1
+                record.assets[kind] = stored_path
+                return stored_path
+
+            path = await func(*args)
+            self.manifest.built += 1
+            if path and (complete is None or complete(*args)):
+                path = await asyncio.to_thread(self.manifest.store, kind, key, path)
+                record.assets[kind] = path
+            return path
+        return run
+
+    def add_slide(self, slide: dict):
+        """
+        Add the nodes of the next slide of the presentation.
+        """
+        idx = len(self.slides)
+        self.slides.append(slide)
+
+        slide_deps = []
+        if is_main_slide(slide):
+            template_name = MAIN_SLIDE_TEMPLATES[self._main_idx % len(MAIN_SLIDE_TEMPLATES)]
+            record = self._plan_slide(idx, slide, template_name)
+            image_task = self._image_task(slide.get("title", ""), self._main_idx)
+            self.graph.add(f"image:{idx}", self._reusable(record, IMAGE, image_task), self._image_deps)
+            slide_deps.append(f"image:{idx}")
+            self._main_idx += 1
+        else:
+            template_name = None
+            record = self._plan_slide(idx, slide, template_name)
+
+        is_main = is_main_slide(slide)
+        slide_task = self._reusable(
+            record, RENDER, self._slide_task(slide, idx, template_name),
+            complete=lambda image_path=None: not is_main or bool(image_path),
+        )
+        self.graph.add(f"slide:{idx}", slide_task, slide_deps)
+        self._slide_nodes.append(f"slide:{idx}")
+
+        segment_deps = [f"slide:{idx}"]
+        if slide.get("script"):
+            self.graph.add(f"audio:{idx}", self._reusable(record, AUDIO, self._audio_task(slide["script"], idx)))
+            self.graph.add(f"deepfake:{idx}", self._reusable(record, DEEPFAKE, self._deepfake_task()), [f"audio:{idx}"])
+            self._deepfake_nodes.append(f"deepfake:{idx}")
+            segment_deps.append(f"deepfake:{idx}")
+        else:
+            self._deepfake_nodes.append(None)
+
+        if record is not None:
+            has_script = bool(slide.get("script"))
+            segment_task = self._reusable(
+                record, SEGMENT, self._segment_task(idx),
+                complete=lambda slide_path, video_path=None: RENDER in record.assets and (not has_script or bool(video_path)),
+            )
+            self.graph.add(f"segment:{idx}", segment_task, segment_deps)
+            self._segment_nodes.append(f"segment:{idx}")
+
+    def _add_final(self):
+        if self.manifest is not None:
+            async def join(*segment_paths):
+                return await asyncio.to_thread(join_presentation_segments, list(segment_paths), self.output_dir)
+
+            self.graph.add(FINAL_NODE, join, list(self._segment_nodes))
+            return
+
+        slide_nodes = list(self._slide_nodes)
+        deepfake_nodes = list(self._deepfake_nodes)
+
+        async def final(*results):
+            slide_paths = results[:len(slide_nodes)]
+            deepfakes = iter(results[len(slide_nodes):])
+            video_paths = [next(deepfakes) if node else None for node in deepfake_nodes]
+            return await asyncio.to_thread(build_final_presentation, slide_paths, video_paths, self.output_dir)
+
+        self.graph.add(FINAL_NODE, final, slide_nodes + [node for node in deepfake_nodes if node])
+
+    @staticmethod
+    def _prompts_task(titles: List[str]):
+        async def run():
+            return await generate_stable_diffusion_prompts(titles)
+        return run
+
+    def _image_task(self, title: str, image_idx: int):
+        async def run(prompts=None):
+            prompt = prompts[self._prompt_positions.get(image_idx, image_idx)] if prompts else None
+            try:
+                return await generate_image(
+                    title, image_idx, self._prompt_semaphore, self._image_semaphore, prompt, self._images_dir
+                )
+            except Exception as e:
+                logger.error(f"Image generation failed for '{title}', rendering slide without it: {e}")
+                return None
+        return run
+
+    def _audio_task(self, script: str, idx: int):
+        async def run():
+            if self._audio_batch is not None:
+                return await self._audio_batch.get(idx)
+            return await generate_audio_script(script, idx, self._audio_dir)
+        return run
+
+    def _deepfake_task(self):
+        async def run(audio_file_path):
+            if self._deepfake_batch is not None:
+                return await self._deepfake_batch.get(audio_file_path)
+            return await generate_deepfake_video(self.character, audio_file_path, self._videos_dir)
+        return run
+
+    def _segment_task(self, idx: int):
+        async def run(slide_path, video_path=None):
+            output_path = os.path.abspath(os.path.join(self.output_dir, f"segment_{idx}.mp4"))
+            async with self._segment_semaphore:
+                return await asyncio.to_thread(encode_slide_segment, slide_path, video_path, output_path)
+        return run
+
+    def _slide_task(self, slide: dict, idx: int, template_name: Optional[str]):
+        async def run(image_path=None):
+            return await asyncio.to_thread(
+                render_presentation_slide, slide, idx, image_path, self.output_dir, template_name
+            )
+        return run
+
+    async def run(self) -> str:
+        """
+        Run the whole graph and return the path of the final presentation video.
+        """
+        try:
+            results = await self.graph.run()
+        finally:
+            if self._audio_batch is not None:
+                self._audio_batch.cancel()
+            if self._deepfake_batch is not None:
+                self._deepfake_batch.cancel()
+        return results[FINAL_NODE]
+
+    async def run_streaming(self, slides: AsyncIterator[dict]) -> str:
+        """
+        Start every slide's work as soon as the slide arrives from ``slides``, e.g. while
+        the LLM is still writing the next ones, and return the path of the final video.
+        Image prompts are built per slide here, since the titles are not known up front.
+        """
+        self.graph.start()
+        try:
+            async for slide in slides:
+                logger.info(f"Slide {len(self.slides)} received, starting its assets")
+                self.add_slide(slide)
+            if not self.slides:
+                raise ValueError("The presentation content does not contain any slides.")
+            self._add_final()
+        except BaseException:
+            await self.graph.cancel()
+            raise
+
+        results = await self.graph.wait()
+        return results[FINAL_NODE]
+
+
+def render_presentation_slide(slide: dict, idx: int, image_path: Optional[str], output_dir: str,
+                              template_name: Optional[str] = None) -> str:
+    """
+    Render a single slide of the presentation content into a PNG.
+
+    :param slide: The slide dictionary from the presentation content.
+    :param idx: Index of the slide, used to build the output file name.
+    :param image_path: Path of the generated image for main slides.
+    :param output_dir: Directory where the slide image is written.
+    :param template_name: Template to use for main slides.
+    :return: Path of the rendered slide.
+    """
+    renderer = prepare_presentation_slide(slide, image_path, template_name)
+    output_path = os.path.abspath(os.path.join(output_dir, f"slide_{idx}.png"))
+    renderer.render_slide(output_path)
+    return output_path
+
+
+def prepare_presentation_slide(slide: dict, image_path: Optional[str], template_name: Optional[str] = None) -> SlideRenderer:
+    """
+    Fill the template of a slide, ready to be rendered.
+    """
+    renderer = SlideRenderer()
+    slide_type = slide.get("type")
+
+    if slide_type == "introduction":
+        renderer.generate_intro_slide(title=slide.get("title", ""), subtitle=slide.get("subtitle", ""))
+    elif slide_type == "conclusion":
+        renderer.generate_conclusion_slide(thank_you=slide.get("title", ""), call_to_action=slide.get("subtitle", ""))
+    else:
+        renderer.generate_main_slide(
+            title=slide.get("title"),
+            bullet_points=slide.get("bullet_points"),
+            image_url=image_path,
+            template_name=template_name or MAIN_SLIDE_TEMPLATES[0],
+        )
+    return renderer
+
+
+def generate_slides(presentation_content: dict, image_file_paths: List[Optional[str]], output_dir: str) -> List[str]:
+    """
+    Render every slide of the presentation, pairing main slides with their images in order.
+    The slides are rendered together, on as many browsers as the pool holds.
+    """
+    images = iter(image_file_paths)
+    renderers = []
+    slide_file_paths = []
+    main_idx = 0
+    for idx, slide in enumerate(presentation_content.get("slides", [])):
+        if is_main_slide(slide):
+            template_name = MAIN_SLIDE_TEMPLATES[main_idx % len(MAIN_SLIDE_TEMPLATES)]
+            renderers.append(prepare_presentation_slide(slide, next(images, None), template_name))
+            main_idx += 1
+        else:
+            renderers.append(prepare_presentation_slide(slide, None))
+        slide_file_paths.append(os.path.abspath(os.path.join(output_dir, f"slide_{idx}.png")))
+
+    render_slides(renderers, slide_file_paths)
+    return slide_file_paths
+
+
+def build_final_presentation(slide_file_paths: List[str], video_file_paths: List[Optional[str]], output_dir: str) -> str:
+    """
+    Overlay the deepfake videos onto their slides and encode the final presentation.
+
+    :param slide_file_paths: Rendered slide images, in presentation order.
+    :param video_file_paths: Deepfake video for each slide, or None for a static slide.
+    :param output_dir: Directory where the final video is written.
+    :return: Path of the final presentation video.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    builder = PresentationBuilder(video_position=VIDEO_POSITION, video_size=VIDEO_SIZE)
+    for idx, slide_path in enumerate(slide_file_paths):
+        video_path = video_file_paths[idx] if idx < len(video_file_paths) else None
+        builder.add_slide(slide_path, video_path)
+
+    final_video_path = os.path.join(output_dir, "presentation.mp4")
+    builder.produce_presentation(final_video_path)
+    return final_video_path
+
+
+def encode_slide_segment(slide_path: str, video_path: Optional[str], output_path: str) -> str:
+    """
+    Encode a single slide, with its deepfake overlaid, as a segment of the presentation.
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    builder = PresentationBuilder(video_position=VIDEO_POSITION, video_size=VIDEO_SIZE)
+    builder.add_slide(slide_path, video_path)
+    builder.produce_segment(output_path, fps=PRESENTATION_FPS)
+    return output_path
+
+
+def join_presentation_segments(segment_paths: List[str], output_dir: str) -> str:
+    """
+    Join the encoded segments of every slide into the final presentation video.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    final_video_path = os.path.join(output_dir, "presentation.mp4")
+    concat_segments(segment_paths, final_video_path)
+    return final_video_path
@@ -1,4 +1,18 @@
-from moviepy.editor import VideoFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.editor import AudioClip, VideoFileClip, ImageClip, CompositeVideoClip, concatenate_videoclips
+
+AUDIO_FPS = 44100
+STATIC_SLIDE_DURATION = 5
+
+
+def _silence(t):
+    return np.zeros((len(t), 2)) if np.ndim(t) else np.zeros(2)
+
 
 class PresentationBuilder:
     def __init__(self, video_position=("right", "bottom"), video_size=(100, None)):
@@ -42,7 +56,7 @@ class PresentationBuilder:
             # Set audio
             slide = slide.set_audio(video_clip.audio)
         else:
-            slide = slide.set_duration(5)
+            slide = slide.set_duration(STATIC_SLIDE_DURATION)
 
         self.slides.append(slide)
 
@@ -63,10 +77,77 @@ class PresentationBuilder:
             fps=fps,
             codec='libx264',
             audio_codec='aac',
-            temp_audiofile='temp-audio.m4a',
+            temp_audiofile=f"{output_path}.temp-audio.m4a",
             remove_temp=True
         )
 
+    def segment_settings(self, fps=24):
+        """
+        Everything besides the slide and its video that changes an encoded segment.
+        """
+        return {
+            "video_position": self.video_position,
+            "video_size": self.video_size,
+            "fps": fps,
+            "audio_fps": AUDIO_FPS,
+            "static_duration": STATIC_SLIDE_DURATION,
+        }
+
+    def produce_segment(self, output_path, fps=24):
+        """
+        Encodes the added slides as one segment of a presentation.
+
+        Every segment gets the same codecs, frame rate and a stereo audio track, silent for
+        slides without a video, so segments can be joined by ``concat_segments`` without
+        being encoded again.
+
+        :param output_path: Path to save the segment.
+        :param fps: Frames per second of the segment.
+        """
+        if not self.slides:
+            raise ValueError("No slides have been added to the segment.")
+
+        slides = [
+            slide if slide.audio is not None
+            else slide.set_audio(AudioClip(_silence, duration=slide.duration, fps=AUDIO_FPS))
+            for slide in self.slides
+        ]
+        clip = slides[0] if len(slides) == 1 else concatenate_videoclips(slides, method="compose")
+        clip.write_videofile(
+            output_path,
+            fps=fps,
+            codec='libx264',
+            audio_codec='aac',
+            audio_fps=AUDIO_FPS,
+            temp_audiofile=f"{output_path}.temp-audio.m4a",
+            remove_temp=True,
+            logger=None,
+        )
+
+
+def concat_segments(segment_paths, output_path):
+    """
+    Joins segments written by ``PresentationBuilder.produce_segment`` into the final video
+    with ffmpeg's concat demuxer, copying the streams instead of encoding them again.
+
+    :param segment_paths: Segments in presentation order.
+    :param output_path: Path to save the final video.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        subprocess.run(
+            [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+             "-i", list_file.name, "-c", "copy", "-movflags", "+faststart", output_path],
+            check=True, capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"Failed to join the presentation segments: {e.stderr.decode(errors='replace')}")
+    finally:
+        os.remove(list_file.name)
+
 if __name__ == "__main__":
     # Initialize the presentation builder
     presentation = PresentationBuilder(
@@ -4,6 +4,7 @@ from typing import Optional, List
 from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Request
 from fastapi.responses import FileResponse
 from pydantic import HttpUrl
+from starlette.background import BackgroundTask
 import random
 import os
 from fastapi.responses import FileResponse
@@ -11,11 +12,12 @@ from PIL import Image, ImageDraw
 
 from presentation_builder import PresentationBuilder
 from slide_renderer import SlideRenderer
-from models import PresentationResponse
-from deepfake_service import generate_deepfake_videos
-from llm_service import generate_presentation_content
-from stable_diffusion_service import generate_images
-from tts_service import generate_audio_scripts
+from models import PresentationResponse, JobSubmitResponse, JobStatusResponse, DeckUpdateRequest
+from deck_manifest import DeckManifest, deck_lock
+from jobs import job_manager, JobQueueFullError
+from llm_service import LLM_STREAMING, generate_presentation_content, stream_presentation_content
+from pipeline import PresentationPipeline
+from workspace import Workspace
 from utils import *
 
 # Configure logging
@@ -46,42 +48,195 @@ async def generate_presentation(
     if not file and not text:
         raise HTTPException(status_code=400, detail="Either file or text must be provided.")
 
+    workspace = Workspace()
     try:
-        # Handle file or text input
-        if file:
-            content = await file.read()
-            if file.content_type == "application/pdf":
-                text_content = extract_text_from_pdf(content)
-            elif file.content_type.startswith("text/"):
-                text_content = content.decode('utf-8')
-            else:
-                raise HTTPException(status_code=400, detail="Unsupported file type.")
-        else:
-            text_content = text.strip()
-
-        # Generate content
-        presentation_content = await generate_presentation_content(text_content, duration, detail_level, character)
-        presentation_content = json.loads(presentation_content)
+        text_content = await _read_text_content(file, text)
 
-        # Generate assets
-        tittles = extract_tittles_from_presentation_content(presentation_content)
-        image_file_paths = await generate_images(tittles)
-        scripts = extract_scripts_from_presentation_content(presentation_content)
-        audio_file_paths = await generate_audio_scripts(scripts)
-        deepfake_file_paths = await generate_deepfake_videos(character, audio_file_paths)
-        slide_file_paths = generate_slides(presentation_content, image_file_paths, "output")
-        final_video_path = build_final_presentation(slide_file_paths, deepfake_file_paths, "output")
+        # Generate content and assets, running independent stages of every slide concurrently
+        if LLM_STREAMING:
+            pipeline = PresentationPipeline(None, character, workspace.path)
+            slides = stream_presentation_content(text_content, duration, detail_level, character)
+            final_video_path = await pipeline.run_streaming(slides)
+        else:
+            presentation_content = await generate_presentation_content(text_content, duration, detail_level, character)
+            presentation_content = json.loads(presentation_content)
+            pipeline = PresentationPipeline(presentation_content, character, workspace.path)
+            final_video_path = await pipeline.run()
 
         if not os.path.exists(final_video_path):
             raise HTTPException(status_code=500, detail="Failed to generate presentation video")
 
-        # Return final video
+        # Return final video, the workspace is removed once it has been sent
         return FileResponse(
             path=final_video_path,
             filename="presentation.mp4",
             media_type="video/mp4",
+            background=BackgroundTask(workspace.cleanup),
         )
 
     except Exception as e:
+        workspace.cleanup()
         logger.exception("Error during presentation generation.")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_presentation_job(
+        file: Optional[UploadFile] = File(None, description="File containing content."),
+        text: Optional[str] = Form(None, description="Text content."),
+        duration: int = Form(..., description="Duration in minutes."),
+        detail_level: str = Form(..., description="Detail level."),
+        character: str = Form(..., description="Character for deepfake."),
+):
+    logger.info("Submit presentation job called.")
+
+    if not file and not text:
+        raise HTTPException(status_code=400, detail="Either file or text must be provided.")
+
+    text_content = await _read_text_content(file, text)
+
+    try:
+        job = job_manager.submit(text_content, duration, detail_level, character)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+
+    return JobSubmitResponse(job_id=job.id, status=job.status)
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_presentation_job(job_id: str, request: Request):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+
+    video_url = job.video_url
+    if video_url and video_url.startswith("/"):
+        video_url = str(request.base_url).rstrip('/') + video_url
+
+    return JobStatusResponse(
+        job_id=job.id,
+        status=job.status,
+        progress=job.progress,
+        stages=job.stages,
+        video_url=video_url,
+        error=job.error,
+    )
+
+
+@router.post("/decks")
+async def create_deck(
+        file: Optional[UploadFile] = File(None, description="File containing content."),
+        text: Optional[str] = Form(None, description="Text content."),
+        duration: int = Form(..., description="Duration in minutes."),
+        detail_level: str = Form(..., description="Detail level."),
+        character: str = Form(..., description="Character for deepfake."),
+):
+    """
+    Generate a presentation like /generate-presentation and keep it as a deck, whose slides
+    can later be edited through /decks/{deck_id}/update.
+    """
+    logger.info("Create deck called.")
+
+    if not file and not text:
+        raise HTTPException(status_code=400, detail="Either file or text must be provided.")
+
+    text_content = await _read_text_content(file, text)
+    manifest = DeckManifest(character=character)
+
+    try:
+        async with deck_lock(manifest.deck_id):
+            with Workspace(manifest.deck_id) as workspace:
+                if LLM_STREAMING:
+                    pipeline = PresentationPipeline(None, character, workspace.path, manifest=manifest)
+                    slides = stream_presentation_content(text_content, duration, detail_level, character)
+                    final_video_path = await pipeline.run_streaming(slides)
+                else:
+                    presentation_content = await generate_presentation_content(text_content, duration, detail_level, character)
+                    presentation_content = json.loads(presentation_content)
+                    pipeline = PresentationPipeline(presentation_content, character, workspace.path, manifest=manifest)
+                    final_video_path = await pipeline.run()
+                manifest.finish(len(pipeline.slides), final_video_path)
+
+    except Exception as e:
+        logger.exception("Error during deck generation.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return _deck_video_response(manifest)
+
+
+@router.get("/decks/{deck_id}")
+async def get_deck(deck_id: str):
+    manifest = DeckManifest.load(deck_id)
+    if not manifest:
+        raise HTTPException(status_code=404, detail=f"Deck {deck_id} not found.")
+    return manifest.to_dict()
+
+
+@router.post("/decks/{deck_id}/update")
+async def update_deck(deck_id: str, update: DeckUpdateRequest):
+    """
+    Rebuild a deck from new slide contents. Only the assets whose inputs changed are
+    regenerated; the others, down to the encoded video segment of every untouched slide,
+    are reused from the previous build.
+
+    Either ``slides`` replaces the whole slide list, or ``edits`` maps slide indexes to the
+    fields to change in them.
+    """
+    logger.info(f"Update deck {deck_id} called.")
+
+    if not DeckManifest.load(deck_id):
+        raise HTTPException(status_code=404, detail=f"Deck {deck_id} not found.")
+
+    async with deck_lock(deck_id):
+        # Reloaded under the lock, so a concurrent update is not overwritten
+        manifest = DeckManifest.load(deck_id)
+        slides = update.slides if update.slides is not None else [record.content for record in manifest.slides]
+        for idx, changes in (update.edits or {}).items():
+            if not 0 <= idx < len(slides):
+                raise HTTPException(status_code=400, detail=f"Deck {deck_id} has no slide {idx}.")
+            slides[idx] = {**slides[idx], **changes}
+        if not slides:
+            raise HTTPException(status_code=400, detail="The deck must contain at least one slide.")
+        if update.character:
+            manifest.character = update.character
+
+        try:
+            with Workspace(deck_id) as workspace:
+                pipeline = PresentationPipeline({"slides": slides}, manifest.character, workspace.path, manifest=manifest)
+                final_video_path = await pipeline.run()
+                manifest.finish(len(pipeline.slides), final_video_path)
+        except Exception as e:
+            logger.exception(f"Error during update of deck {deck_id}.")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    logger.info(f"Deck {deck_id} updated: {manifest.reused} assets reused, {manifest.built} built")
+    return _deck_video_response(manifest)
+
+
+def _deck_video_response(manifest: DeckManifest) -> FileResponse:
+    if not manifest.video or not os.path.exists(manifest.video):
+        raise HTTPException(status_code=500, detail="Failed to generate presentation video")
+
+    return FileResponse(
+        path=manifest.video,
+        filename="presentation.mp4",
+        media_type="video/mp4",
+        headers={
+            "X-Deck-Id": manifest.deck_id,
+            "X-Assets-Reused": str(manifest.reused),
+            "X-Assets-Built": str(manifest.built),
+        },
+    )
+
+
+async def _read_text_content(file: Optional[UploadFile], text: Optional[str]) -> str:
+    # Handle file or text input
+    if file:
+        content = await file.read()
+        if file.content_type == "application/pdf":
+            return extract_text_from_pdf(content)
+        elif file.content_type.startswith("text/"):
+            return content.decode('utf-8')
+        else:
+            raise HTTPException(status_code=400, detail="Unsupported file type.")
+    return text.strip()
@@ -0,0 +1,313 @@
+import io
+import logging
+import os
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+import httpx
+import numpy as np
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
+
+# Liberation Sans has the metrics of Arial, the font of the templates, and is what Chromium uses for it
+SLIDE_FONT_REGULAR = os.getenv("SLIDE_FONT_REGULAR", "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf")
+SLIDE_FONT_BOLD = os.getenv("SLIDE_FONT_BOLD", "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf")
+FALLBACK_FONT_REGULAR = "DejaVuSans.ttf"
+FALLBACK_FONT_BOLD = "DejaVuSans-Bold.ttf"
+# Height of "line-height: normal" for Arial, as a multiple of the font size
+NORMAL_LINE_HEIGHT = 1.15
+BROKEN_IMAGE_TEXT = "Slide Image"
+SLIDE_IMAGE_TIMEOUT = float(os.getenv("SLIDE_IMAGE_TIMEOUT", "30"))
+
+logger = logging.getLogger(__name__)
+
+Size = Tuple[int, int]
+
+
+@lru_cache(maxsize=None)
+def load_font(size: int, bold: bool = False) -> ImageFont.FreeTypeFont:
+    for path in ((SLIDE_FONT_BOLD, FALLBACK_FONT_BOLD) if bold else (SLIDE_FONT_REGULAR, FALLBACK_FONT_REGULAR)):
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def linear_gradient(size: Size, start: str, end: str) -> Image.Image:
+    """
+    ``linear-gradient(135deg, start, end)``: the colour runs from the top-left corner to
+    the bottom-right one, so it only depends on ``x + y`` and every row is a window of the
+    same ramp. Returns a copy the caller may draw on.
+    """
+    return _linear_gradient(size, start, end).copy()
+
+
+@lru_cache(maxsize=16)
+def _linear_gradient(size: Size, start: str, end: str) -> Image.Image:
+    width, height = size
+    t = ((np.arange(width + height - 1, dtype=np.float32) + 1) / (width + height))[:, None]
+    ramp = np.array(ImageColor.getrgb(start), np.float32) * (1 - t) + np.array(ImageColor.getrgb(end), np.float32) * t
+    ramp = np.round(ramp).astype(np.uint8)
+    rows = np.lib.stride_tricks.sliding_window_view(ramp, width, axis=0)[:height]
+    return Image.fromarray(np.ascontiguousarray(rows.transpose(0, 2, 1)), "RGB")
+
+
+@lru_cache(maxsize=32)
+def rounded_mask(size: Size, radius: int) -> Image.Image:
+    mask = Image.new("L", size, 0)
+    ImageDraw.Draw(mask).rounded_rectangle((0, 0, size[0] - 1, size[1] - 1), radius, fill=255)
+    return mask
+
+
+@lru_cache(maxsize=8)
+def corner_mask(size: Size, radius: int) -> Image.Image:
+    return ImageChops.invert(rounded_mask(size, radius))
+
+
+def round_corners(canvas: Image.Image, background, radius: int):
+    """
+    Let ``background``, an image or a colour, show outside the rounded corners of a slide
+    that fills the whole canvas. Only the four corner boxes are touched.
+    """
+    width, height = canvas.size
+    mask = corner_mask(canvas.size, radius)
+    for x, y in ((0, 0), (width - radius, 0), (0, height - radius), (width - radius, height - radius)):
+        box = (x, y, x + radius, y + radius)
+        source = ImageColor.getrgb(background) if isinstance(background, str) else background.crop(box)
+        canvas.paste(source, box, mask.crop(box))
+
+
+def wrap_lines(text: str, font: ImageFont.FreeTypeFont, max_width: float) -> List[str]:
+    """
+    Break ``text`` into lines at spaces like a browser does: greedily, and with words
+    longer than a line left on a line of their own.
+    """
+    lines = []
+    for paragraph in (text or "").splitlines():
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        if line:
+            lines.append(line)
+    return lines
+
+
+def draw_lines(draw: ImageDraw.ImageDraw, lines: List[str], font: ImageFont.FreeTypeFont, line_height: float,
+               x: float, y: float, width: float, fill: str, align: str = "left") -> float:
+    """
+    Draw lines of text into line boxes of ``line_height``, with the glyphs vertically
+    centred in them as CSS does.
+
+    :return: The y coordinate below the last line.
+    """
+    ascent, descent = font.getmetrics()
+    baseline_offset = (line_height - ascent - descent) / 2 + ascent
+    for line in lines:
+        line_x = x
+        if align == "center":
+            line_x = x + (width - font.getlength(line)) / 2
+        draw.text((line_x, y + baseline_offset), line, font=font, fill=fill, anchor="ls")
+        y += line_height
+    return y
+
+
+def draw_bullets(draw: ImageDraw.ImageDraw, points: List[str], font: ImageFont.FreeTypeFont, line_height: float,
+                 x: float, y: float, width: float, item_gap: float, fill: str) -> float:
+    """
+    Draw a disc list; ``x`` is where the text of the items starts, the markers hang left of it.
+    """
+    marker_width = font.getlength("• ")
+    for point in points:
+        lines = wrap_lines(point, font, width) or [""]
+        draw_lines(draw, ["•"], font, line_height, x - marker_width, y, marker_width, fill)
+        y = draw_lines(draw, lines, font, line_height, x, y, width, fill) + item_gap
+    return y
+
+
+def bullet_items(bullet_points: Optional[List[str]]) -> List[str]:
+    points = [point for point in bullet_points or [] if point]
+    return points if bullet_points else ["No points available"]
+
+
+def fetch_image(url: Optional[str]) -> Optional[Image.Image]:
+    """
+    Open the image of a slide from an http(s) or file URL or a local path, like the
+    ``src`` of the templates' ``<img>`` accepts. ``None`` when it cannot be loaded, which
+    the layouts draw like the browser's broken image.
+    """
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme.lower()
+    try:
+        if scheme in ("http", "https"):
+            response = httpx.get(url, timeout=SLIDE_IMAGE_TIMEOUT, follow_redirects=True)
+            response.raise_for_status()
+            source = io.BytesIO(response.content)
+        elif scheme == "file":
+            source = url2pathname(urlsplit(url).path)
+        elif len(scheme) > 1:
+            # Other schemes are not fetched; a one-letter "scheme" is a Windows drive
+            return None
+        else:
+            source = url
+        with Image.open(source) as image:
+            return image.convert("RGB")
+    except (httpx.HTTPError, OSError) as e:
+        logger.warning(f"Could not load slide image {url}: {e}")
+        return None
+
+
+def load_image(url: Optional[str], max_width: float, max_height: float) -> Optional[Image.Image]:
+    """
+    Open a slide image and shrink it to fit the box like ``max-width`` and ``max-height``
+    do; images smaller than the box keep their size.
+    """
+    image = fetch_image(url)
+    if image is None:
+        return None
+    scale = min(1.0, max_width / image.width, max_height / image.height)
+    if scale < 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS,
+                             reducing_gap=2.0)
+    return image
+
+
+def paste_rounded(canvas: Image.Image, image: Image.Image, position: Tuple[float, float], radius: int):
+    canvas.paste(image, (round(position[0]), round(position[1])), rounded_mask(image.size, radius))
+
+
+def draw_broken_image(draw: ImageDraw.ImageDraw, x: float, y: float, width: float, height: float):
+    """
+    Alt text of an image that could not be generated, centred in its box.
+    """
+    font = load_font(16)
+    draw_lines(draw, [BROKEN_IMAGE_TEXT], font, 16 * NORMAL_LINE_HEIGHT, x, y + (height - 16 * NORMAL_LINE_HEIGHT) / 2,
+               width, "#555555", align="center")
+
+
+def draw_centered_pair(draw: ImageDraw.ImageDraw, size: Size, padding: int, title: str, title_color: str,
+                       subtitle: str, subtitle_color: str):
+    """
+    A bold 4em title over a 2em subtitle, centred on the slide as a block, as in the
+    introduction and conclusion templates.
+    """
+    width, height = size
+    title_font, subtitle_font = load_font(64, bold=True), load_font(32)
+    title_height, subtitle_height = 64 * NORMAL_LINE_HEIGHT, 32 * NORMAL_LINE_HEIGHT
+    title_lines = wrap_lines(title, title_font, width - 2 * padding)
+    subtitle_lines = wrap_lines(subtitle, subtitle_font, width - 2 * padding)
+
+    block_height = len(title_lines) * title_height + 20 + len(subtitle_lines) * subtitle_height
+    y = (height - block_height) / 2
+    y = draw_lines(draw, title_lines, title_font, title_height, padding, y, width - 2 * padding, title_color, "center")
+    draw_lines(draw, subtitle_lines, subtitle_font, subtitle_height, padding, y + 20, width - 2 * padding,
+               subtitle_color, "center")
+
+
+def layout_intro(fields: dict, size: Size) -> Image.Image:
+    canvas = linear_gradient(size, "#0077cc", "#e3f2fd")
+    draw_centered_pair(ImageDraw.Draw(canvas), size, 0, fields.get("title", ""), "#ffffff",
+                       fields.get("subtitle", ""), "#ffffff")
+    return canvas
+
+
+def layout_conclusion(fields: dict, size: Size) -> Image.Image:
+    # The white .slide covers the whole gradient of the body
+    canvas = Image.new("RGB", size, "#ffffff")
+    draw_centered_pair(ImageDraw.Draw(canvas), size, 20, fields.get("thank_you", ""), "#0077cc",
+                       fields.get("call_to_action", ""), "#555555")
+    return canvas
+
+
+def layout_main_1(fields: dict, size: Size) -> Image.Image:
+    """
+    Title across the top, bullets on the left 58% and the image framed on the right 38%.
+    """
+    width, height = size
+    canvas = Image.new("RGB", size, "#ffffff")
+    round_corners(canvas, _linear_gradient(size, "#e3f2fd", "#ffffff"), 12)
+    draw = ImageDraw.Draw(canvas)
+
+    # padding: 5% is relative to the width on every side
+    padding = 0.05 * width
+    content_width = width - 2 * padding
+    title_font = load_font(48, bold=True)
+    title_lines = wrap_lines(fields.get("title") or "Untitled Slide", title_font, content_width)
+    y = draw_lines(draw, title_lines, title_font, 48 * NORMAL_LINE_HEIGHT, padding, padding, content_width,
+                   "#0077cc", "center") + 20
+
+    bullet_font = load_font(24)
+    draw_bullets(draw, bullet_items(fields.get("bullet_points")), bullet_font, 24 * 1.8,
+                 padding + 30, y + 24, 0.58 * content_width, 10, "#555555")
+
+    frame_width = 0.38 * content_width
+    frame_x = padding + content_width - frame_width
+    image = load_image(fields.get("image_url"), frame_width - 24, height)
+    frame_height = (image.height if image else 16 * NORMAL_LINE_HEIGHT) + 24
+    draw.rounded_rectangle((frame_x, y, frame_x + frame_width - 1, y + frame_height - 1), 8,
+                           fill="#f0f4f8", outline="#dddddd", width=2)
+    if image:
+        paste_rounded(canvas, image, (frame_x + (frame_width - image.width) / 2, y + 12), 6)
+    else:
+        draw_broken_image(draw, frame_x, y, frame_width, frame_height)
+    return canvas
+
+
+def layout_main_2(fields: dict, size: Size) -> Image.Image:
+    """
+    Image on the left half, title and bullets on the right half.
+    """
+    width, height = size
+    canvas = Image.new("RGB", size, "#ffffff")
+    draw = ImageDraw.Draw(canvas)
+
+    # Both sections are flex: 1, so they split the width left after their paddings
+    section_width = (width - 2 * 20 - 2 * 40) / 2 + 2 * 20
+    draw.rectangle((0, 0, section_width - 1, height), fill="#eef2f6")
+    image = load_image(fields.get("image_url"), section_width - 40, height - 40)
+    if image:
+        paste_rounded(canvas, image, ((section_width - image.width) / 2, (height - image.height) / 2), 8)
+    else:
+        draw_broken_image(draw, 0, 0, section_width, height)
+
+    x = section_width + 40
+    content_width = width - x - 40
+    title_font = load_font(40)
+    title_lines = wrap_lines(fields.get("title") or "Untitled Slide", title_font, content_width)
+    y = draw_lines(draw, title_lines, title_font, 40 * NORMAL_LINE_HEIGHT, x, 40, content_width, "#0077cc")
+    draw_bullets(draw, bullet_items(fields.get("bullet_points")), load_font(24), 24 * 1.7,
+                 x + 20, y + 15 + 60, content_width - 20, 10, "#555555")
+    round_corners(canvas, "#f8f9fa", 12)
+    return canvas
+
+
+LAYOUTS: Dict[str, Callable[[dict, Size], Image.Image]] = {
+    "intro.html": layout_intro,
+    "slide_1.html": layout_main_1,
+    "slide_2.html": layout_main_2,
+    "conclusion.html": layout_conclusion,
+}
+
+
+def has_layout(template_name: Optional[str]) -> bool:
+    return template_name in LAYOUTS
+
+
+def rasterize(template_name: str, fields: dict, size: Size = (1920, 1080)) -> Image.Image:
+    """
+    Draw a slide with Pillow, laid out like its HTML template renders in Chromium.
+
+    :param template_name: The template the slide was generated from.
+    :param fields: The values of the template placeholders, see ``SlideRenderer.fields``.
+    :param size: Width and height of the slide, the viewport of the template.
+    :raises KeyError: If the template has no Pillow layout.
+    """
+    return LAYOUTS[template_name](fields, size)
+
@@ -1,6 +1,31 @@
 from html2image import Html2Image
+import io
 import os
 import logging
+import re
+
+import numpy as np
+
+from browser_pool import get_browser_pool
+from slide_raster import has_layout, rasterize
+
+# "browser_pool" renders on warm browsers shared by every slide, "html2image" starts one per slide
+SLIDE_RENDER_BACKEND = os.getenv("SLIDE_RENDER_BACKEND", "browser_pool")
+# Set to false to render every template in the browser, whatever engine it asks for
+SLIDE_PILLOW_ENGINE = os.getenv("SLIDE_PILLOW_ENGINE", "true").lower() in ("1", "true", "yes")
+BROWSER_ENGINE = "browser"
+PILLOW_ENGINE = "pillow"
+# Templates pick their engine with <meta name="slide-engine" content="pillow">
+ENGINE_META_PATTERN = re.compile(r'<meta\s+name="slide-engine"\s+content="([^"]+)"', re.IGNORECASE)
+
+
+def template_engine(template):
+    """
+    The engine a template asks to be rendered with, the browser unless it says otherwise.
+    :param template: The HTML of the template.
+    """
+    match = ENGINE_META_PATTERN.search(template)
+    return match.group(1).strip().lower() if match else BROWSER_ENGINE
 
 
 # Configure logging
@@ -20,6 +45,10 @@ class SlideRenderer:
         """
         self.templates_dir = templates_dir
         self.html = ""
+        self.template_name = None
+        self.engine = BROWSER_ENGINE
+        # Values of the placeholders of the current slide, what the Pillow engine draws
+        self.fields = {}
         logging.debug(f"Initialized SlideRenderer with templates_dir: {templates_dir}")
 
     def load_template(self, template_name):
@@ -35,7 +64,10 @@ class SlideRenderer:
             raise FileNotFoundError(f"Template {template_name} not found in {self.templates_dir}")
         with open(file_path, "r", encoding="utf-8") as file:
             logging.info(f"Template {template_name} loaded successfully")
-            return file.read()
+            template = file.read()
+        self.template_name = template_name
+        self.engine = template_engine(template)
+        return template
 
     def generate_intro_slide(self, title, subtitle, template_name="intro.html"):
         """
@@ -47,6 +79,7 @@ class SlideRenderer:
         logging.info(f"Generating intro slide with title: {title} and subtitle: {subtitle}")
         template = self.load_template(template_name)
         self.html = template.replace("{{ title }}", title).replace("{{ subtitle }}", subtitle)
+        self.fields = {"title": title, "subtitle": subtitle}
 
     def generate_main_slide(self, title, bullet_points=None, image_url="", template_name="slide_1.html"):
         """
@@ -71,6 +104,7 @@ class SlideRenderer:
         self.html = template.replace("{{ title }}", title or "Untitled Slide")
         self.html = self.html.replace("{{ bullet_points }}", bullet_points_html)
         self.html = self.html.replace("{{ image_url }}", image_url or "placeholder.jpg")
+        self.fields = {"title": title, "bullet_points": bullet_points, "image_url": image_url}
 
         # Log the final HTML for debugging
         logging.debug(f"Generated HTML for main slide:\n{self.html}")
@@ -86,6 +120,7 @@ class SlideRenderer:
         logging.info(f"Generating conclusion slide with thank_you: {thank_you} and call_to_action: {call_to_action}")
         template = self.load_template(template_name)
         self.html = template.replace("{{ thank_you }}", thank_you).replace("{{ call_to_action }}", call_to_action)
+        self.fields = {"thank_you": thank_you, "call_to_action": call_to_action}
 
     def render_slide(self, output_path, size=(1920, 1080)):
         """
@@ -97,12 +132,25 @@ class SlideRenderer:
 
         # Ensure the directory exists
         output_dir = os.path.dirname(output_path)
-        if output_dir and not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            logging.debug(f"Created output directory: {output_dir}")
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        if self.uses_pillow:
+            rasterize(self.template_name, self.fields, size).save(output_path, "PNG", compress_level=1)
+            logging.info(f"Slide rendered successfully with Pillow to {output_path}")
+            return
+
+        if SLIDE_RENDER_BACKEND == "browser_pool":
+            png = self.render_png(size, base_dir=output_dir or None)
+            with open(output_path, "wb") as f:
+                f.write(png)
+            logging.info(f"Slide rendered successfully to {output_path}")
+            return
 
         hti = Html2Image(
             output_path=output_dir,
+            # Keeps the temporary HTML files of concurrent renders apart
+            temp_path=output_dir or None,
             browser_executable="/usr/bin/chromium",  # Update path if necessary
             custom_flags=["--headless", "--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu"]
         )
@@ -113,6 +161,62 @@ class SlideRenderer:
             logging.error(f"Error rendering slide: {e}")
             raise
 
+    def render_png(self, size=(1920, 1080), base_dir=None):
+        """
+        Render the slide with its template's engine, Pillow or the shared browser pool.
+        :param size: Tuple specifying the width and height of the rendered image.
+        :param base_dir: Directory relative URLs of the slide resolve against.
+        :return: The PNG bytes of the slide.
+        """
+        if self.uses_pillow:
+            buffer = io.BytesIO()
+            rasterize(self.template_name, self.fields, size).save(buffer, "PNG", compress_level=1)
+            return buffer.getvalue()
+        return get_browser_pool().render_png(self.html, size, base_dir)
+
+    def render_rgb(self, size=(1920, 1080), base_dir=None):
+        """
+        Render the slide with its template's engine, Pillow or the shared browser pool.
+        :return: A (height, width, 3) uint8 RGB array of the slide.
+        """
+        if self.uses_pillow:
+            return np.asarray(rasterize(self.template_name, self.fields, size))
+        return get_browser_pool().render_rgb(self.html, size, base_dir)
+
+    @property
+    def uses_pillow(self):
+        """
+        Whether the slide is drawn by the Pillow engine: its template asks for it and has a
+        layout in slide_raster.
+        """
+        return SLIDE_PILLOW_ENGINE and self.engine == PILLOW_ENGINE and has_layout(self.template_name)
+
+
+def render_slides(renderers, output_paths, size=(1920, 1080)):
+    """
+    Render several generated slides at once on the shared browser pool.
+    :param renderers: SlideRenderer instances whose slide has been generated.
+    :param output_paths: Path to save each rendered image, in the same order.
+    :param size: Tuple specifying the width and height of the rendered images.
+    """
+    browser_slides = []
+    for renderer, output_path in zip(renderers, output_paths):
+        if renderer.uses_pillow or SLIDE_RENDER_BACKEND != "browser_pool":
+            renderer.render_slide(output_path, size)
+        else:
+            browser_slides.append((renderer, output_path))
+    if not browser_slides:
+        return
+
+    pngs = get_browser_pool().render_many([renderer.html for renderer, _ in browser_slides], size)
+    for png, (_, output_path) in zip(pngs, browser_slides):
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(png)
+    logging.info(f"Rendered {len(browser_slides)} slides in the browser")
+
 if __name__ == "__main__":
     # Example usage
     generator = SlideRenderer()
@@ -1,50 +1,119 @@
 import asyncio
 import base64
+import contextlib
 import io
 import json
+import logging
 import os.path
 
 import cv2
 import httpx
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 from PIL.Image import Image
 
-from llm_service import generate_stable_diffusion_prompt
+from http_clients import STABLE_DIFFUSION, get_client
+from llm_service import generate_stable_diffusion_prompt, generate_stable_diffusion_prompts
 
 STABLE_DIFFUSION_URL = "http://text_to_image_container:7050/generate"
+STABLE_DIFFUSION_CONCURRENCY = int(os.getenv("STABLE_DIFFUSION_CONCURRENCY", "4"))
+STABLE_DIFFUSION_BATCH_PROMPTS = os.getenv("STABLE_DIFFUSION_BATCH_PROMPTS", "true").lower() in ("1", "true", "yes")
+IMAGES_DIR = "photos"
 
-async def generate_images(titles: List[str]) -> List[str]:
-    # Generate prompts for creating the images
-    prompts = []
-    for title in titles:
-        prompt = await generate_stable_diffusion_prompt(title)
-        prompts.append(prompt)
+logger = logging.getLogger(__name__)
 
-    output_dir = "photos"
-    os.makedirs(output_dir, exist_ok=True)
+async def generate_images(titles: List[str], concurrency: Optional[int] = None,
+                          batch_prompts: bool = STABLE_DIFFUSION_BATCH_PROMPTS,
+                          output_dir: str = IMAGES_DIR) -> List[Optional[str]]:
+    """
+    Generate one image per slide title.
+
+    In batch mode the prompts of all titles are built with a single LLM call first.
+    Otherwise every title runs its own prompt -> image chain, so each prompt is sent to
+    the stable diffusion service as soon as the LLM returns it. The number of in-flight
+    LLM calls and image renders is bounded separately by ``concurrency``.
+
+    Args:
+        titles (List[str]): The slide titles to illustrate
+        concurrency (Optional[int]): Maximum parallel requests per stage,
+            defaults to STABLE_DIFFUSION_CONCURRENCY
+        batch_prompts (bool): Build all prompts with one LLM call,
+            defaults to STABLE_DIFFUSION_BATCH_PROMPTS
+        output_dir (str): Directory where the images are written
+
+    Returns:
+        List[Optional[str]]: Absolute image paths in the same order as ``titles``,
+            with None for the slides whose image could not be generated
+    """
+    concurrency = max(1, concurrency or STABLE_DIFFUSION_CONCURRENCY)
+    prompt_semaphore = asyncio.Semaphore(concurrency)
+    image_semaphore = asyncio.Semaphore(concurrency)
+    prompts = await generate_stable_diffusion_prompts(titles) if batch_prompts else [None] * len(titles)
+
+    async def generate_or_none(idx: int, title: str) -> Optional[str]:
+        try:
+            return await generate_image(title, idx, prompt_semaphore, image_semaphore, prompts[idx], output_dir)
+        except httpx.HTTPStatusError as exc:
+            logger.warning(f"Image generation failed for '{title}' with status {exc.response.status_code}: "
+                           f"{exc.response.text}")
+        except Exception:
+            logger.exception(f"Image generation failed for '{title}'")
+        return None
+
+    return list(await asyncio.gather(*(generate_or_none(idx, title) for idx, title in enumerate(titles))))
+
+
+async def generate_image(title: str, idx: int,
+                         prompt_semaphore: Optional[asyncio.Semaphore] = None,
+                         image_semaphore: Optional[asyncio.Semaphore] = None,
+                         prompt: Optional[dict] = None,
+                         output_dir: str = IMAGES_DIR) -> str:
+    """
+    Generate the prompt for a single slide title and render it into an image.
+
+    Args:
+        title (str): The slide title the image should illustrate
+        idx (int): Index of the image, used to build the output file name
+        prompt_semaphore (Optional[asyncio.Semaphore]): Bounds the concurrent LLM calls
+        image_semaphore (Optional[asyncio.Semaphore]): Bounds the concurrent image renders
+        prompt (Optional[dict]): Prompt already built for this title, skips the LLM call
+        output_dir (str): Directory where the image is written
+
+    Returns:
+        str: Absolute path of the saved PNG
+    """
+    if prompt is None:
+        async with prompt_semaphore or contextlib.nullcontext():
+            prompt = await generate_stable_diffusion_prompt(title)
+    async with image_semaphore or contextlib.nullcontext():
+        return await render_image(prompt, idx, output_dir)
+
+
+async def render_image(prompt: dict, idx: int, output_dir: str = IMAGES_DIR) -> str:
+    """
+    Send a prompt to the stable diffusion service and save the first returned image.
 
-    file_paths = []
-    # the stable diffusion service accepts a payload of "prompt" and "negative_prompt"
-    for idx,prompt in enumerate(prompts):
-        print(prompt)
-        async with httpx.AsyncClient(timeout=None) as client:
-            try:
-                response = await client.post(STABLE_DIFFUSION_URL, json=prompt)
-                response.raise_for_status()
-                json_response = response.json()
-                base64image = json_response.get("images")[0]
-                image_path = f"photos/image_{idx}.png"
-                abs_path = os.path.abspath(image_path)
-                save_base64_as_png(base64image, abs_path)
-                file_paths.append(abs_path)
+    Args:
+        prompt (dict): Payload with "prompt" and "negative_prompt"
+        idx (int): Index of the image, used to build the output file name
+        output_dir (str): Directory where the image is written
 
-            except httpx.HTTPStatusError as exc:
-                print(f"Request failed with status {exc.response.status_code}")
-                print(f"Response body: {exc.response.text}")
+    Returns:
+        str: Absolute path of the saved PNG
+    """
+    os.makedirs(output_dir, exist_ok=True)
 
-    return file_paths
+    logger.debug(f"Stable diffusion prompt: {prompt}")
+    client = get_client(STABLE_DIFFUSION)
+    response = await client.post(STABLE_DIFFUSION_URL, json=prompt)
+    response.raise_for_status()
+    json_response = response.json()
+    base64image = json_response.get("images")[0]
+    image_path = os.path.join(output_dir, f"image_{idx}.png")
+    abs_path = os.path.abspath(image_path)
+    save_base64_as_png(base64image, abs_path)
+    return abs_path
 
 
 def save_base64_as_png(base64_string: str, output_path: str) -> None:
@@ -76,4 +145,4 @@ if __name__ == "__main__":
     # Print the file paths
     print("Generated image file paths:")
     for path in file_paths:
-        print(path)
\ No newline at end of file
+        print(path)
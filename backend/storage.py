@@ -1,4 +1,5 @@
 import os
+import shutil
 import uuid
 from typing import Optional
 from abc import ABC, abstractmethod
@@ -33,7 +34,7 @@ class S3StorageService(StorageService):
 
 class LocalStorageService(StorageService):
     def __init__(self):
-        self.videos_dir = os.path.join(os.path.dirname(__file__), "..", "videos")
+        self.videos_dir = os.path.join(os.path.dirname(__file__), "videos")
         if not os.path.exists(self.videos_dir):
             os.makedirs(self.videos_dir)
 
@@ -41,7 +42,7 @@ class LocalStorageService(StorageService):
         if not file_name:
             file_name = f"{uuid.uuid4()}.mp4"
         destination_path = os.path.join(self.videos_dir, file_name)
-        os.rename(file_path, destination_path)
+        shutil.move(file_path, destination_path)
         video_url = f"/videos/{file_name}"
         return video_url
 
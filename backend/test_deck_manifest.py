@@ -0,0 +1,40 @@
+import pytest
+
+from deck_manifest import IMAGE, RENDER, DeckManifest, is_main_slide, slide_keys, slide_template
+
+SEGMENT_SETTINGS = {"fps": 24}
+
+
+@pytest.mark.parametrize("slide", [{"title": "Untyped"}, {"type": "content", "title": "Unknown type"}])
+def test_untyped_slide_is_a_main_slide(slide):
+    assert is_main_slide(slide)
+    assert slide_template(slide, "slide_2.html") == "slide_2.html"
+
+    keys = slide_keys(slide, "character", "slide_2.html", SEGMENT_SETTINGS)
+
+    assert keys[IMAGE] is not None
+    assert keys[RENDER] is not None
+
+
+def test_intro_and_conclusion_templates():
+    assert slide_template({"type": "introduction"}, "slide_1.html") == "intro.html"
+    assert slide_template({"type": "conclusion"}, "slide_1.html") == "conclusion.html"
+    assert slide_keys({"type": "introduction", "title": "Hi"}, "character", "intro.html", SEGMENT_SETTINGS)[IMAGE] is None
+
+
+def test_pipeline_plans_untyped_slide_as_main(tmp_path):
+    pipeline = pytest.importorskip("pipeline")
+    slides = [
+        {"type": "introduction", "title": "Oceans"},
+        {"type": "main", "title": "Plastic", "bullet_points": ["Bottles"]},
+        {"title": "Nets", "bullet_points": ["Ghost nets"]},
+        {"type": "conclusion", "title": "Thanks"},
+    ]
+    manifest = DeckManifest(character="character")
+
+    presentation = pipeline.PresentationPipeline({"slides": slides}, "character", str(tmp_path), manifest=manifest)
+
+    assert [record.template for record in manifest.slides] == [
+        "intro.html", pipeline.MAIN_SLIDE_TEMPLATES[0], pipeline.MAIN_SLIDE_TEMPLATES[1], "conclusion.html",
+    ]
+    assert "image:2" in presentation.graph.nodes
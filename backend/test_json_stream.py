@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from json_stream import SlideStreamParser
+
+PRESENTATION = {
+    "parameters": {"duration": "5 minutes", "detail_level": "Beginner", "impersonation": "Narrator"},
+    "slides": [
+        {"type": "introduction", "title": "Oceans {in} \"danger\"", "subtitle": "Why it matters",
+         "script": "Welcome [everyone]."},
+        {"type": "main", "title": "Plastic", "bullet_points": ["Bottles", "Bags, nets"],
+         "script": "Plastic is everywhere."},
+        {"type": "main", "title": "Escapes \\\" and braces }", "bullet_points": ["a \\ b", "{not: an object}"],
+         "script": "Quotes \"inside\" [brackets] and ] closing ones."},
+        {"type": "conclusion", "title": "Conclusion", "subtitle": "Act now", "script": "Thank you."},
+    ],
+}
+# What the model writes around the JSON: prose and a code fence
+TEXT = "Here is your presentation:\n```json\n" + json.dumps(PRESENTATION, indent=2) + "\n```"
+
+
+def feed_in_chunks(parser: SlideStreamParser, text: str, size: int) -> list:
+    slides = []
+    for pos in range(0, len(text), size):
+        slides += parser.feed(text[pos:pos + size])
+    return slides
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 12, 64, len(TEXT)])
+def test_slides_split_across_chunks(size):
+    parser = SlideStreamParser()
+
+    slides = feed_in_chunks(parser, TEXT, size)
+
+    assert slides == PRESENTATION["slides"]
+    assert parser.slides == PRESENTATION["slides"]
+    assert parser.done
+    assert parser.text == TEXT
+
+
+def test_slide_is_returned_once_its_object_closes():
+    text = json.dumps({"slides": PRESENTATION["slides"][1:]})
+    end_of_first = text.index("}") + 1
+    parser = SlideStreamParser()
+
+    assert parser.feed(text[:end_of_first - 1]) == []
+    assert parser.feed(text[end_of_first - 1:end_of_first]) == [PRESENTATION["slides"][1]]
+    assert not parser.done
+
+
+def test_slides_key_split_across_chunks():
+    parser = SlideStreamParser()
+
+    assert parser.feed('{"sli') == []
+    assert parser.feed('des": [{"title": "A"}') == [{"title": "A"}]
+    assert parser.feed("]}") == []
+    assert parser.done
+
+
+def test_braces_in_a_string_before_the_object_closes():
+    parser = SlideStreamParser()
+
+    assert parser.feed('{"slides": [{"title": "} ] {"') == []
+    assert parser.feed(', "script": "\\"}"}') == [{"title": "} ] {", "script": "\"}"}]
+
+
+def test_text_after_the_array_is_ignored():
+    parser = SlideStreamParser()
+
+    slides = parser.feed('{"slides": [{"title": "A"}]} and {"title": "not a slide"}')
+
+    assert slides == [{"title": "A"}]
+    assert parser.done
+
+
+def test_invalid_slide():
+    parser = SlideStreamParser()
+
+    with pytest.raises(ValueError):
+        parser.feed('{"slides": [{"title": "A",}]}')
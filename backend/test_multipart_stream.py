@@ -0,0 +1,80 @@
+import pytest
+
+from multipart_stream import MultipartStreamParser, boundary_from_content_type
+
+BOUNDARY = "b0undary"
+# The audio of part 0 contains the boundary itself, only its Content-Length tells where it ends
+BODIES = {2: b"RIFF" + bytes(range(256)) * 3, 0: b"\r\n--b0undary in audio", 1: b'{"error": "boom"}'}
+
+
+def batch_response(bodies: dict) -> bytes:
+    raw = b""
+    for idx, body in bodies.items():
+        raw += (f"--{BOUNDARY}\r\nContent-Type: audio/wav\r\nX-Script-Index: {idx}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n").encode("utf-8") + body + b"\r\n"
+    return raw + f"--{BOUNDARY}--\r\n".encode("utf-8")
+
+
+def feed_in_chunks(parser: MultipartStreamParser, raw: bytes, size: int) -> list:
+    parts = []
+    for pos in range(0, len(raw), size):
+        parts += parser.feed(raw[pos:pos + size])
+    return parts
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 13, 40, 4096])
+def test_parts_split_across_chunks(size):
+    parser = MultipartStreamParser(BOUNDARY)
+
+    parts = feed_in_chunks(parser, batch_response(BODIES), size)
+
+    assert [int(headers["x-script-index"]) for headers, _ in parts] == list(BODIES)
+    assert {int(headers["x-script-index"]): body for headers, body in parts} == BODIES
+    assert parts[0][0]["content-type"] == "audio/wav"
+    assert parser.done
+
+
+def test_boundary_split_across_chunks():
+    raw = batch_response(BODIES)
+    # Cut inside the delimiter of the second part and inside the closing delimiter
+    second = raw.index(f"--{BOUNDARY}".encode("utf-8"), 1)
+    closing = raw.rindex(f"--{BOUNDARY}--".encode("utf-8"))
+    cuts = [0, second + 3, second + 9, closing + 5, len(raw)]
+    parser = MultipartStreamParser(BOUNDARY)
+
+    parts = []
+    for start, end in zip(cuts, cuts[1:]):
+        parts += parser.feed(raw[start:end])
+
+    assert {int(headers["x-script-index"]): body for headers, body in parts} == BODIES
+    assert parser.done
+
+
+def test_part_is_returned_once_its_body_is_complete():
+    raw = batch_response({0: b"first", 1: b"second"})
+    end_of_first = raw.index(b"first") + len(b"first")
+    parser = MultipartStreamParser(BOUNDARY)
+
+    assert parser.feed(raw[:end_of_first - 1]) == []
+    assert [body for _, body in parser.feed(raw[end_of_first - 1:end_of_first])] == [b"first"]
+    assert not parser.done
+
+
+def test_part_without_content_length():
+    parser = MultipartStreamParser(BOUNDARY)
+
+    with pytest.raises(ValueError):
+        parser.feed(f"--{BOUNDARY}\r\nContent-Type: audio/wav\r\n\r\naudio".encode("utf-8"))
+
+
+@pytest.mark.parametrize("content_type", [
+    f'multipart/mixed; boundary="{BOUNDARY}"',
+    f"multipart/mixed; charset=utf-8; Boundary={BOUNDARY}",
+])
+def test_boundary_from_content_type(content_type):
+    assert boundary_from_content_type(content_type) == BOUNDARY
+
+
+def test_content_type_without_boundary():
+    with pytest.raises(ValueError):
+        boundary_from_content_type("multipart/mixed")
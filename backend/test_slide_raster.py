@@ -0,0 +1,95 @@
+import functools
+import os
+import shutil
+import threading
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from slide_raster import linear_gradient, load_image, rasterize
+
+CHROMIUM_PATH = os.getenv("CHROME_BIN", "/usr/bin/chromium")
+# Largest mean absolute difference per channel (0-255) between a layout and its Chromium render
+MAX_MEAN_DIFF = float(os.getenv("SLIDE_RASTER_MAX_MEAN_DIFF", "6.0"))
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+BULLETS = [
+    "Plastic waste makes up eighty percent of all marine debris found from surface waters to deep-sea sediments",
+    "Over one hundred thousand marine mammals die every year",
+    "Microplastics enter the food chain",
+]
+SLIDES = {
+    "intro": lambda renderer, image: renderer.generate_intro_slide("Pollution in the Oceans", "A short introduction"),
+    "main_1": lambda renderer, image: renderer.generate_main_slide("Where the Plastic Comes From", BULLETS, image,
+                                                                   "slide_1.html"),
+    "main_2": lambda renderer, image: renderer.generate_main_slide("What It Does to Marine Life", BULLETS, image,
+                                                                   "slide_2.html"),
+    "main_1_without_image": lambda renderer, image: renderer.generate_main_slide("A Slide Without Its Image",
+                                                                                 BULLETS[:2], "", "slide_1.html"),
+    "conclusion": lambda renderer, image: renderer.generate_conclusion_slide("Thank You!", "Questions are welcome."),
+}
+
+
+@pytest.fixture
+def sample_image(tmp_path) -> str:
+    path = tmp_path / "sample.png"
+    linear_gradient((768, 512), "#ff7f50", "#2e8b57").save(path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def browser_pool():
+    if not shutil.which(CHROMIUM_PATH):
+        pytest.skip(f"Chromium is not installed at {CHROMIUM_PATH}, set CHROME_BIN")
+    from browser_pool import BrowserPool
+
+    pool = BrowserPool(size=1, executable=CHROMIUM_PATH)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize("slide", SLIDES)
+def test_layout_matches_chromium(slide, browser_pool, sample_image, tmp_path):
+    from slide_renderer import SlideRenderer
+
+    renderer = SlideRenderer(TEMPLATES_DIR)
+    SLIDES[slide](renderer, sample_image)
+
+    pillow = np.asarray(rasterize(renderer.template_name, renderer.fields))
+    chromium = browser_pool.render_rgb(renderer.html, (1920, 1080))
+    diff = np.abs(pillow.astype(np.int16) - chromium.astype(np.int16))
+    mean_diff = float(diff.mean())
+
+    if mean_diff > MAX_MEAN_DIFF:
+        side_by_side = np.concatenate([chromium, pillow, (255 - diff.max(axis=2, keepdims=True)).repeat(3, axis=2)],
+                                      axis=1)
+        diff_path = tmp_path / f"{slide}.png"
+        Image.fromarray(side_by_side.astype(np.uint8)).save(diff_path)
+        pytest.fail(f"{renderer.template_name} is off by {mean_diff:.2f} on average, "
+                    f"above {MAX_MEAN_DIFF}; Chromium, Pillow and their difference are in {diff_path}")
+
+
+def test_load_image_from_path_and_file_url(sample_image):
+    assert load_image(sample_image, 384, 384).size == (384, 256)
+    assert load_image(Path(sample_image).as_uri(), 1000, 1000).size == (768, 512)
+
+
+def test_load_image_from_http_url(sample_image):
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=os.path.dirname(sample_image))
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        assert load_image(f"{url}/{os.path.basename(sample_image)}", 384, 384).size == (384, 256)
+        assert load_image(f"{url}/missing.png", 384, 384) is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_load_image_that_cannot_be_loaded(tmp_path):
+    assert load_image("", 100, 100) is None
+    assert load_image(str(tmp_path / "missing.png"), 100, 100) is None
+    assert load_image("data:image/png;base64,AAAA", 100, 100) is None
@@ -1,36 +1,210 @@
-from typing import List
-import httpx
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
 import logging
 import os
+import struct
+
+from http_clients import TTS, get_client
+from multipart_stream import MultipartStreamParser, boundary_from_content_type
 
 TTS_SERVICE_URL = "http://text_to_speech_container:8080/synthesize"
+TTS_BATCH_URL = "http://text_to_speech_container:8080/synthesize-batch"
+TTS_STREAM_URL = "http://text_to_speech_container:8080/synthesize-stream"
+TTS_BATCH = os.getenv("TTS_BATCH", "true").lower() in ("1", "true", "yes")
+TTS_STREAMING = os.getenv("TTS_STREAMING", "true").lower() in ("1", "true", "yes")
+WAV_HEADER_SIZE = 44
+TTS_MODEL_CHARACTER = "default_man_en"
+AUDIO_DIR = "audio"
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-async def generate_audio_scripts(script: List[str]) -> List[str]:
-    audio_file_paths = []
-    os.makedirs("audio", exist_ok=True)
-
-    for idx, text in enumerate(script):
-        logger.info(f"Converting text to speech for slide {idx + 1}")
-        logger.info(f"Text: {text}")
-        payload = {
-            "text": text,
-            "output_file_name": f"audio_{idx}",
-            "model_character": "default_man_en",
-            "output_format": "wav",
-            "use_cuda": "false"
-        }
-
-        async with httpx.AsyncClient(timeout=None) as client:
-            response = await client.post(TTS_SERVICE_URL, data=payload)  # Use 'data' for form data
-            response.raise_for_status()
-
-            audio_file_path = f"audio/audio_{idx}.wav"
-            with open(audio_file_path, "wb") as f:
-                f.write(response.content)
-            audio_file_paths.append(audio_file_path)
+async def generate_audio_scripts(script: List[str], output_dir: str = AUDIO_DIR) -> List[str]:
+    """
+    Synthesize every script with a single batch call and return the WAV paths in order.
+    """
+    audio_file_paths: List[Optional[str]] = [None] * len(script)
+
+    async for idx, audio_file_path, error in stream_audio_batch(dict(enumerate(script)), output_dir=output_dir):
+        if error:
+            raise RuntimeError(f"Speech synthesis failed for slide {idx + 1}: {error}")
+        audio_file_paths[idx] = audio_file_path
 
     return audio_file_paths
+
+
+async def generate_audio_script(text: str, idx: int, output_dir: str = AUDIO_DIR) -> str:
+    """
+    Synthesize the script of a single slide into a WAV file.
+
+    :param text: The script to convert to speech.
+    :param idx: Index of the slide, used to build the output file name.
+    :param output_dir: Directory where the WAV file is written.
+    :return: Path of the saved WAV file.
+    """
+    audio_file_path = os.path.join(output_dir, f"audio_{idx}.wav")
+    if TTS_STREAMING:
+        logger.info(f"Streaming text to speech for slide {idx + 1}")
+        async for _ in stream_audio_script(text, audio_file_path):
+            pass
+        return audio_file_path
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    logger.info(f"Converting text to speech for slide {idx + 1}")
+    logger.info(f"Text: {text}")
+    payload = {
+        "text": text,
+        "output_file_name": f"audio_{idx}",
+        "model_character": "default_man_en",
+        "output_format": "wav",
+        "use_cuda": "false"
+    }
+
+    client = get_client(TTS)
+    response = await client.post(TTS_SERVICE_URL, data=payload)  # Use 'data' for form data
+    response.raise_for_status()
+
+    with open(audio_file_path, "wb") as f:
+        f.write(response.content)
+
+    return audio_file_path
+
+
+async def stream_audio_script(text: str, audio_file_path: str,
+                              model_character: str = TTS_MODEL_CHARACTER) -> AsyncIterator[bytes]:
+    """
+    Stream the speech of a script sentence by sentence into a WAV file.
+
+    The PCM of every chunk is yielded as soon as it is written, so a caller can start using
+    the audio after the first sentence. Once the stream ends, the sizes in the streaming WAV
+    header are patched so the file is a regular WAV.
+
+    :param text: The script to convert to speech.
+    :param audio_file_path: Path of the WAV file to write.
+    :return: Async iterator over the 16-bit mono PCM chunks.
+    """
+    os.makedirs(os.path.dirname(audio_file_path) or ".", exist_ok=True)
+    payload = {
+        "text": text,
+        "model_character": model_character,
+        "output_format": "wav",
+    }
+
+    client = get_client(TTS)
+    header = b""
+    async with client.stream("POST", TTS_STREAM_URL, data=payload) as response:
+        response.raise_for_status()
+        with open(audio_file_path, "wb") as f:
+            async for chunk in response.aiter_bytes():
+                f.write(chunk)
+                if len(header) < WAV_HEADER_SIZE:
+                    missing = WAV_HEADER_SIZE - len(header)
+                    header += chunk[:missing]
+                    chunk = chunk[missing:]
+                if chunk:
+                    yield chunk
+
+            if len(header) < WAV_HEADER_SIZE:
+                raise RuntimeError("TTS stream ended before the WAV header was received.")
+            size = f.tell()
+            f.seek(4)
+            f.write(struct.pack("<I", size - 8))
+            f.seek(WAV_HEADER_SIZE - 4)
+            f.write(struct.pack("<I", size - WAV_HEADER_SIZE))
+
+    logger.info(f"Streamed speech into {audio_file_path} ({size - WAV_HEADER_SIZE} bytes of audio)")
+
+
+async def stream_audio_batch(scripts: Dict[int, str], model_character: str = TTS_MODEL_CHARACTER,
+                             output_dir: str = AUDIO_DIR) -> AsyncIterator[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Send the scripts to the TTS batch endpoint and write every WAV as soon as its part of
+    the multipart response arrives.
+
+    :param scripts: Script of every slide keyed by slide index.
+    :param output_dir: Directory where the WAV files are written.
+    :return: Async iterator of ``(slide index, WAV path, None)``, or ``(slide index, None, error)``
+             for scripts the TTS service could not synthesize, in completion order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    indices = list(scripts)
+    payload = {
+        "scripts": [scripts[idx] for idx in indices],
+        "model_character": model_character,
+        "output_format": "wav",
+    }
+
+    logger.info(f"Converting {len(indices)} scripts to speech in one batch")
+    client = get_client(TTS)
+    async with client.stream("POST", TTS_BATCH_URL, json=payload) as response:
+        response.raise_for_status()
+        parser = MultipartStreamParser(boundary_from_content_type(response.headers["content-type"]))
+
+        async for chunk in response.aiter_bytes():
+            for headers, body in parser.feed(chunk):
+                idx = indices[int(headers["x-script-index"])]
+                if headers.get("content-type", "").startswith("application/json"):
+                    error = json.loads(body).get("error", "unknown error")
+                    logger.error(f"Speech synthesis failed for slide {idx + 1}: {error}")
+                    yield idx, None, error
+                    continue
+
+                audio_file_path = os.path.join(output_dir, f"audio_{idx}.wav")
+                with open(audio_file_path, "wb") as f:
+                    f.write(body)
+                logger.info(f"Received speech for slide {idx + 1}")
+                yield idx, audio_file_path, None
+
+    if not parser.done:
+        raise RuntimeError("TTS batch response ended before all scripts were received.")
+
+
+class AudioBatch:
+    def __init__(self, scripts: Dict[int, str], output_dir: str = AUDIO_DIR):
+        """
+        Shares one batch TTS call between the per-slide audio tasks of a presentation.
+
+        The batch request is sent when the first slide asks for its audio, and every
+        ``get`` returns as soon as the part of its own slide has been written, so the
+        deepfake of a slide does not wait for the rest of the batch.
+
+        :param scripts: Script of every slide keyed by slide index.
+        :param output_dir: Directory where the WAV files are written.
+        """
+        self.scripts = scripts
+        self.output_dir = output_dir
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, idx: int) -> str:
+        if self._task is None:
+            loop = asyncio.get_running_loop()
+            self._futures = {slide_idx: loop.create_future() for slide_idx in self.scripts}
+            self._task = asyncio.create_task(self._run())
+        return await asyncio.shield(self._futures[idx])
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        error = RuntimeError("TTS batch response did not contain this slide.")
+        try:
+            async for idx, audio_file_path, part_error in stream_audio_batch(self.scripts, output_dir=self.output_dir):
+                if part_error:
+                    self._futures[idx].set_exception(RuntimeError(f"Speech synthesis failed: {part_error}"))
+                else:
+                    self._futures[idx].set_result(audio_file_path)
+        except asyncio.CancelledError:
+            error = RuntimeError("TTS batch was cancelled.")
+            raise
+        except Exception as e:
+            logger.error(f"TTS batch failed: {e}")
+            error = e
+        finally:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(error)
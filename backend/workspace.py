@@ -0,0 +1,64 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Root of the per-job workspaces; mount a tmpfs here so the intermediate files never hit the disk
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT") or os.path.join(tempfile.gettempdir(), "promptvision")
+# Workspaces older than this are left over from a crash and removed at startup
+WORKSPACE_MAX_AGE = float(os.getenv("WORKSPACE_MAX_AGE", str(6 * 3600)))
+WORKSPACE_PREFIX = "job-"
+
+
+class Workspace:
+    def __init__(self, name: Optional[str] = None, root: str = WORKSPACE_ROOT):
+        """
+        Private directory of a single presentation, holding its images, audio, deepfakes,
+        rendered slides and video, so concurrent presentations never share a file name.
+
+        Use it as a context manager, or call ``cleanup`` once the result has been sent or
+        uploaded.
+
+        :param name: Included in the directory name, e.g. the job id, to ease debugging.
+        :param root: Directory the workspace is created in.
+        """
+        os.makedirs(root, exist_ok=True)
+        prefix = f"{WORKSPACE_PREFIX}{name}-" if name else WORKSPACE_PREFIX
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def __enter__(self) -> "Workspace":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        logger.debug(f"Removed workspace {self.path}")
+
+
+def remove_stale_workspaces(root: str = WORKSPACE_ROOT, max_age: float = WORKSPACE_MAX_AGE) -> int:
+    """
+    Remove the workspaces a crashed or killed process did not clean up.
+
+    :return: Number of workspaces removed.
+    """
+    if not os.path.isdir(root):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(root):
+        if not entry.name.startswith(WORKSPACE_PREFIX) or not entry.is_dir(follow_symlinks=False):
+            continue
+        if now - entry.stat().st_mtime > max_age:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+
+    if removed:
+        logger.info(f"Removed {removed} stale workspaces from {root}")
+    return removed
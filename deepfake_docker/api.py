@@ -11,6 +11,13 @@ from pathlib import Path
 import datetime
 import os
 import io
+import shutil
+import threading
+import uuid
+
+from clip_cache import create_clip_cache_from_env
+from job_queue import JOB_COMPLETED, JOB_FAILED, JobQueue, QueueFullError
+from outputs import FifoReader, OutputJanitor
 
 app = Bottle()
 
@@ -28,81 +35,172 @@ UPLOAD_DIR = Path("/app/uploads")
 OUTPUT_DIR = Path("/app/outputs")
 CHARACTERS_DIR = Path("/app/characters")
 WAV2LIP_MODEL_PATH = "Wav2Lip/checkpoints/wav2lip_gan.pth"
-WAV2LIP_SCRIPT_PATH = "Wav2Lip/inference.py"
 CHARACTERS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Seconds a client is asked to wait before retrying when the job queue is full
+QUEUE_RETRY_AFTER = int(os.getenv("DEEPFAKE_QUEUE_RETRY_AFTER", "10"))
 
-@app.post('/generate-deepfake')
-def generate_deepfake():
-    logger.info("Received request to /generate-deepfake")
 
-    # Get the 'character' parameter from the request
+# Read size when streaming the videos of a batch into the response
+BATCH_CHUNK_SIZE = 1024 * 1024
+STREAM_DIR = Path(os.getenv("DEEPFAKE_STREAM_DIR", "/app/temp"))
+
+
+def remove_job_audio(job):
+    for audio_path in job.audio_paths:
+        try:
+            Path(audio_path).unlink()
+        except Exception as e:
+            logger.warning(f"Failed to clean up temporary files: {e}")
+
+
+# Every request goes through this queue: a fixed number of long-lived Wav2Lip processes
+# (inference slots) serve the jobs, so bursts wait in line instead of starting more models
+job_queue = JobQueue(WAV2LIP_MODEL_PATH, on_finished=remove_job_audio)
+job_queue.start()
+
+# Videos fetched through /jobs stay in OUTPUT_DIR until they are older than the retention
+output_janitor = OutputJanitor(OUTPUT_DIR)
+output_janitor.start()
+
+# Finished clips keyed by character, audio, checkpoint and settings; None when disabled
+clip_cache = create_clip_cache_from_env(OUTPUT_DIR / "clips", WAV2LIP_MODEL_PATH)
+
+FACE_CACHE_PREWARM = os.getenv("FACE_CACHE_PREWARM", "true").lower() in ("1", "true", "yes")
+
+
+def prepare_characters_in_background(paths):
+    """
+    Fill the face cache for the given character videos on a background thread, so their
+    first lip-sync job does not pay for face detection.
+    """
+    def prepare():
+        for path in paths:
+            try:
+                if clip_cache is not None:
+                    # Hash the video for the clip cache now rather than on its first request
+                    clip_cache.file_hash(path)
+                info = job_queue.prepare(path)
+                logger.info(f"Face cache ready for {path.name}: {info['frames']} frames at {info['fps']} fps")
+            except Exception as e:
+                logger.warning(f"Failed to prepare character {path.name}: {e}")
+
+    thread = threading.Thread(target=prepare, name='prepare-characters')
+    thread.daemon = True
+    thread.start()
+
+
+if FACE_CACHE_PREWARM:
+    prepare_characters_in_background(sorted(f for f in CHARACTERS_DIR.iterdir() if f.is_file()))
+
+
+def save_job_inputs():
+    """
+    Validate the character and audio files of the current request and save the audio
+    under unique names.
+
+    :return: ``(character_video_path, audio_paths, error)``, where ``error`` is a response body
+             (with ``response.status`` already set) when the request is invalid.
+    """
     character_name = request.forms.get('character')
-    audio = request.files.get('audio')
+    audios = request.files.getall('audio')
 
     # Check if both character and audio are provided
-    if not character_name or not audio:
+    if not character_name or not audios:
         logger.warning("Missing character or audio in the request")
         response.status = 400
-        return {"error": "Character and audio files are required"}
+        return None, None, {"error": "Character and audio files are required"}
 
     logger.debug(f"Character selected: {character_name}")
-    logger.debug(f"Audio filename: {audio.filename}")
+    logger.debug(f"Audio filenames: {[audio.filename for audio in audios]}")
 
     # Validate that the character video exists
     character_video_path = CHARACTERS_DIR / character_name
     if not character_video_path.exists() or not character_video_path.is_file():
         logger.warning(f"Character video '{character_name}' does not exist")
         response.status = 400
-        return {"error": f"Character '{character_name}' does not exist"}
-
-    # Save the uploaded audio file temporarily
-    audio_path = UPLOAD_DIR / audio.filename
+        return None, None, {"error": f"Character '{character_name}' does not exist"}
 
+    # Save the uploaded audio files under unique names, so concurrent jobs never share them
+    audio_paths = []
     try:
-        audio.save(str(audio_path))
-        logger.info(f"Saved audio file to {audio_path}")
+        for audio in audios:
+            audio_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{audio.filename}"
+            audio.save(str(audio_path))
+            audio_paths.append(audio_path)
+            logger.info(f"Saved audio file to {audio_path}")
     except Exception as e:
         logger.error(f"Failed to save audio file: {e}")
+        remove_files(audio_paths)
         response.status = 500
-        return {"error": "Failed to save audio file"}
+        return None, None, {"error": "Failed to save audio file"}
 
-    output_path = OUTPUT_DIR / f"deepfake_{os.path.splitext(audio.filename)[0]}_{character_name}.mp4"
+    return character_video_path, audio_paths, None
 
-    # Run Wav2Lip inference with subprocess
-    command = [
-        "python3", WAV2LIP_SCRIPT_PATH,
-        "--checkpoint_path", WAV2LIP_MODEL_PATH,
-        "--face", str(character_video_path),
-        "--audio", str(audio_path),
-        "--outfile", str(output_path)
-    ]
 
-    logger.info(f"Executing command: {' '.join(command)}")
-    start_time = datetime.datetime.now()
+def remove_files(paths):
+    for path in paths:
+        try:
+            path.unlink()
+        except Exception:
+            pass
+
 
+def submit_job(character_video_path, audio_paths, output_paths):
+    """
+    Queue a lip-sync job, or set a 429 response and return None when the queue is full.
+    """
     try:
-        result = subprocess.run(command)
-        end_time = datetime.datetime.now()
-        duration = (end_time - start_time).total_seconds()
-        logger.info(f"Wav2Lip inference completed in {duration} seconds")
-        logger.debug(f"Subprocess stdout: {result.stdout}")
-        logger.debug(f"Subprocess stderr: {result.stderr}")
-
-        if result.returncode != 0:
-            logger.error(f"Wav2Lip inference failed with return code {result.returncode}")
-            response.status = 500
-            return {"error": f"Wav2Lip inference failed: {result.stderr}"}
-    except Exception as e:
-        logger.exception(f"Unexpected error during Wav2Lip inference: {e}")
+        return job_queue.submit_batch(character_video_path, audio_paths, output_paths)
+    except QueueFullError as e:
+        logger.warning(str(e))
+        remove_files(audio_paths)
+        response.status = 429
+        response.set_header('Retry-After', str(QUEUE_RETRY_AFTER))
+        return None
+
+
+@app.post('/generate-deepfake')
+def generate_deepfake():
+    logger.info("Received request to /generate-deepfake")
+
+    character_video_path, audio_paths, error = save_job_inputs()
+    if error is not None:
+        return error
+    if len(audio_paths) > 1:
+        remove_files(audio_paths)
+        response.status = 400
+        return {"error": "Only one audio file is accepted, use /generate-deepfake-batch for several"}
+
+    audio_path = audio_paths[0]
+    cache_key = clip_key(character_video_path, audio_path)
+    cached_path = clip_cache.get(cache_key) if cache_key else None
+    if cached_path is not None:
+        logger.info(f"Serving cached deepfake {cached_path.name} for {audio_path.name}")
+        remove_files(audio_paths)
+        return serve_cached(cached_path)
+
+    if request.forms.get('stream', '').lower() in ('1', 'true', 'yes'):
+        logger.info(f"Streaming Wav2Lip job for {character_video_path} and {audio_path}")
+        return stream_deepfake(character_video_path, audio_path, cache_key)
+
+    output_path = batch_output_paths(character_video_path, [audio_path])[0]
+
+    logger.info(f"Submitting Wav2Lip job for {character_video_path} and {audio_path}")
+    start_time = datetime.datetime.now()
+
+    job = submit_job(character_video_path, [audio_path], [output_path])
+    if job is None:
+        return {"error": "Too many deepfake jobs in progress, retry later"}
+
+    job.done.wait()
+    if job.status == JOB_FAILED:
+        logger.error(f"Wav2Lip inference failed: {job.error}")
         response.status = 500
-        return {"error": "An unexpected error occurred during processing"}
-    finally:
-        # Cleanup temporary files
-        try:
-            audio_path.unlink()
-        except Exception as e:
-            logger.warning(f"Failed to clean up temporary files: {e}")
+        return {"error": f"Wav2Lip inference failed: {job.error}"}
+
+    duration = (datetime.datetime.now() - start_time).total_seconds()
+    logger.info(f"Wav2Lip inference completed in {duration} seconds ({job.wait_seconds:.1f}s queued)")
 
     if not output_path.exists():
         logger.error(f"Output file {output_path} does not exist after inference")
@@ -114,13 +212,284 @@ def generate_deepfake():
     # Serve the output video file
     try:
         logger.info(f"Sending output video {output_path} to client")
-        return static_file(filename=output_path.name, root=str(output_path.parent), download=True)
+        if cache_key:
+            return serve_cached(clip_cache.put(cache_key, output_path))
+        return serve_and_remove(output_path)
     except Exception as e:
         logger.exception(f"Failed to send output video: {e}")
         response.status = 500
         return {"error": "Failed to send the generated video"}
 
 
+def clip_key(character_video_path, audio_path):
+    """
+    Clip cache key of a lip-sync, or None when the cache is disabled or the audio cannot
+    be hashed.
+    """
+    if clip_cache is None:
+        return None
+    try:
+        return clip_cache.key(character_video_path, clip_cache.audio_hash(audio_path))
+    except Exception as e:
+        logger.warning(f"Failed to compute the clip cache key of {audio_path}: {e}")
+        return None
+
+
+def serve_cached(cached_path):
+    return static_file(filename=cached_path.name, root=str(cached_path.parent), download=True,
+                       mimetype='video/mp4')
+
+
+def serve_and_remove(output_path):
+    """
+    Serve a generated video and remove it right away: ``static_file`` has already opened
+    it, so the response is still sent in full but nothing is left behind in OUTPUT_DIR.
+    """
+    served = static_file(filename=output_path.name, root=str(output_path.parent), download=True)
+    try:
+        output_path.unlink()
+    except Exception as e:
+        logger.warning(f"Failed to remove served video {output_path}: {e}")
+    return served
+
+
+def stream_deepfake(character_video_path, audio_path, cache_key=None):
+    """
+    Run the job with its encoder writing a fragmented MP4 into a FIFO and pipe that into
+    the response while the frames are produced. With a ``cache_key`` the streamed bytes
+    are also written to the clip cache, otherwise the video never touches the disk.
+
+    The response only starts once the first bytes are there, so a job that fails before
+    producing any video still gets a proper error status.
+    """
+    stream_dir = Path(tempfile.mkdtemp(dir=str(STREAM_DIR) if STREAM_DIR.is_dir() else None))
+    fifo_path = stream_dir / f"{audio_path.stem}.mp4"
+    os.mkfifo(str(fifo_path))
+
+    job = submit_job(character_video_path, [audio_path], [fifo_path])
+    if job is None:
+        shutil.rmtree(str(stream_dir), ignore_errors=True)
+        return {"error": "Too many deepfake jobs in progress, retry later"}
+
+    reader = FifoReader(job, fifo_path)
+    first_chunk = reader.read()
+    if not first_chunk:
+        reader.close()
+        shutil.rmtree(str(stream_dir), ignore_errors=True)
+        job.done.wait()
+        logger.error(f"Wav2Lip inference failed: {job.error}")
+        response.status = 500
+        return {"error": f"Wav2Lip inference failed: {job.error}"}
+
+    def stream():
+        cache_path = clip_cache.temp_path() if cache_key else None
+        cache_file = open(str(cache_path), 'wb') if cache_path else None
+        try:
+            chunk = first_chunk
+            while chunk:
+                if cache_file:
+                    cache_file.write(chunk)
+                yield chunk
+                chunk = reader.read()
+
+            # The encoder also closes the FIFO when the job fails midway: raising aborts the
+            # chunked body, so the client sees a broken response instead of a short video
+            job.done.wait()
+            if job.status != JOB_COMPLETED:
+                logger.error(f"Deepfake job {job.id} failed while streaming: {job.error}")
+                raise RuntimeError(f"Wav2Lip inference failed: {job.error}")
+            logger.info(f"Streamed deepfake job {job.id}")
+
+            if cache_file:
+                cache_file.close()
+                clip_cache.put(cache_key, cache_path)
+        finally:
+            # Closing the read end early (client gone) makes the encoder fail and frees the slot
+            reader.close()
+            shutil.rmtree(str(stream_dir), ignore_errors=True)
+            if cache_file:
+                cache_file.close()
+                if cache_path.exists():
+                    cache_path.unlink()
+
+    response.content_type = 'video/mp4'
+    return stream()
+
+
+def batch_output_paths(character_video_path, audio_paths):
+    return [OUTPUT_DIR / f"deepfake_{audio_path.stem}_{character_video_path.name}.mp4" for audio_path in audio_paths]
+
+
+@app.post('/generate-deepfake-batch')
+def generate_deepfake_batch():
+    """
+    Lip-sync every uploaded ``audio`` file onto the same character in a single Wav2Lip job,
+    so the model warms up and reads the character's faces once and the mel windows of all
+    the clips share inference batches.
+
+    The videos are returned as a ``multipart/mixed`` body in upload order; every part has an
+    ``X-Audio-Index`` header with the position of its audio file and a ``Content-Length``.
+    """
+    logger.info("Received request to /generate-deepfake-batch")
+
+    character_video_path, audio_paths, error = save_job_inputs()
+    if error is not None:
+        return error
+
+    # Clips already in the cache are served from it; only the others go through Wav2Lip
+    cache_keys = [clip_key(character_video_path, audio_path) for audio_path in audio_paths]
+    video_paths = [clip_cache.get(key) if key else None for key in cache_keys]
+    todo = [i for i, path in enumerate(video_paths) if path is None]
+    remove_files([audio_paths[i] for i, path in enumerate(video_paths) if path is not None])
+
+    if todo:
+        todo_audio = [audio_paths[i] for i in todo]
+        output_paths = batch_output_paths(character_video_path, todo_audio)
+        logger.info(
+            f"Submitting Wav2Lip batch of {len(todo)} audio files for {character_video_path}, "
+            f"{len(audio_paths) - len(todo)} served from the clip cache"
+        )
+        start_time = datetime.datetime.now()
+
+        job = submit_job(character_video_path, todo_audio, output_paths)
+        if job is None:
+            return {"error": "Too many deepfake jobs in progress, retry later"}
+
+        job.done.wait()
+        if job.status == JOB_FAILED:
+            logger.error(f"Wav2Lip batch inference failed: {job.error}")
+            response.status = 500
+            return {"error": f"Wav2Lip inference failed: {job.error}"}
+
+        duration = (datetime.datetime.now() - start_time).total_seconds()
+        logger.info(f"Wav2Lip batch of {len(todo)} completed in {duration} seconds ({job.wait_seconds:.1f}s queued)")
+
+        missing = [str(path) for path in output_paths if not path.exists()]
+        if missing:
+            logger.error(f"Output files {missing} do not exist after inference")
+            response.status = 500
+            return {"error": "Failed to generate the deepfake videos"}
+
+        for i, output_path in zip(todo, output_paths):
+            video_paths[i] = clip_cache.put(cache_keys[i], output_path) if cache_keys[i] else output_path
+    else:
+        logger.info(f"All {len(audio_paths)} clips of the batch served from the clip cache")
+
+    boundary = uuid.uuid4().hex
+    response.content_type = f"multipart/mixed; boundary={boundary}"
+    return stream_videos(video_paths, boundary, remove=[not key for key in cache_keys])
+
+
+def stream_videos(paths, boundary, remove):
+    """
+    Multipart body of the videos, see ``generate_deepfake_batch``.
+
+    :param remove: Whether to remove each video once sent, i.e. it is not a cached clip.
+    """
+    for idx, (path, remove_after) in enumerate(zip(paths, remove)):
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: video/mp4\r\n"
+            f"Content-Disposition: attachment; filename=\"{path.name}\"\r\n"
+            f"X-Audio-Index: {idx}\r\n"
+            f"Content-Length: {path.stat().st_size}\r\n\r\n"
+        )
+        yield headers.encode('utf-8')
+        with open(str(path), 'rb') as f:
+            for chunk in iter(lambda: f.read(BATCH_CHUNK_SIZE), b''):
+                yield chunk
+        if remove_after:
+            path.unlink()
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode('utf-8')
+
+
+@app.post('/jobs')
+def create_job():
+    logger.info("Received request to /jobs")
+
+    character_video_path, audio_paths, error = save_job_inputs()
+    if error is not None:
+        return error
+
+    job = submit_job(character_video_path, audio_paths, batch_output_paths(character_video_path, audio_paths))
+    if job is None:
+        return {"error": "Too many deepfake jobs in progress, retry later"}
+
+    response.status = 202
+    response.set_header('Location', f"/jobs/{job.id}")
+    body = job.to_dict()
+    body["queue_depth"] = job_queue.metrics()["queue_depth"]
+    return body
+
+
+@app.get('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        response.status = 404
+        return {"error": f"Job '{job_id}' does not exist"}
+    return job.to_dict()
+
+
+@app.get('/jobs/<job_id>/result')
+def get_job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        response.status = 404
+        return {"error": f"Job '{job_id}' does not exist"}
+    if job.status == JOB_FAILED:
+        response.status = 500
+        return {"error": f"Wav2Lip inference failed: {job.error}"}
+    if job.status != JOB_COMPLETED:
+        response.status = 409
+        return {"error": f"Job '{job_id}' is {job.status}"}
+
+    try:
+        output_path = Path(job.output_paths[int(request.query.get('index', 0))])
+    except (ValueError, IndexError):
+        response.status = 400
+        return {"error": f"Job '{job_id}' has {len(job.output_paths)} outputs"}
+    if not output_path.exists():
+        response.status = 410
+        return {"error": f"Result of job '{job_id}' is no longer available"}
+    return static_file(filename=output_path.name, root=str(output_path.parent), download=True)
+
+
+@app.get('/clips/<character>/<audio_sha256>')
+def get_clip(character, audio_sha256):
+    """
+    Cached lip-sync of the audio with the given SHA-256 onto the character. A HEAD request
+    only tells whether the clip is cached, so a client can skip uploading the audio.
+    """
+    character_video_path = CHARACTERS_DIR / character
+    if clip_cache is None or not character_video_path.is_file():
+        response.status = 404
+        return {"error": "Clip is not cached"}
+
+    cached_path = clip_cache.get(clip_cache.key(character_video_path, audio_sha256.lower()))
+    if cached_path is None:
+        response.status = 404
+        return {"error": "Clip is not cached"}
+    logger.info(f"Serving cached deepfake {cached_path.name} by lookup")
+    return serve_cached(cached_path)
+
+
+@app.get('/metrics')
+def metrics():
+    return job_queue.metrics()
+
+
+@app.get('/health')
+def health_check():
+    return {
+        "status": "healthy",
+        "wav2lip": job_queue.metrics()["workers"],
+        "outputs": output_janitor.stats(),
+        "clip_cache": clip_cache.stats() if clip_cache is not None else None,
+    }
+
+
 @app.post('/upload-character')
 def upload_character():
     logger.info("Received request to /upload-character")
@@ -154,6 +523,7 @@ def upload_character():
                     f.write(mp4_content)
 
                 logger.info(f"Saved converted MP4 video to {character_video_path}")
+                prepare_characters_in_background([character_video_path])
                 return {"message": "Character video converted and uploaded successfully"}
 
             except (subprocess.CalledProcessError, Exception) as e:
@@ -171,6 +541,7 @@ def upload_character():
 
             video.save(str(character_video_path))
             logger.info(f"Saved original video file to {character_video_path}")
+            prepare_characters_in_background([character_video_path])
             return {"message": "Character video uploaded successfully"}
 
     except Exception as e:
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import voice_activity
+import wav2lip_worker
+from face_cache import FACE_CACHE_VERSION, video_sha256
+
+logger = logging.getLogger('wav2lip_service')
+
+DEEPFAKE_CLIP_CACHE = os.getenv("DEEPFAKE_CLIP_CACHE", "true").lower() in ("1", "true", "yes")
+DEEPFAKE_CLIP_CACHE_MAX_BYTES = int(os.getenv("DEEPFAKE_CLIP_CACHE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+# Entries used this recently are never evicted, so a clip being served is not deleted under it
+EVICTION_GRACE_SECONDS = 60
+
+
+def output_settings():
+    """
+    Everything besides the inputs and the checkpoint that changes the produced video.
+    """
+    return {
+        "codec": wav2lip_worker.WAV2LIP_VIDEO_CODEC_ARGS,
+        "pads": wav2lip_worker.PADS,
+        "img_size": wav2lip_worker.IMG_SIZE,
+        "face_cache": FACE_CACHE_VERSION,
+        "vad": [
+            voice_activity.VAD_ENABLED,
+            voice_activity.VAD_DYNAMIC_RANGE_DB,
+            voice_activity.VAD_FLOOR_DB,
+            voice_activity.VAD_MIN_SILENCE_SECONDS,
+            voice_activity.VAD_PAD_SECONDS,
+            voice_activity.VAD_CROSSFADE_SECONDS,
+        ],
+    }
+
+
+class ClipCache(object):
+    def __init__(self, cache_dir, checkpoint_path, max_bytes=DEEPFAKE_CLIP_CACHE_MAX_BYTES):
+        """
+        Finished lip-sync videos keyed by the content of everything that produced them: the
+        character video, the audio, the checkpoint and the output settings. Reruns, retries
+        and regenerated decks get their unchanged clips back without running Wav2Lip.
+
+        Clips are moved into the cache with ``os.replace``, so a reader never sees a partial
+        file. Eviction is least recently used by total bytes: a hit refreshes the clip's
+        mtime, and the oldest clips are removed once ``max_bytes`` is exceeded.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_path = checkpoint_path
+        self.max_bytes = max_bytes
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def file_hash(self, path):
+        """
+        SHA-256 of a file, memoised on its path, size and modification time.
+        """
+        stat = os.stat(str(path))
+        signature = (os.path.abspath(str(path)), stat.st_size, stat.st_mtime)
+        with self._lock:
+            digest = self._hashes.get(signature)
+        if digest is None:
+            digest = video_sha256(str(path))
+            with self._lock:
+                self._hashes[signature] = digest
+        return digest
+
+    @staticmethod
+    def audio_hash(audio_path):
+        # Uploads have unique paths, so their hashes are not memoised
+        return video_sha256(str(audio_path))
+
+    def key(self, character_video_path, audio_sha256):
+        payload = json.dumps({
+            "character": self.file_hash(character_video_path),
+            "audio": audio_sha256,
+            "checkpoint": self.file_hash(self.checkpoint_path),
+            "settings": output_settings(),
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.mp4"
+
+    def get(self, key):
+        """
+        Path of the cached clip, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            os.utime(str(path))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def temp_path(self):
+        """
+        Path for a clip being written, on the cache's filesystem so ``put`` is a rename.
+        """
+        fd, path = tempfile.mkstemp(dir=str(self.cache_dir), prefix='.tmp-', suffix='.mp4')
+        os.close(fd)
+        return Path(path)
+
+    def put(self, key, video_path):
+        """
+        Move a finished video into the cache and return its new path.
+        """
+        path = self._path(key)
+        os.replace(str(video_path), str(path))
+        self.evict()
+        return path
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(str(self.cache_dir)):
+            if entry.name.startswith('.tmp-') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+
+            now = time.time()
+            evicted = 0
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes or now - mtime < EVICTION_GRACE_SECONDS:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+            self.evicted += evicted
+
+        if evicted:
+            logger.info(f"Evicted {evicted} clips from the clip cache, {total} bytes left")
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def create_clip_cache_from_env(cache_dir, checkpoint_path):
+    if not DEEPFAKE_CLIP_CACHE:
+        return None
+    return ClipCache(cache_dir, checkpoint_path, DEEPFAKE_CLIP_CACHE_MAX_BYTES)
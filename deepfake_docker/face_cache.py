@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger('wav2lip_service')
+
+FACE_CACHE_DIR = os.getenv("FACE_CACHE_DIR", "/app/data/face_cache")
+FACE_CACHE_MAX_BYTES = int(os.getenv("FACE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# Bump when the detection parameters (pads, smoothing, crop size) change
+FACE_CACHE_VERSION = 1
+# Bump when the stored files change; unlike the version, it leaves the lip-synced clips valid
+FACE_CACHE_FORMAT = 2
+# Entries used this recently are never evicted, so a character being prepared keeps its files
+EVICTION_GRACE_SECONDS = 60
+
+
+def video_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CharacterFaces(object):
+    def __init__(self, faces, boxes, fps, frame_size):
+        """
+        Everything Wav2Lip needs from a character video besides its frames, which are decoded
+        for every job: at full resolution they are far too large to keep.
+
+        :param faces: Face crop of every frame resized to the model input, ``(N, S, S, 3)`` uint8.
+        :param boxes: Smoothed face box ``(y1, y2, x1, x2)`` of every frame, ``(N, 4)`` int32.
+        :param fps: Frame rate of the video.
+        :param frame_size: Width and height of the frames.
+        """
+        self.faces = faces
+        self.boxes = boxes
+        self.fps = fps
+        self.frame_size = frame_size
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class FaceCache(object):
+    def __init__(self, cache_dir=FACE_CACHE_DIR, max_bytes=FACE_CACHE_MAX_BYTES):
+        """
+        On-disk cache of face detections, keyed by the SHA-256 of the character video, so
+        each presenter is run through S3FD only once.
+
+        Only the face crops at the model input size and the boxes are stored, a few tens of
+        kilobytes per frame. The crops are stored as ``.npy`` files and opened with
+        ``mmap_mode='r'``. Files are written under a temporary name and moved into place,
+        and the metadata file is written last, so a half-written entry is never picked up.
+
+        Eviction is least recently used by total bytes: loading an entry refreshes the mtime
+        of its metadata file, and the oldest entries are removed once ``max_bytes`` is exceeded.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._hashes = {}
+        self._loaded = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def key(self, video_path):
+        """
+        Content hash of the video, memoised on its path, size and modification time.
+        """
+        stat = os.stat(video_path)
+        signature = (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            digest = self._hashes.get(signature)
+        if digest is None:
+            digest = video_sha256(video_path)
+            with self._lock:
+                self._hashes[signature] = digest
+        return "{}-v{}-f{}".format(digest, FACE_CACHE_VERSION, FACE_CACHE_FORMAT)
+
+    def _path(self, key, name):
+        return os.path.join(self.cache_dir, "{}.{}".format(key, name))
+
+    def load(self, video_path):
+        """
+        Cached faces of the video, or None when it has not been prepared yet.
+        """
+        key = self.key(video_path)
+        meta_path = self._path(key, 'json')
+        try:
+            os.utime(meta_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._loaded.pop(key, None)
+                self.misses += 1
+            return None
+
+        with self._lock:
+            if key in self._loaded:
+                self.hits += 1
+                return self._loaded[key]
+
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        character = self._open(key, meta)
+        with self._lock:
+            self._loaded[key] = character
+            self.hits += 1
+        return character
+
+    def _open(self, key, meta):
+        return CharacterFaces(
+            faces=np.load(self._path(key, 'faces.npy'), mmap_mode='r'),
+            boxes=np.load(self._path(key, 'boxes.npy')),
+            fps=meta['fps'],
+            frame_size=tuple(meta['frame_size']),
+        )
+
+    def store(self, video_path, faces, boxes, fps, frame_size):
+        """
+        Write the face crops and boxes of a video and return them, the crops memory-mapped.
+        """
+        key = self.key(video_path)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        for name, array in (('faces.npy', faces), ('boxes.npy', boxes)):
+            self._write(self._path(key, name), lambda f, array=array: np.save(f, array))
+        meta = {'fps': fps, 'frames': len(boxes), 'frame_size': list(frame_size),
+                'video': os.path.basename(video_path)}
+        self._write(self._path(key, 'json'), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+        logger.info("Cached {} face boxes of {} as {}".format(len(boxes), video_path, key))
+        character = self._open(key, meta)
+        with self._lock:
+            self._loaded[key] = character
+        self.evict()
+        return character
+
+    @staticmethod
+    def _write(path, write):
+        tmp_path = "{}.tmp-{}".format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _entries(self):
+        """
+        Every entry as ``(last use, total bytes, paths, key)``. The last use is the mtime of
+        the metadata file, or of the newest file of an entry still being written.
+        """
+        files = {}
+        if not os.path.isdir(self.cache_dir):
+            return []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and '.tmp-' not in entry.name:
+                files.setdefault(entry.name.split('.', 1)[0], []).append((entry.path, entry.stat()))
+
+        entries = []
+        for key, stats in files.items():
+            meta_mtimes = [stat.st_mtime for path, stat in stats if path.endswith('.json')]
+            mtime = meta_mtimes[0] if meta_mtimes else max(stat.st_mtime for _, stat in stats)
+            entries.append((mtime, sum(stat.st_size for _, stat in stats), [path for path, _ in stats], key))
+        return entries
+
+    def evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _, _ in entries)
+            if total <= self.max_bytes:
+                return
+
+            now = time.time()
+            evicted = 0
+            for mtime, size, paths, key in sorted(entries):
+                if total <= self.max_bytes or now - mtime < EVICTION_GRACE_SECONDS:
+                    break
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                self._loaded.pop(key, None)
+                total -= size
+                evicted += 1
+            self.evicted += evicted
+
+        if evicted:
+            logger.info("Evicted {} characters from the face cache, {} bytes left".format(evicted, total))
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "loaded": len(self._loaded),
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,181 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from wav2lip_worker import Wav2LipWorker
+
+logger = logging.getLogger('wav2lip_service')
+
+DEEPFAKE_SLOTS = int(os.getenv("DEEPFAKE_SLOTS", "1"))
+DEEPFAKE_QUEUE_SIZE = int(os.getenv("DEEPFAKE_QUEUE_SIZE", "16"))
+DEEPFAKE_JOB_HISTORY = int(os.getenv("DEEPFAKE_JOB_HISTORY", "200"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeepfakeJob(object):
+    def __init__(self, character_video_path, audio_paths, output_paths):
+        """
+        Lip-sync of one or more audio files onto the same character; several audio files are
+        run as a single batch on the worker.
+        """
+        self.id = uuid.uuid4().hex
+        self.character_video_path = character_video_path
+        self.audio_paths = list(audio_paths)
+        self.output_paths = list(output_paths)
+        self.status = JOB_QUEUED
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def wait_seconds(self):
+        if self.started_at is None:
+            return time.time() - self.created_at
+        return self.started_at - self.created_at
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "outputs": len(self.output_paths),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "run_seconds": round(self.finished_at - self.started_at, 3)
+            if self.started_at and self.finished_at else None,
+        }
+
+
+class JobQueue(object):
+    def __init__(self, checkpoint_path, slots=DEEPFAKE_SLOTS, queue_size=DEEPFAKE_QUEUE_SIZE,
+                 history_size=DEEPFAKE_JOB_HISTORY, on_finished=None):
+        """
+        Bounded queue of lip-sync jobs served by a fixed number of inference slots.
+
+        Every slot owns one ``Wav2LipWorker`` process, so at most ``slots`` models are loaded
+        and running no matter how many requests arrive at once; further jobs wait in a FIFO
+        of ``queue_size`` entries, and submissions beyond that are rejected with
+        ``QueueFullError`` instead of piling up.
+
+        :param on_finished: Optional callback called with every job once it finishes.
+        """
+        self.slots = max(1, slots)
+        self.queue_size = queue_size
+        self.history_size = history_size
+        self.on_finished = on_finished
+        self.workers = [Wav2LipWorker(checkpoint_path) for _ in range(self.slots)]
+        self.jobs = OrderedDict()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._wait_times = deque(maxlen=200)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        for idx, worker in enumerate(self.workers):
+            worker.start()
+            thread = threading.Thread(target=self._serve, args=(worker,), name='deepfake-slot-{}'.format(idx))
+            thread.daemon = True
+            thread.start()
+        logger.info(f"Started {self.slots} deepfake inference slots (queue size {self.queue_size})")
+
+    def submit(self, character_video_path, audio_path, output_path):
+        return self.submit_batch(character_video_path, [audio_path], [output_path])
+
+    def submit_batch(self, character_video_path, audio_paths, output_paths):
+        """
+        Queue the lip-sync of several audio files onto the same character as one job, which
+        takes a single slot and a single queue entry.
+        """
+        job = DeepfakeJob(character_video_path, audio_paths, output_paths)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError(f"Deepfake queue is full ({self.queue_size} jobs waiting)")
+
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.history_size:
+                oldest_id, oldest = next(iter(self.jobs.items()))
+                if oldest.status in (JOB_QUEUED, JOB_RUNNING):
+                    break
+                self.jobs.pop(oldest_id)
+        logger.info(f"Queued deepfake job {job.id} with {len(job.audio_paths)} audio files ({self._queue.qsize()} waiting)")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def prepare(self, character_video_path):
+        return self.workers[0].prepare(character_video_path)
+
+    def _serve(self, worker):
+        while True:
+            job = self._queue.get()
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            with self._lock:
+                self.running += 1
+                self._wait_times.append(job.wait_seconds)
+            logger.info(f"Running deepfake job {job.id} after {job.wait_seconds:.1f}s in the queue")
+
+            try:
+                if len(job.audio_paths) == 1:
+                    worker.run(job.character_video_path, job.audio_paths[0], job.output_paths[0])
+                else:
+                    worker.run_batch(job.character_video_path, job.audio_paths, job.output_paths)
+                job.status = JOB_COMPLETED
+            except Exception as e:
+                logger.error(f"Deepfake job {job.id} failed: {e}")
+                job.status = JOB_FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self.running -= 1
+                    if job.status == JOB_COMPLETED:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                job.done.set()
+                self._queue.task_done()
+                if self.on_finished is not None:
+                    try:
+                        self.on_finished(job)
+                    except Exception as e:
+                        logger.warning(f"Post-processing of deepfake job {job.id} failed: {e}")
+
+    def metrics(self):
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            metrics = {
+                "slots": self.slots,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self.queue_size,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_avg": round(sum(wait_times) / len(wait_times), 3) if wait_times else None,
+                "wait_seconds_p95": round(wait_times[int(0.95 * (len(wait_times) - 1))], 3) if wait_times else None,
+            }
+        metrics["workers"] = [worker.stats() for worker in self.workers]
+        return metrics
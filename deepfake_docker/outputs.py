@@ -0,0 +1,123 @@
+import logging
+import os
+import select
+import threading
+import time
+
+logger = logging.getLogger('wav2lip_service')
+
+DEEPFAKE_OUTPUT_RETENTION_SECONDS = float(os.getenv("DEEPFAKE_OUTPUT_RETENTION_SECONDS", "3600"))
+DEEPFAKE_OUTPUT_MAX_BYTES = int(os.getenv("DEEPFAKE_OUTPUT_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+DEEPFAKE_OUTPUT_GC_INTERVAL = float(os.getenv("DEEPFAKE_OUTPUT_GC_INTERVAL", "300"))
+STREAM_CHUNK_SIZE = 256 * 1024
+# Files touched this recently are never removed, so a video being written or served is safe
+GC_GRACE_SECONDS = 60
+
+
+class FifoReader(object):
+    def __init__(self, job, fifo_path):
+        """
+        Reads a job's output from the FIFO its encoder writes to, as the video is produced.
+
+        The FIFO is opened without blocking, so a job that fails before its encoder opens
+        the other end does not leave the request hanging: the end of the stream is reported
+        once data has been read and the writer has closed, or once the job is over.
+        """
+        self.job = job
+        self.fd = os.open(str(fifo_path), os.O_RDONLY | os.O_NONBLOCK)
+        self.started = False
+
+    def read(self):
+        """
+        Next chunk of the video, or ``b''`` at the end of the stream.
+        """
+        while True:
+            readable, _, _ = select.select([self.fd], [], [], 0.5)
+            if not readable:
+                if self.job.done.is_set() and not self.started:
+                    return b''
+                continue
+            chunk = os.read(self.fd, STREAM_CHUNK_SIZE)
+            if chunk:
+                self.started = True
+                return chunk
+            # End of file: either the encoder closed its end or it has not opened it yet
+            if self.started or self.job.done.is_set():
+                return b''
+            time.sleep(0.05)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class OutputJanitor(object):
+    def __init__(self, directory, max_age=DEEPFAKE_OUTPUT_RETENTION_SECONDS,
+                 max_bytes=DEEPFAKE_OUTPUT_MAX_BYTES, interval=DEEPFAKE_OUTPUT_GC_INTERVAL):
+        """
+        Retention policy of the generated videos: files older than ``max_age`` seconds are
+        removed, then the oldest ones until the directory holds at most ``max_bytes``.
+
+        :param interval: Seconds between two sweeps of the background thread.
+        """
+        self.directory = str(directory)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.removed = 0
+        self.removed_bytes = 0
+
+    def start(self):
+        thread = threading.Thread(target=self._loop, name='output-janitor')
+        thread.daemon = True
+        thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Failed to clean up the output directory: {e}")
+            time.sleep(self.interval)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def sweep(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed = 0
+        for mtime, size, path in entries:
+            age = now - mtime
+            if age < GC_GRACE_SECONDS:
+                break
+            if age <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            self.removed_bytes += size
+
+        if removed:
+            self.removed += removed
+            logger.info(f"Removed {removed} old videos from {self.directory}, {total} bytes left")
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "files": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+            "removed": self.removed,
+            "removed_bytes": self.removed_bytes,
+        }
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+
+VAD_ENABLED = os.getenv("WAV2LIP_VAD", "true").lower() in ("1", "true", "yes")
+# A frame is voiced when its energy is within this many dB of the loudest frame...
+VAD_DYNAMIC_RANGE_DB = float(os.getenv("VAD_DYNAMIC_RANGE_DB", "35"))
+# ...and above this absolute floor
+VAD_FLOOR_DB = float(os.getenv("VAD_FLOOR_DB", "-50"))
+# Pauses shorter than this are kept voiced, so the mouth does not snap shut between words
+VAD_MIN_SILENCE_SECONDS = float(os.getenv("VAD_MIN_SILENCE_SECONDS", "0.4"))
+# Voiced spans are widened by this much, so the mouth opens before the first syllable
+VAD_PAD_SECONDS = float(os.getenv("VAD_PAD_SECONDS", "0.08"))
+VAD_CROSSFADE_SECONDS = float(os.getenv("VAD_CROSSFADE_SECONDS", "0.12"))
+
+
+def frame_energy_db(wav, fps, n_frames, window_seconds, sample_rate=16000):
+    """
+    RMS energy in dBFS of the audio window each video frame is lip-synced to.
+
+    :param wav: Mono float audio in ``[-1, 1]``.
+    :param window_seconds: Length of the window starting at every frame, i.e. the span of
+                           the mel window the model sees for it.
+    """
+    window = max(1, int(window_seconds * sample_rate))
+    energy = np.empty(n_frames)
+    for i in range(n_frames):
+        start = int(i * sample_rate / fps)
+        chunk = wav[start:start + window]
+        rms = np.sqrt(np.mean(np.square(chunk, dtype=np.float64))) if len(chunk) else 0.0
+        energy[i] = 20 * np.log10(max(rms, 1e-10))
+    return energy
+
+
+def voiced_frames(energy_db, fps, dynamic_range_db=VAD_DYNAMIC_RANGE_DB, floor_db=VAD_FLOOR_DB,
+                  min_silence_seconds=VAD_MIN_SILENCE_SECONDS, pad_seconds=VAD_PAD_SECONDS):
+    """
+    Boolean mask of the frames that carry speech.
+
+    Frames are voiced when their energy is close enough to the loudest frame of the clip;
+    voiced spans are then padded on both sides and pauses shorter than
+    ``min_silence_seconds`` are filled in.
+    """
+    if not len(energy_db):
+        return np.zeros(0, dtype=bool)
+    voiced = (energy_db > energy_db.max() - dynamic_range_db) & (energy_db > floor_db)
+
+    pad = int(round(pad_seconds * fps))
+    if pad:
+        padded = voiced.copy()
+        for shift in range(1, pad + 1):
+            padded[shift:] |= voiced[:-shift]
+            padded[:-shift] |= voiced[shift:]
+        voiced = padded
+
+    min_silence = int(round(min_silence_seconds * fps))
+    voiced_idx = np.flatnonzero(voiced)
+    for start, end in zip(voiced_idx[:-1], voiced_idx[1:]):
+        if 1 < end - start <= min_silence:
+            voiced[start + 1:end] = True
+    return voiced
+
+
+def blend_weights(voiced, fps, crossfade_seconds=VAD_CROSSFADE_SECONDS):
+    """
+    Weight of the lip-synced face in every frame: 1 on voiced frames, ramping linearly down
+    to 0 over the crossfade on both sides of every voiced span, and 0 elsewhere, where the
+    original character frame is used untouched.
+    """
+    weights = voiced.astype(np.float32)
+    crossfade = int(round(crossfade_seconds * fps))
+    for step in range(1, crossfade + 1):
+        weight = 1.0 - step / float(crossfade + 1)
+        near = np.zeros_like(voiced)
+        near[step:] |= voiced[:-step]
+        near[:-step] |= voiced[step:]
+        weights = np.maximum(weights, near * weight)
+    return weights
+
+
+def lip_sync_weights(wav, fps, n_frames, window_seconds, sample_rate=16000):
+    """
+    Blend weight of every video frame of a clip, see ``blend_weights``; all ones when voice
+    activity detection is disabled.
+    """
+    if not VAD_ENABLED:
+        return np.ones(n_frames, dtype=np.float32)
+    energy = frame_energy_db(wav, fps, n_frames, window_seconds, sample_rate)
+    return blend_weights(voiced_frames(energy, fps), fps)
@@ -0,0 +1,593 @@
+import logging
+import multiprocessing
+import os
+import queue
+import shlex
+import shutil
+import signal
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+
+from face_cache import FaceCache
+from voice_activity import lip_sync_weights
+
+logger = logging.getLogger('wav2lip_service')
+
+WAV2LIP_DIR = "Wav2Lip"
+WAV2LIP_TEMP_DIR = os.getenv("WAV2LIP_TEMP_DIR", "/app/temp")
+WAV2LIP_DEVICE = os.getenv("WAV2LIP_DEVICE", "")  # empty picks CUDA when available
+WAV2LIP_BATCH_SIZE = int(os.getenv("WAV2LIP_BATCH_SIZE", "128"))
+FACE_DET_BATCH_SIZE = int(os.getenv("FACE_DET_BATCH_SIZE", "16"))
+WAV2LIP_JOB_TIMEOUT = float(os.getenv("WAV2LIP_JOB_TIMEOUT", "900"))
+WAV2LIP_STARTUP_TIMEOUT = float(os.getenv("WAV2LIP_STARTUP_TIMEOUT", "300"))
+WAV2LIP_VIDEO_CODEC_ARGS = shlex.split(
+    os.getenv("WAV2LIP_VIDEO_CODEC_ARGS", "-c:v libx264 -preset veryfast -crf 18 -pix_fmt yuv420p")
+)
+# Fragments of streamed outputs are flushed at least this often, in microseconds
+FRAGMENT_DURATION_US = 1000000
+
+# Same defaults as Wav2Lip/inference.py
+IMG_SIZE = 96
+MEL_STEP_SIZE = 16
+PADS = (0, 10, 0, 0)
+BOX_SMOOTHING_WINDOW = 5
+
+READY = "__ready__"
+
+
+class Wav2LipError(Exception):
+    pass
+
+
+class Wav2LipInference(object):
+    def __init__(self, checkpoint_path, device=WAV2LIP_DEVICE):
+        """
+        The Wav2Lip model and the face detector, loaded once. Only meant to be created
+        inside the worker process, since it imports torch and initialises CUDA.
+        """
+        sys.path.insert(0, os.path.abspath(WAV2LIP_DIR))
+        import audio
+        import torch
+        import face_detection
+        from models import Wav2Lip
+
+        self.audio = audio
+        self.torch = torch
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+
+        if self.device == 'cuda':
+            checkpoint = torch.load(checkpoint_path)
+        else:
+            checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        state_dict = {k.replace('module.', ''): v for k, v in checkpoint["state_dict"].items()}
+
+        model = Wav2Lip()
+        model.load_state_dict(state_dict)
+        self.model = model.to(self.device).eval()
+
+        self.detector = face_detection.FaceAlignment(
+            face_detection.LandmarksType._2D, flip_input=False, device=self.device
+        )
+        self.face_cache = FaceCache()
+
+    def read_frames(self, face_path):
+        import cv2
+
+        video_stream = cv2.VideoCapture(face_path)
+        fps = video_stream.get(cv2.CAP_PROP_FPS)
+        frames = []
+        while True:
+            still_reading, frame = video_stream.read()
+            if not still_reading:
+                video_stream.release()
+                break
+            frames.append(frame)
+        if not frames:
+            raise Wav2LipError("Could not read any frame from {}".format(face_path))
+        return frames, fps
+
+    def detect_faces(self, frames):
+        """
+        Face box ``(y1, y2, x1, x2)`` of every frame, padded and smoothed over time.
+        """
+        import numpy as np
+
+        batch_size = FACE_DET_BATCH_SIZE
+        while True:
+            predictions = []
+            try:
+                for i in range(0, len(frames), batch_size):
+                    predictions.extend(self.detector.get_detections_for_batch(np.array(frames[i:i + batch_size])))
+            except RuntimeError:
+                if batch_size == 1:
+                    raise Wav2LipError("Image too big to run face detection on GPU.")
+                batch_size //= 2
+                logger.warning("Face detection ran out of memory, retrying with batch size {}".format(batch_size))
+                continue
+            break
+
+        pady1, pady2, padx1, padx2 = PADS
+        boxes = []
+        for rect, frame in zip(predictions, frames):
+            if rect is None:
+                raise Wav2LipError("Face not detected! Ensure the video contains a face in all the frames.")
+            y1 = max(0, rect[1] - pady1)
+            y2 = min(frame.shape[0], rect[3] + pady2)
+            x1 = max(0, rect[0] - padx1)
+            x2 = min(frame.shape[1], rect[2] + padx2)
+            boxes.append([x1, y1, x2, y2])
+
+        boxes = np.array(boxes)
+        for i in range(len(boxes)):
+            window = boxes[i:i + BOX_SMOOTHING_WINDOW] if i + BOX_SMOOTHING_WINDOW <= len(boxes) \
+                else boxes[len(boxes) - BOX_SMOOTHING_WINDOW:]
+            boxes[i] = np.mean(window, axis=0)
+
+        return [(int(y1), int(y2), int(x1), int(x2)) for (x1, y1, x2, y2) in boxes]
+
+    def prepare(self, face_path, frames=None, fps=None):
+        """
+        Face crops and boxes of a character video, detected and cached the first time the
+        video is seen and memory-mapped from the face cache afterwards.
+
+        :param frames: Decoded frames of the video with their ``fps``, when the caller
+                       already has them; the video is decoded otherwise.
+        """
+        import cv2
+        import numpy as np
+
+        character = self.face_cache.load(face_path)
+        if character is not None:
+            return character
+
+        started = time.time()
+        if frames is None:
+            frames, fps = self.read_frames(face_path)
+        boxes = self.detect_faces(frames)
+        faces = [cv2.resize(frame[y1:y2, x1:x2], (IMG_SIZE, IMG_SIZE)) for frame, (y1, y2, x1, x2) in zip(frames, boxes)]
+        frame_h, frame_w = frames[0].shape[:2]
+        character = self.face_cache.store(
+            face_path, np.asarray(faces), np.asarray(boxes, dtype=np.int32), fps, (frame_w, frame_h)
+        )
+        logger.info("Prepared {} in {:.1f}s".format(face_path, time.time() - started))
+        return character
+
+    def prepare_character(self, face_path):
+        character = self.prepare(face_path)
+        return {"frames": len(character), "fps": character.fps}
+
+    def mel_chunks(self, wav, fps):
+        import numpy as np
+
+        mel = self.audio.melspectrogram(wav)
+        if np.isnan(mel.reshape(-1)).sum() > 0:
+            raise Wav2LipError("Mel contains nan! Using a TTS voice? Add a small epsilon noise to the wav file.")
+
+        chunks = []
+        mel_idx_multiplier = 80. / fps
+        i = 0
+        while True:
+            start_idx = int(i * mel_idx_multiplier)
+            if start_idx + MEL_STEP_SIZE > len(mel[0]):
+                chunks.append(mel[:, len(mel[0]) - MEL_STEP_SIZE:])
+                break
+            chunks.append(mel[:, start_idx:start_idx + MEL_STEP_SIZE])
+            i += 1
+        return chunks
+
+    def batches(self, character, frames, clips, weights):
+        """
+        Model batches over the mel windows of every clip, in order, skipping the frames whose
+        blend weight is 0 since they keep the original character frame.
+
+        Each clip starts again from the first frame of the character video, exactly as if it
+        were lip-synced on its own, but windows of consecutive clips share batches, so short
+        clips still fill ``WAV2LIP_BATCH_SIZE``.
+
+        :param frames: Decoded frames of the character video.
+        :param clips: Mel windows of every clip, as returned by ``mel_chunks``.
+        :param weights: Blend weight of every frame of every clip, see ``lip_sync_weights``.
+        :return: Iterator of ``(img_batch, mel_batch, items)``, where every item is
+                 ``(clip index, frame index, frame, face box, weight)``.
+        """
+        import numpy as np
+
+        selected = [(clip_idx, i) for clip_idx, clip_weights in enumerate(weights)
+                    for i in np.flatnonzero(clip_weights > 0)]
+        for start in range(0, len(selected), WAV2LIP_BATCH_SIZE):
+            img_batch, mel_batch, items = [], [], []
+            for clip_idx, i in selected[start:start + WAV2LIP_BATCH_SIZE]:
+                idx = i % len(character)
+                img_batch.append(character.faces[idx])
+                mel_batch.append(clips[clip_idx][i])
+                items.append((clip_idx, i, frames[idx].copy(),
+                              tuple(int(v) for v in character.boxes[idx]), float(weights[clip_idx][i])))
+
+            img_batch, mel_batch = np.asarray(img_batch), np.asarray(mel_batch)
+            img_masked = img_batch.copy()
+            img_masked[:, IMG_SIZE // 2:] = 0
+            img_batch = np.concatenate((img_masked, img_batch), axis=3) / 255.
+            mel_batch = np.reshape(mel_batch, [len(mel_batch), mel_batch.shape[1], mel_batch.shape[2], 1])
+
+            yield img_batch, mel_batch, items
+
+    def run(self, face_path, audio_path, outfile):
+        """
+        Lip-sync the face video to the audio and write the result to ``outfile``.
+        """
+        return self.run_batch(face_path, [audio_path], [outfile])[0]
+
+    def run_batch(self, face_path, audio_paths, outfiles):
+        """
+        Lip-sync the face video to every audio file in a single pass over the model, writing
+        one video per audio file.
+
+        Only the frames that carry speech, plus a short crossfade around them, go through
+        the model; during pauses the original character frames are written untouched.
+        """
+        import cv2
+        import numpy as np
+
+        work_dir = tempfile.mkdtemp(dir=WAV2LIP_TEMP_DIR if os.path.isdir(WAV2LIP_TEMP_DIR) else None)
+        try:
+            wav_paths = []
+            for clip_idx, audio_path in enumerate(audio_paths):
+                if not audio_path.endswith('.wav'):
+                    wav_path = os.path.join(work_dir, 'audio_{}.wav'.format(clip_idx))
+                    _run_ffmpeg(['ffmpeg', '-y', '-i', audio_path, '-strict', '-2', wav_path])
+                    audio_path = wav_path
+                wav_paths.append(audio_path)
+
+            frames, fps = self.read_frames(face_path)
+            character = self.prepare(face_path, frames, fps)
+            if len(frames) != len(character):
+                raise Wav2LipError("Decoded {} frames from {} but its faces were cached for {}".format(
+                    len(frames), face_path, len(character)))
+            clips, weights = [], []
+            for wav_path in wav_paths:
+                wav = self.audio.load_wav(wav_path, 16000)
+                mels = self.mel_chunks(wav, character.fps)
+                clips.append(mels)
+                weights.append(lip_sync_weights(wav, character.fps, len(mels), MEL_STEP_SIZE / 80.))
+
+            frame_w, frame_h = character.frame_size
+            writers = [
+                VideoEncoder(outfile, wav_path, character.fps, frame_w, frame_h,
+                             os.path.join(work_dir, 'ffmpeg_{}.log'.format(i)))
+                for i, (wav_path, outfile) in enumerate(zip(wav_paths, outfiles))
+            ]
+            # Next frame to write of every clip; frames skipped by the model are filled in from
+            # the character video right before the next lip-synced frame
+            written = [0] * len(clips)
+
+            def write_original(clip_idx, until):
+                for i in range(written[clip_idx], until):
+                    writers[clip_idx].write(frames[i % len(frames)])
+                written[clip_idx] = max(written[clip_idx], until)
+
+            try:
+                with self.torch.no_grad():
+                    for img_batch, mel_batch, items in self.batches(character, frames, clips, weights):
+                        img_batch = self.torch.FloatTensor(np.transpose(img_batch, (0, 3, 1, 2))).to(self.device)
+                        mel_batch = self.torch.FloatTensor(np.transpose(mel_batch, (0, 3, 1, 2))).to(self.device)
+
+                        pred = self.model(mel_batch, img_batch)
+                        pred = pred.cpu().numpy().transpose(0, 2, 3, 1) * 255.
+
+                        for p, (clip_idx, i, f, (y1, y2, x1, x2), weight) in zip(pred, items):
+                            face = cv2.resize(p.astype(np.uint8), (x2 - x1, y2 - y1))
+                            if weight < 1:
+                                face = cv2.addWeighted(face, weight, f[y1:y2, x1:x2], 1 - weight, 0)
+                            f[y1:y2, x1:x2] = face
+                            write_original(clip_idx, i)
+                            writers[clip_idx].write(f)
+                            written[clip_idx] = i + 1
+
+                for clip_idx, mels in enumerate(clips):
+                    write_original(clip_idx, len(mels))
+                for writer in writers:
+                    writer.close()
+            finally:
+                for writer in writers:
+                    writer.abort()
+
+            total_frames = sum(len(mels) for mels in clips)
+            synced_frames = sum(int((clip_weights > 0).sum()) for clip_weights in weights)
+            logger.info("Ran Wav2Lip on {} of {} frames, the rest are silent".format(synced_frames, total_frames))
+            return list(outfiles)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class VideoEncoder(object):
+    def __init__(self, outfile, audio_path, fps, width, height, log_path):
+        """
+        ffmpeg process that encodes raw BGR frames from its stdin and muxes them with the
+        audio straight into the final MP4, with no intermediate video file.
+
+        When ``outfile`` is a FIFO, e.g. one the API is streaming to a client, the output is
+        a fragmented MP4 flushed every ``FRAGMENT_DURATION_US``, which needs no seeking and
+        can be played while it is still being written.
+        """
+        self.outfile = outfile
+        self.log_path = log_path
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '{}x{}'.format(width, height), '-r', str(fps), '-i', '-',
+            '-i', audio_path,
+        ] + WAV2LIP_VIDEO_CODEC_ARGS + ['-c:a', 'aac', '-b:a', '192k']
+        if os.path.exists(outfile) and stat.S_ISFIFO(os.stat(outfile).st_mode):
+            command += [
+                '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+                '-frag_duration', str(FRAGMENT_DURATION_US), '-f', 'mp4',
+            ]
+        command.append(outfile)
+
+        self._log = open(log_path, 'wb')
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._log)
+
+    def _error(self):
+        self._log.flush()
+        with open(self.log_path, 'rb') as f:
+            message = f.read().decode('utf-8', 'replace')[-2000:]
+        return Wav2LipError("ffmpeg failed to encode {}: {}".format(self.outfile, message))
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, ValueError):
+            self.process.wait()
+            raise self._error()
+
+    def close(self):
+        """
+        Finish the video and wait for ffmpeg to write the last of it.
+        """
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise self._error()
+
+    def abort(self):
+        """
+        Stop ffmpeg if it is still running; a no-op once ``close`` has returned.
+        """
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+def _run_ffmpeg(command):
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    if process.returncode != 0:
+        raise Wav2LipError("ffmpeg failed: {}".format(stderr.decode('utf-8', 'replace')[-2000:]))
+
+
+def _worker_main(checkpoint_path, device, jobs, results):
+    """
+    Entry point of the worker process: load the model once, then serve jobs until a None
+    job arrives.
+    """
+    started = time.time()
+    try:
+        inference = Wav2LipInference(checkpoint_path, device)
+    except Exception:
+        results.put((READY, None, traceback.format_exc()))
+        return
+    results.put((READY, inference.device, None))
+    logger.info("Wav2Lip worker ready on {} in {:.1f}s".format(inference.device, time.time() - started))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, method, args = job
+        try:
+            results.put((job_id, getattr(inference, method)(*args), None))
+        except Exception:
+            results.put((job_id, None, traceback.format_exc()))
+
+
+class Wav2LipWorker(object):
+    def __init__(self, checkpoint_path, device=WAV2LIP_DEVICE):
+        """
+        Owns a long-lived process that keeps the Wav2Lip checkpoint and the face detector
+        loaded, and feeds it jobs through a queue, so requests no longer pay for importing
+        torch, initialising CUDA and loading the model.
+
+        The process runs on CUDA when a device is available and on the CPU otherwise. It is
+        started with ``spawn`` so CUDA is never initialised in a forked process, and it is
+        restarted automatically if it dies.
+        """
+        self.checkpoint_path = checkpoint_path
+        self.device = device
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._process = None
+        self._jobs = None
+        self._results = None
+        self._ready = threading.Event()
+        self._startup_error = None
+        self._generation = 0
+        self.active_device = None
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            if self._process is not None:
+                self.restarts += 1
+                logger.warning("Wav2Lip worker exited, restarting it")
+
+            self._jobs = self._ctx.Queue()
+            self._results = self._ctx.Queue()
+            self._ready.clear()
+            self._startup_error = None
+            self._process = self._ctx.Process(
+                target=_worker_main,
+                args=(self.checkpoint_path, self.device, self._jobs, self._results),
+                name='wav2lip-worker',
+            )
+            self._process.daemon = True
+            self._process.start()
+
+            self._generation += 1
+            dispatcher = threading.Thread(
+                target=self._dispatch, args=(self._process, self._results, self._generation),
+                name='wav2lip-dispatcher',
+            )
+            dispatcher.daemon = True
+            dispatcher.start()
+            logger.info("Started Wav2Lip worker process {}".format(self._process.pid))
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                self._jobs.put(None)
+                self._process.join(10)
+                if self._process.is_alive():
+                    self._process.terminate()
+
+    def _restart(self, generation, reason):
+        """
+        Terminate the worker process of ``generation`` and start a new one. The jobs still
+        pending on the old process fail once the dispatcher sees it exit.
+        """
+        with self._lock:
+            process = self._process
+            if generation != self._generation or process is None or not process.is_alive():
+                return
+            logger.error("Terminating Wav2Lip worker process {}: {}".format(process.pid, reason))
+            process.terminate()
+        process.join(10)
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        self.start()
+
+    def _dispatch(self, process, results, generation):
+        while True:
+            try:
+                job_id, result, error = results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    error = "Wav2Lip worker exited with code {}".format(process.exitcode)
+                    if process is self._process and not self._ready.is_set():
+                        self._startup_error = error
+                        self._ready.set()
+                    self._fail_pending(generation, error)
+                    return
+                continue
+
+            if job_id == READY:
+                self.active_device = result
+                self._startup_error = error
+                self._ready.set()
+                if error:
+                    logger.error("Wav2Lip worker failed to start:\n{}".format(error))
+                continue
+
+            with self._lock:
+                pending = self._pending.pop(job_id, None)
+            if pending is not None:
+                pending['result'] = result
+                pending['error'] = error
+                pending['event'].set()
+
+    def _fail_pending(self, generation, error):
+        with self._lock:
+            failed = [job_id for job_id, job in self._pending.items() if job['generation'] == generation]
+            jobs = [self._pending.pop(job_id) for job_id in failed]
+        for job in jobs:
+            job['error'] = error
+            job['event'].set()
+
+    def run(self, face_path, audio_path, outfile, timeout=WAV2LIP_JOB_TIMEOUT):
+        """
+        Run one lip-sync job on the worker and block until its video is written.
+
+        :return: Path of the output video.
+        :raises Wav2LipError: If the worker fails, dies or does not answer within ``timeout``.
+        """
+        return self._call('run', (str(face_path), str(audio_path), str(outfile)), timeout)
+
+    def run_batch(self, face_path, audio_paths, outfiles, timeout=None):
+        """
+        Lip-sync several audio files onto the same character in one job, so their mel windows
+        share model batches, and block until every video is written.
+
+        :param timeout: Defaults to ``WAV2LIP_JOB_TIMEOUT`` per audio file.
+        :return: Paths of the output videos, in the order of ``audio_paths``.
+        :raises Wav2LipError: If the worker fails, dies or does not answer within ``timeout``.
+        """
+        if timeout is None:
+            timeout = WAV2LIP_JOB_TIMEOUT * len(audio_paths)
+        args = (str(face_path), [str(path) for path in audio_paths], [str(path) for path in outfiles])
+        return self._call('run_batch', args, timeout)
+
+    def prepare(self, face_path, timeout=WAV2LIP_JOB_TIMEOUT):
+        """
+        Detect the faces of the character video into the face cache, so later lip-sync
+        jobs with it skip face detection.
+
+        :return: Number of frames and frame rate of the video.
+        """
+        return self._call('prepare_character', (str(face_path),), timeout)
+
+    def _call(self, method, args, timeout):
+        self.start()
+        if not self._ready.wait(WAV2LIP_STARTUP_TIMEOUT):
+            raise Wav2LipError("Wav2Lip worker did not start in time")
+        if self._startup_error:
+            raise Wav2LipError("Wav2Lip worker failed to start: {}".format(self._startup_error))
+
+        job_id = uuid.uuid4().hex
+        job = {'event': threading.Event(), 'result': None, 'error': None}
+        with self._lock:
+            job['generation'] = self._generation
+            self._pending[job_id] = job
+            jobs = self._jobs
+        jobs.put((job_id, method, args))
+
+        if not job['event'].wait(timeout):
+            with self._lock:
+                self._pending.pop(job_id, None)
+            self.failed += 1
+            # The worker is still busy with the job, or hung on it: every later job would
+            # queue behind it, so it is replaced like a worker that died
+            self._restart(job['generation'], "{} job timed out after {}s".format(method, timeout))
+            raise Wav2LipError("Wav2Lip {} job timed out after {}s".format(method, timeout))
+        if job['error']:
+            self.failed += 1
+            raise Wav2LipError(job['error'])
+
+        self.completed += 1
+        return job['result']
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            alive = self._process is not None and self._process.is_alive()
+        return {
+            "alive": alive,
+            "ready": self._ready.is_set() and not self._startup_error,
+            "device": self.active_device,
+            "pending": pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+        }
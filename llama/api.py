@@ -1,8 +1,16 @@
+import json
+from typing import AsyncIterator, Iterable, Optional
+
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse
+from pydantic import AliasChoices, BaseModel, Field
 import boto3
 from botocore.exceptions import ClientError
 
+from bedrock_executor import BackpressureError, create_executor_from_env
+from response_cache import ResponseCache, create_cache_from_env
+from token_budget import MAX_MODEL_TOKENS, create_budget_from_env
+
 # Initialize FastAPI application
 app = FastAPI(
     title="Bedrock Chat API",
@@ -17,51 +25,78 @@ except Exception as e:
     print(f"Failed to initialize Bedrock client: {str(e)}")
     raise
 
+MODEL_ID = "meta.llama3-1-70b-instruct-v1:0"
+
+response_cache = create_cache_from_env()
+bedrock_executor = create_executor_from_env()
+token_budget = create_budget_from_env()
+
+# Budget of requests that are not presentations and do not ask for one explicitly
+DEFAULT_MAX_TOKENS = 4000
+COMPLETE_STOP_REASONS = ("end_turn", "stop_sequence")
+
 class ChatRequest(BaseModel):
     input_text: str
-    duration_minutes: float = Field(default=1.0, gt=0, description="Duration in minutes")
+    duration_minutes: Optional[float] = Field(
+        default=None,
+        gt=0,
+        validation_alias=AliasChoices("duration_minutes", "duration"),
+        description="Duration of the presentation in minutes, used to size the token budget",
+    )
+    max_tokens: Optional[int] = Field(
+        default=None, gt=0, le=MAX_MODEL_TOKENS, description="Explicit token budget, overrides the duration"
+    )
+    bypass_cache: bool = Field(default=False, description="Skip the response cache for this request")
 
 class ChatResponse(BaseModel):
     response_text: str
 
-def calculate_max_tokens(duration_minutes: float) -> int:
-    """
-    Calculate maximum tokens based on duration in minutes.
-    """
-    words_per_minute = 200
-    tokens_per_word = 1.5
-    base_tokens = 100
-    
-    calculated_tokens = int(duration_minutes * words_per_minute * tokens_per_word)
-    return max(base_tokens, min(calculated_tokens, 4096))
-
 @app.post("/chat")
 async def chat(request: ChatRequest):
     """
     Endpoint to handle chat conversations using AWS Bedrock's `converse` method.
     """
     try:
-        max_tokens = calculate_max_tokens(request.duration_minutes)
-        
-        conversation = [
-            {
-                "role": "user",
-                "content": [{"text": request.input_text}]
-            }
-        ]
-
-        response = client.converse(
-            modelId="meta.llama3-1-70b-instruct-v1:0",
-            messages=conversation,
-            inferenceConfig={
-                "maxTokens": 4000,
-                "temperature": 0.5,
-                "topP": 0.9,
-            },
-        )
+        conversation, inference_config = _build_conversation(request)
+
+        cache_key = _cache_key(conversation, inference_config)
+        if request.bypass_cache:
+            response_cache.record_bypass()
+        else:
+            cached_text = response_cache.get(cache_key)
+            if cached_text is not None:
+                return {"response_text": cached_text}
+
+        while True:
+            response = await bedrock_executor.run(
+                client.converse,
+                modelId=MODEL_ID,
+                messages=conversation,
+                inferenceConfig=inference_config,
+            )
 
-        response_text = response["output"]["message"]["content"][0]["text"]
-        return {"response_text": response_text.strip()}
+            response_text = response["output"]["message"]["content"][0]["text"].strip()
+            stop_reason = response.get("stopReason")
+            token_budget.record(
+                request.duration_minutes,
+                inference_config["maxTokens"],
+                response.get("usage", {}).get("outputTokens"),
+                response.get("metrics", {}).get("latencyMs"),
+                stop_reason,
+                response_text,
+            )
+            retry_max_tokens = _retry_max_tokens(request, inference_config["maxTokens"], stop_reason)
+            if retry_max_tokens is None:
+                break
+            print(f"Response cut off at {inference_config['maxTokens']} tokens, retrying with {retry_max_tokens}")
+            inference_config = {**inference_config, "maxTokens": retry_max_tokens}
+
+        if stop_reason in COMPLETE_STOP_REASONS:
+            response_cache.set(cache_key, response_text)
+        return {"response_text": response_text}
+
+    except BackpressureError as e:
+        raise _too_many_requests(e)
 
     except ClientError as e:
         error_code = e.response.get("Error", {}).get("Code", "Unknown")
@@ -79,9 +114,211 @@ async def chat(request: ChatRequest):
             detail=f"Internal server error: {str(e)}"
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Endpoint streaming the completion as newline-delimited JSON using AWS Bedrock's
+    `converse_stream` method.
+
+    Every line is one of:
+      {"type": "delta", "text": "..."}
+      {"type": "done", "stop_reason": "...", "usage": {...}}
+      {"type": "error", "detail": "..."}
+    """
+    conversation, inference_config = _build_conversation(request)
+    cache_key = _cache_key(conversation, inference_config)
+
+    if request.bypass_cache:
+        response_cache.record_bypass()
+    else:
+        cached_text = response_cache.get(cache_key)
+        if cached_text is not None:
+            lines = [
+                _ndjson({"type": "delta", "text": cached_text}),
+                _ndjson({"type": "done", "stop_reason": "cached", "usage": None}),
+            ]
+            return StreamingResponse(iter(lines), media_type="application/x-ndjson")
+
+    # The slot is held for the whole stream and released by stream_converse_events
+    try:
+        await bedrock_executor.acquire()
+    except BackpressureError as e:
+        raise _too_many_requests(e)
+
+    try:
+        response = await bedrock_executor.call(
+            client.converse_stream,
+            modelId=MODEL_ID,
+            messages=conversation,
+            inferenceConfig=inference_config,
+        )
+    except ClientError as e:
+        bedrock_executor.release()
+        error_code = e.response.get("Error", {}).get("Code", "Unknown")
+        error_message = e.response.get("Error", {}).get("Message", str(e))
+        print(f"AWS Bedrock Error ({error_code}): {error_message}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"AWS Bedrock Error ({error_code}): {error_message}"
+        )
+    except Exception:
+        bedrock_executor.release()
+        raise
+
+    return StreamingResponse(
+        stream_converse_events(
+            response["stream"],
+            cache_key,
+            release_slot=True,
+            duration_minutes=request.duration_minutes,
+            max_tokens=inference_config["maxTokens"],
+            conversation=conversation,
+            inference_config=inference_config,
+            # Budget the stream continues with should the model be cut off
+            retry_max_tokens=_retry_max_tokens(request, inference_config["maxTokens"], "max_tokens"),
+        ),
+        media_type="application/x-ndjson",
+    )
+
+async def stream_converse_events(events: Iterable[dict], cache_key: str = None,
+                                 release_slot: bool = False, duration_minutes: Optional[float] = None,
+                                 max_tokens: int = DEFAULT_MAX_TOKENS, conversation: Optional[list] = None,
+                                 inference_config: Optional[dict] = None,
+                                 retry_max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Translate a `converse_stream` event stream into NDJSON lines.
+
+    Every blocking read of the Bedrock stream runs on the executor thread pool, so the event
+    loop stays free while waiting for tokens. The full text is cached once the model stops,
+    and the token usage is recorded against the budget.
+
+    When the stream is cut off by the budget and ``retry_max_tokens`` is given, the text
+    already sent cannot be taken back, so the model is asked to continue it with that budget
+    and the continuation is streamed as if it were the same response.
+    """
+    parts = []
+    stop_reason = None
+    iterator = iter(events)
+    try:
+        while True:
+            event = await bedrock_executor.call(next, iterator, None)
+            if event is None:
+                break
+            if "contentBlockDelta" in event:
+                text = event["contentBlockDelta"].get("delta", {}).get("text")
+                if text:
+                    parts.append(text)
+                    yield _ndjson({"type": "delta", "text": text})
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"].get("stopReason")
+            elif "metadata" in event:
+                text = "".join(parts).strip()
+                usage = event["metadata"].get("usage")
+                token_budget.record(
+                    duration_minutes,
+                    max_tokens,
+                    (usage or {}).get("outputTokens"),
+                    event["metadata"].get("metrics", {}).get("latencyMs"),
+                    stop_reason,
+                    text,
+                )
+                if retry_max_tokens and stop_reason == "max_tokens" and conversation:
+                    print(f"Stream cut off at {max_tokens} tokens, continuing it with {retry_max_tokens}")
+                    response = await bedrock_executor.call(
+                        client.converse_stream,
+                        modelId=MODEL_ID,
+                        messages=conversation + [{"role": "assistant", "content": [{"text": text}]}],
+                        inferenceConfig={**inference_config, "maxTokens": retry_max_tokens},
+                    )
+                    iterator = iter(response["stream"])
+                    # The continuation alone is no sample of the length of a presentation
+                    duration_minutes = None
+                    max_tokens, retry_max_tokens, stop_reason = retry_max_tokens, None, None
+                    continue
+                if cache_key and stop_reason in COMPLETE_STOP_REASONS:
+                    response_cache.set(cache_key, text)
+                yield _ndjson({
+                    "type": "done",
+                    "stop_reason": stop_reason,
+                    "usage": usage,
+                    "max_tokens": max_tokens,
+                })
+    except Exception as e:
+        print(f"Error while streaming from Bedrock: {e}")
+        yield _ndjson({"type": "error", "detail": str(e)})
+    finally:
+        if release_slot:
+            bedrock_executor.release()
+
+def _too_many_requests(error: BackpressureError) -> HTTPException:
+    print(f"Rejecting request: {error}")
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": "5"})
+
+def _retry_max_tokens(request: ChatRequest, max_tokens: int, stop_reason: Optional[str]) -> Optional[int]:
+    """
+    Budget to retry a response cut off by the budget with, so truncated JSON never reaches
+    the caller. Only budgets sized from the duration are retried, an explicit ``max_tokens``
+    is what the caller asked for.
+    """
+    if stop_reason != "max_tokens" or request.max_tokens is not None or request.duration_minutes is None:
+        return None
+    return MAX_MODEL_TOKENS if max_tokens < MAX_MODEL_TOKENS else None
+
+def _ndjson(payload: dict) -> str:
+    return json.dumps(payload) + "\n"
+
+def _build_conversation(request: ChatRequest):
+    if request.max_tokens is not None:
+        max_tokens = request.max_tokens
+    elif request.duration_minutes is not None:
+        max_tokens = token_budget.max_tokens(request.duration_minutes)
+    else:
+        max_tokens = DEFAULT_MAX_TOKENS
+
+    conversation = [
+        {
+            "role": "user",
+            "content": [{"text": request.input_text}]
+        }
+    ]
+    inference_config = {
+        "maxTokens": max_tokens,
+        "temperature": 0.5,
+        "topP": 0.9,
+    }
+    return conversation, inference_config
+
+def _cache_key(conversation: list, inference_config: dict) -> str:
+    # The budget is left out of the key: only responses that finished on their own are
+    # cached, and those are valid whatever limit the request was given.
+    sampling_config = {key: value for key, value in inference_config.items() if key != "maxTokens"}
+    return ResponseCache.make_key(MODEL_ID, sampling_config, conversation)
+
+@app.get("/metrics/tokens")
+async def token_metrics():
+    """
+    Output tokens per second, budget utilisation and the samples the budget is learned from.
+    """
+    return token_budget.metrics()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """
+    Hit/miss counters and size of the response cache.
+    """
+    return response_cache.stats()
+
+@app.delete("/cache")
+async def clear_cache():
+    """
+    Drop every cached response from memory and disk.
+    """
+    response_cache.clear()
+    return {"status": "cleared"}
+
 @app.get("/health")
 async def health_check():
     """
-    Health check endpoint to verify if the API is running.
+    Health check endpoint to verify if the API is running, with the current Bedrock load.
     """
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy", "bedrock": bedrock_executor.stats()}
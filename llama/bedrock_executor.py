@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class BackpressureError(Exception):
+    pass
+
+
+class BedrockExecutor:
+    def __init__(self, max_in_flight: int = 8, max_queue: int = 32, queue_timeout: float = 30.0):
+        """
+        Runs the synchronous boto3 Bedrock calls on a dedicated thread pool so they never
+        block the event loop, and bounds how many of them run at once.
+
+        :param max_in_flight: Maximum number of concurrent Bedrock calls (and pool threads).
+        :param max_queue: Maximum number of requests waiting for a free slot; requests beyond
+                          this are rejected straight away.
+        :param queue_timeout: Seconds a request may wait for a slot before it is rejected.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="bedrock")
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.completed = 0
+
+    async def acquire(self):
+        """
+        Wait for a free slot, raising ``BackpressureError`` when the queue is full or the
+        wait exceeds ``queue_timeout``. Every successful call must be paired with ``release``.
+        """
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise BackpressureError(f"Too many requests waiting for the model ({self.waiting} queued).")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise BackpressureError(f"Timed out after {self.queue_timeout}s waiting for the model.")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.completed += 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Run ``func`` on the thread pool without taking a slot, for work that already holds one.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Take a slot and run ``func`` on the thread pool.
+        """
+        async with self.slot():
+            return await self.call(func, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+def create_executor_from_env() -> BedrockExecutor:
+    return BedrockExecutor(
+        max_in_flight=int(os.getenv("BEDROCK_MAX_IN_FLIGHT", "8")),
+        max_queue=int(os.getenv("BEDROCK_MAX_QUEUE", "32")),
+        queue_timeout=float(os.getenv("BEDROCK_QUEUE_TIMEOUT", "30")),
+    )
@@ -0,0 +1,188 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from bedrock_executor import BedrockExecutor
+from response_cache import ResponseCache
+from token_budget import TokenBudget
+
+
+def delta(text: str) -> dict:
+    return {"contentBlockDelta": {"delta": {"text": text}, "contentBlockIndex": 0}}
+
+
+def message_stop(stop_reason: str) -> dict:
+    return {"messageStop": {"stopReason": stop_reason}}
+
+
+def metadata(output_tokens: int) -> dict:
+    return {"metadata": {"usage": {"inputTokens": 10, "outputTokens": output_tokens}, "metrics": {"latencyMs": 250}}}
+
+
+def failing_stream(events: list, error: Exception):
+    yield from events
+    raise error
+
+
+class FakeBedrock:
+    def __init__(self, *streams):
+        self.streams = list(streams)
+        self.calls = []
+
+    def converse_stream(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"stream": self.streams.pop(0)}
+
+    def converse(self, **kwargs):
+        self.calls.append(kwargs)
+        parts, stop_reason, output_tokens = [], None, None
+        for event in self.streams.pop(0):
+            if "contentBlockDelta" in event:
+                parts.append(event["contentBlockDelta"]["delta"]["text"])
+            elif "messageStop" in event:
+                stop_reason = event["messageStop"]["stopReason"]
+            elif "metadata" in event:
+                output_tokens = event["metadata"]["usage"]["outputTokens"]
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": "".join(parts)}]}},
+            "stopReason": stop_reason,
+            "usage": {"outputTokens": output_tokens},
+            "metrics": {"latencyMs": 250},
+        }
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    """
+    Test client of the API with a fresh cache, executor and token budget.
+    """
+    monkeypatch.setattr(api, "response_cache", ResponseCache())
+    monkeypatch.setattr(api, "bedrock_executor", BedrockExecutor(max_in_flight=2, max_queue=0))
+    monkeypatch.setattr(api, "token_budget", TokenBudget())
+    with TestClient(api.app) as client:
+        yield client
+
+
+def use_stream(monkeypatch, *streams) -> FakeBedrock:
+    bedrock = FakeBedrock(*streams)
+    monkeypatch.setattr(api.client, "converse_stream", bedrock.converse_stream)
+    monkeypatch.setattr(api.client, "converse", bedrock.converse)
+    return bedrock
+
+
+def post_stream(chat: TestClient, text: str = "Tell me about caching", **fields) -> list:
+    response = chat.post("/chat/stream", json={"input_text": text, **fields})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def cached(text: str = "Tell me about caching"):
+    conversation, inference_config = api._build_conversation(api.ChatRequest(input_text=text))
+    return api.response_cache.get(api._cache_key(conversation, inference_config))
+
+
+def test_completed_stream(chat, monkeypatch):
+    use_stream(monkeypatch, iter([delta("Hello"), delta(", world"), message_stop("end_turn"), metadata(3)]))
+
+    lines = post_stream(chat)
+
+    assert lines == [
+        {"type": "delta", "text": "Hello"},
+        {"type": "delta", "text": ", world"},
+        {"type": "done", "stop_reason": "end_turn", "usage": {"inputTokens": 10, "outputTokens": 3},
+         "max_tokens": api.DEFAULT_MAX_TOKENS},
+    ]
+    assert api.bedrock_executor.in_flight == 0
+    assert cached() == "Hello, world"
+    assert api.token_budget.metrics()["output_tokens"] == 3
+
+
+def test_completed_stream_is_served_from_cache(chat, monkeypatch):
+    use_stream(monkeypatch, iter([delta("Hello"), message_stop("end_turn"), metadata(1)]))
+    post_stream(chat)
+    bedrock = use_stream(monkeypatch, iter([]))
+
+    lines = post_stream(chat)
+
+    assert lines == [
+        {"type": "delta", "text": "Hello"},
+        {"type": "done", "stop_reason": "cached", "usage": None},
+    ]
+    assert bedrock.calls == []
+
+
+def test_truncated_stream_is_not_cached(chat, monkeypatch):
+    use_stream(monkeypatch, iter([delta("Hel"), message_stop("max_tokens"), metadata(4000)]))
+
+    lines = post_stream(chat)
+
+    assert lines[-1]["type"] == "done"
+    assert lines[-1]["stop_reason"] == "max_tokens"
+    assert api.bedrock_executor.in_flight == 0
+    assert cached() is None
+    assert api.token_budget.metrics()["truncated"] == 1
+
+
+def test_stream_failing_midway(chat, monkeypatch):
+    use_stream(monkeypatch, failing_stream([delta("Hel")], RuntimeError("connection reset")))
+
+    lines = post_stream(chat)
+
+    assert lines == [
+        {"type": "delta", "text": "Hel"},
+        {"type": "error", "detail": "connection reset"},
+    ]
+    assert api.bedrock_executor.in_flight == 0
+    assert cached() is None
+    assert api.token_budget.metrics()["requests"] == 0
+
+
+def test_slot_released_after_failed_streams(chat, monkeypatch):
+    # More failures than slots: a leaked slot would reject the later requests with a 429
+    for _ in range(api.bedrock_executor.max_in_flight + 1):
+        use_stream(monkeypatch, failing_stream([], RuntimeError("throttled")))
+        assert post_stream(chat) == [{"type": "error", "detail": "throttled"}]
+
+    assert api.bedrock_executor.in_flight == 0
+    assert api.bedrock_executor.completed == api.bedrock_executor.max_in_flight + 1
+
+
+def test_truncated_presentation_stream_is_continued(chat, monkeypatch):
+    budget = api.token_budget.max_tokens(1)
+    bedrock = use_stream(
+        monkeypatch,
+        iter([delta('{"slides": ['), message_stop("max_tokens"), metadata(budget)]),
+        iter([delta("]}"), message_stop("end_turn"), metadata(2)]),
+    )
+
+    lines = post_stream(chat, duration_minutes=1)
+
+    assert [line["text"] for line in lines if line["type"] == "delta"] == ['{"slides": [', "]}"]
+    assert lines[-1]["type"] == "done"
+    assert lines[-1]["stop_reason"] == "end_turn"
+    assert lines[-1]["max_tokens"] == api.MAX_MODEL_TOKENS
+    assert bedrock.calls[0]["inferenceConfig"]["maxTokens"] == budget
+    assert bedrock.calls[1]["inferenceConfig"]["maxTokens"] == api.MAX_MODEL_TOKENS
+    assert bedrock.calls[1]["messages"][-1] == {"role": "assistant", "content": [{"text": '{"slides": ['}]}
+    assert api.bedrock_executor.in_flight == 0
+    assert api.token_budget.metrics()["samples"] == 1
+    assert api.token_budget.metrics()["truncated"] == 1
+
+
+def test_truncated_presentation_is_retried(chat, monkeypatch):
+    budget = api.token_budget.max_tokens(1)
+    bedrock = use_stream(
+        monkeypatch,
+        iter([delta('{"slides": ['), message_stop("max_tokens"), metadata(budget)]),
+        iter([delta('{"slides": []}'), message_stop("end_turn"), metadata(5)]),
+    )
+
+    response = chat.post("/chat", json={"input_text": "Tell me about caching", "duration_minutes": 1})
+
+    assert response.status_code == 200
+    assert response.json() == {"response_text": '{"slides": []}'}
+    assert [call["inferenceConfig"]["maxTokens"] for call in bedrock.calls] == [budget, api.MAX_MODEL_TOKENS]
+    assert api.bedrock_executor.in_flight == 0
@@ -0,0 +1,189 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+from typing import Optional
+
+MAX_MODEL_TOKENS = 4096
+MIN_TOKENS = 100
+
+
+def calculate_max_tokens(duration_minutes: float) -> int:
+    """
+    Calculate maximum tokens based on duration in minutes.
+    """
+    words_per_minute = 200
+    tokens_per_word = 1.5
+    base_tokens = MIN_TOKENS
+
+    calculated_tokens = int(duration_minutes * words_per_minute * tokens_per_word)
+    return max(base_tokens, min(calculated_tokens, MAX_MODEL_TOKENS))
+
+
+def count_slides(text: str) -> Optional[int]:
+    """
+    Number of slides in a presentation response, or None when it is not a presentation.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        slides = json.loads(text[start:end + 1]).get("slides")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    return len(slides) if isinstance(slides, list) else None
+
+
+class TokenBudget:
+    def __init__(self, mode: str = "static", headroom: float = 1.5, margin: float = 1.15,
+                 quantile: float = 0.95, min_samples: int = 5, window: int = 200,
+                 state_path: Optional[str] = None):
+        """
+        Sizes ``maxTokens`` for presentation requests from the requested duration.
+
+        In ``static`` mode the budget is ``calculate_max_tokens(duration) * headroom``, the
+        headroom leaving room for the JSON structure around the narration. In ``learned``
+        mode every completed presentation records its output tokens per minute, and once
+        ``min_samples`` are known the budget shrinks to the ``quantile`` of the observed rate
+        times ``margin``. It never grows past the static budget, and falls back to it as soon
+        as a recent response was cut off by the limit.
+
+        :param state_path: Optional JSON file the samples are persisted to between restarts.
+        """
+        self.mode = mode
+        self.headroom = headroom
+        self.margin = margin
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.state_path = state_path
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.truncated = 0
+        self.total_output_tokens = 0
+        self.total_budget_tokens = 0
+        self.total_latency_ms = 0
+        self._load()
+
+    def static_budget(self, duration_minutes: float) -> int:
+        return min(MAX_MODEL_TOKENS, int(calculate_max_tokens(duration_minutes) * self.headroom))
+
+    def learned_budget(self, duration_minutes: float) -> Optional[int]:
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        if any(sample["truncated"] for sample in samples[-self.min_samples:]):
+            return None
+
+        rates = sorted(sample["output_tokens"] / sample["duration_minutes"] for sample in samples)
+        rate = rates[min(len(rates) - 1, int(math.ceil(self.quantile * len(rates))) - 1)]
+        return max(MIN_TOKENS, int(math.ceil(duration_minutes * rate * self.margin)))
+
+    def max_tokens(self, duration_minutes: float) -> int:
+        budget = self.static_budget(duration_minutes)
+        if self.mode == "learned":
+            learned = self.learned_budget(duration_minutes)
+            if learned is not None:
+                budget = min(budget, learned)
+        return budget
+
+    def record(self, duration_minutes: Optional[float], max_tokens: int, output_tokens: Optional[int],
+               latency_ms: Optional[float], stop_reason: Optional[str], text: str = ""):
+        """
+        Record the outcome of a completion. Only presentation requests, i.e. the ones that
+        carried a duration, are used to learn the budget.
+
+        The slide count of the response is kept for the metrics only: the model picks the
+        number of slides, so it is not known when the budget of a request is sized.
+        """
+        if output_tokens is None:
+            return
+        truncated = stop_reason == "max_tokens"
+
+        with self._lock:
+            self.requests += 1
+            self.truncated += int(truncated)
+            self.total_output_tokens += output_tokens
+            self.total_budget_tokens += max_tokens
+            self.total_latency_ms += latency_ms or 0
+
+            if duration_minutes is not None:
+                self._samples.append({
+                    "duration_minutes": duration_minutes,
+                    "slide_count": count_slides(text),
+                    "output_tokens": output_tokens,
+                    "max_tokens": max_tokens,
+                    "latency_ms": latency_ms,
+                    "truncated": truncated,
+                })
+                samples = list(self._samples)
+            else:
+                samples = None
+
+        if samples is not None:
+            self._save(samples)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+            metrics = {
+                "mode": self.mode,
+                "requests": self.requests,
+                "truncated": self.truncated,
+                "output_tokens": self.total_output_tokens,
+                "budget_tokens": self.total_budget_tokens,
+                "budget_utilisation": round(self.total_output_tokens / self.total_budget_tokens, 4)
+                if self.total_budget_tokens else None,
+                "tokens_per_second": round(self.total_output_tokens / (self.total_latency_ms / 1000), 2)
+                if self.total_latency_ms else None,
+                "samples": len(samples),
+            }
+
+        slide_samples = [sample for sample in samples if sample["slide_count"]]
+        if slide_samples:
+            metrics["tokens_per_slide"] = round(
+                sum(sample["output_tokens"] for sample in slide_samples)
+                / sum(sample["slide_count"] for sample in slide_samples), 1
+            )
+        if samples:
+            metrics["tokens_per_minute"] = round(
+                sum(sample["output_tokens"] for sample in samples)
+                / sum(sample["duration_minutes"] for sample in samples), 1
+            )
+            metrics["last"] = samples[-1]
+        return metrics
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as file:
+                self._samples.extend(json.load(file))
+        except (OSError, ValueError) as e:
+            print(f"Could not load token budget samples from {self.state_path}: {e}")
+
+    def _save(self, samples: list):
+        if not self.state_path:
+            return
+        try:
+            state_dir = os.path.dirname(self.state_path)
+            if state_dir:
+                os.makedirs(state_dir, exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(samples, file)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            print(f"Could not save token budget samples to {self.state_path}: {e}")
+
+
+def create_budget_from_env() -> TokenBudget:
+    return TokenBudget(
+        mode=os.getenv("TOKEN_BUDGET_MODE", "static"),
+        headroom=float(os.getenv("TOKEN_BUDGET_HEADROOM", "1.5")),
+        margin=float(os.getenv("TOKEN_BUDGET_MARGIN", "1.15")),
+        min_samples=int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "5")),
+        state_path=os.getenv("TOKEN_BUDGET_STATE_PATH") or None,
+    )
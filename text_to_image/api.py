@@ -9,6 +9,8 @@ from PIL import Image
 import botocore
 from enum import Enum
 
+from bedrock_executor import BackpressureError, create_executor_from_env
+
 
 import logging
 
@@ -63,6 +65,8 @@ except Exception as e:
     print(f"Failed to initialize Bedrock client: {str(e)}")
     raise
 
+bedrock_executor = create_executor_from_env()
+
 @app.post(
     "/generate",
     response_model=ImageGenerationResponse,
@@ -95,22 +99,18 @@ async def generate_image(request: ImageGenerationRequest):
         if request.config.seed is not None:
             body["imageGenerationConfig"]["seed"] = request.config.seed
 
-        # Make the API call to Bedrock
-        response = boto3_bedrock.invoke_model(
-            body=json.dumps(body),
-            modelId="amazon.titan-image-generator-v1",
-            accept="application/json",
-            contentType="application/json"
-        )
+        # Make the API call to Bedrock on the executor so the event loop stays free
+        response_body = await bedrock_executor.run(_invoke_model, body)
 
-        # Process the response
-        response_body = json.loads(response.get("body").read())
-        
         return ImageGenerationResponse(
             images=response_body["images"],
             config=request.config
         )
 
+    except BackpressureError as e:
+        logging.warning(f"Rejecting image generation request: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
     except botocore.exceptions.ClientError as e:
         error_code = e.response.get("Error", {}).get("Code", "Unknown")
         error_message = e.response.get("Error", {}).get("Message", str(e))
@@ -118,6 +118,9 @@ async def generate_image(request: ImageGenerationRequest):
             status_code=400,
             detail=f"AWS Bedrock Error ({error_code}): {error_message}"
         )
+
+    except HTTPException:
+        raise
     
     except Exception as e:
         raise HTTPException(
@@ -125,6 +128,17 @@ async def generate_image(request: ImageGenerationRequest):
             detail=f"Internal server error: {str(e)}"
         )
 
+def _invoke_model(body: dict) -> dict:
+    response = boto3_bedrock.invoke_model(
+        body=json.dumps(body),
+        modelId="amazon.titan-image-generator-v1",
+        accept="application/json",
+        contentType="application/json"
+    )
+
+    # Process the response
+    return json.loads(response.get("body").read())
+
 @app.post("/generate-and-save")
 async def generate_and_save_image(request: ImageGenerationRequest):
     try:
@@ -169,6 +183,10 @@ async def generate_and_save_image(request: ImageGenerationRequest):
             "saved_paths": saved_paths,
             "config": response.config
         }
+
+    except HTTPException:
+        # Already carries its status, e.g. the 429 and Retry-After of a full queue
+        raise
         
     except Exception as e:
         # Log the error details
@@ -180,4 +198,4 @@ async def generate_and_save_image(request: ImageGenerationRequest):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy", "bedrock": bedrock_executor.stats()}
\ No newline at end of file
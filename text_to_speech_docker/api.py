@@ -217,23 +217,57 @@ def upload_audio():
 """
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from pathlib import Path
-import tempfile
+from typing import List, Optional
+import asyncio
+import json
 import os
-import subprocess
 import logging
+import uuid
+
+from audio_cache import AudioCache, create_cache_from_env
+from audio_processing import OUTPUT_FORMATS, StreamNormalizer, media_type, process_pcm
+from synthesis_engine import SynthesisEngine, streaming_wav_header
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+MODELS_LOCATION = {
+    "default_man_en": "/app/voices/en_GB/en_GB-northern_english_male-medium.onnx",
+    "default_man_pt": "/app/voices/pt_PT/pt_PT-tugão-medium.onnx",
+}
+
+# The Portuguese voice speaks too fast; slow it down in the model instead of with ffmpeg's atempo=0.9
+LENGTH_SCALES = {
+    "default_man_pt": 1 / 0.9,
+}
+
+# Streamed speech is cached as raw 16-bit PCM; the normalisation differs from /synthesize
+STREAM_CACHE_FORMAT = "pcm"
+
+TTS_USE_CUDA = os.getenv("TTS_USE_CUDA", "false").lower() in ("1", "true", "yes")
+
+engine = SynthesisEngine(MODELS_LOCATION, use_cuda=TTS_USE_CUDA)
+audio_cache = create_cache_from_env()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load every voice once, so requests only pay for inference
+    await asyncio.to_thread(engine.load)
+    yield
+
+
 app = FastAPI(
     title="Speech Synthesis API",
     description="API for speech synthesis using Piper models",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -243,12 +277,6 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-MODELS_LOCATION = {
-    "default_man_en": "/app/voices/en_GB/en_GB-northern_english_male-medium.onnx",
-    "default_man_pt": "/app/voices/pt_PT/pt_PT-tugão-medium.onnx",
-}
-
-
 @app.post("/synthesize")
 async def synthesize(
     text: str = Form(...),
@@ -256,91 +284,261 @@ async def synthesize(
     model_character: str = Form("default_man_en"),
     output_format: str = Form("wav"),
     use_cuda: bool = Form(True),
+    sample_rate: Optional[int] = Form(None),
+    tempo: float = Form(1.0),
+    normalize: bool = Form(True),
 ):
     """
     Synthesize speech from text using a specified model.
     """
     logger.info(f"Received request to synthesize speech with text: {text}")
-    model_path = MODELS_LOCATION.get(model_character)
+    output_format = output_format.lower()
 
-    if not model_path:
+    if model_character not in MODELS_LOCATION:
         logger.error(f"Model {model_character} not found.")
         raise HTTPException(status_code=400, detail=f"Model {model_character} not found.")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format {output_format}.")
+    if use_cuda != TTS_USE_CUDA:
+        logger.debug(f"Ignoring use_cuda={use_cuda}, voices were loaded with TTS_USE_CUDA={TTS_USE_CUDA}")
+
+    filename = f"{Path(output_file_name).name}.{output_format}"
+    cache_key = _cache_key(text, model_character, output_format, sample_rate, tempo, normalize)
+    if cache_key:
+        cached_path = audio_cache.get(cache_key, output_format)
+        if cached_path:
+            logger.info("Serving synthesized speech from the cache.")
+            return FileResponse(cached_path, media_type=media_type(output_format), filename=filename)
 
     try:
-        audio_data = await perform_synthesis(
-            text, model_path, output_file_name, output_format.lower(), use_cuda, model_character == "default_man_pt"
+        audio_data = await asyncio.to_thread(
+            perform_synthesis, text, model_character, output_format, sample_rate, tempo, normalize
         )
         logger.info("Speech synthesis completed successfully.")
-
-        file_extension = output_format.lower()
-        response_path = f"{output_file_name}.{file_extension}"
-        with open(response_path, "wb") as f:
-            f.write(audio_data)
-
-        return FileResponse(response_path, media_type=f"audio/{file_extension}", filename=response_path)
-
+        if cache_key:
+            await asyncio.to_thread(audio_cache.put, cache_key, output_format, audio_data)
+    except KeyError as e:
+        logger.error(f"Voice {model_character} is not loaded: {e}")
+        raise HTTPException(status_code=503, detail=f"Model {model_character} is not loaded.")
     except Exception as e:
         logger.error(f"Error during synthesis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    return Response(
+        content=audio_data,
+        media_type=media_type(output_format),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 
-async def perform_synthesis(
-    text, model_path, output_file_name, output_format, use_cuda, is_portuguese
+@app.post("/synthesize-stream")
+async def synthesize_stream(
+    text: str = Form(...),
+    model_character: str = Form("default_man_en"),
+    output_format: str = Form("wav"),
+    normalize: bool = Form(True),
 ):
-    temp_files = []
+    """
+    Synthesize speech sentence by sentence and stream it back with chunked transfer encoding.
+
+    With ``output_format=wav`` the body starts with a streaming WAV header (sizes set to
+    0xFFFFFFFF) followed by 16-bit mono PCM; with ``pcm`` only the raw samples are sent and
+    the sample rate is given in ``X-Sample-Rate``. Sentences are synthesised in parallel on
+    the voice's session pool but always sent in order, so the first audio arrives after a
+    single sentence.
+
+    The samples of a finished stream are stored in the audio cache, and a cached text is
+    sent in one chunk right after the header.
+    """
+    output_format = output_format.lower()
+    if model_character not in MODELS_LOCATION:
+        raise HTTPException(status_code=400, detail=f"Model {model_character} not found.")
+    if output_format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail=f"Unsupported streaming format {output_format}.")
     try:
-        logger.debug("Creating temporary WAV file.")
-        tmp_wav_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-        temp_files.append(tmp_wav_file.name)
+        voice = engine.get(model_character)
+    except KeyError:
+        raise HTTPException(status_code=503, detail=f"Model {model_character} is not loaded.")
+
+    logger.info(f"Received request to stream speech with text: {text}")
+    # The stream is cached as its raw samples, whatever the format it is sent in
+    cache_key = _cache_key(text, model_character, STREAM_CACHE_FORMAT, None, 1.0, normalize)
+    return StreamingResponse(
+        _stream_sentences(voice, text, model_character, output_format, normalize, cache_key),
+        media_type="audio/wav" if output_format == "wav" else "audio/L16",
+        headers={"X-Sample-Rate": str(voice.sample_rate)},
+    )
+
+
+async def _stream_sentences(voice, text: str, model_character: str, output_format: str, normalize: bool,
+                            cache_key: Optional[str] = None):
+    if output_format == "wav":
+        yield streaming_wav_header(voice.sample_rate)
+
+    if cache_key:
+        cached_path = audio_cache.get(cache_key, STREAM_CACHE_FORMAT)
+        if cached_path:
+            try:
+                pcm = await asyncio.to_thread(Path(cached_path).read_bytes)
+            except FileNotFoundError:
+                pass
+            else:
+                logger.info("Streaming synthesized speech from the cache.")
+                yield pcm
+                return
+
+    length_scale = voice.length_scale * LENGTH_SCALES.get(model_character, 1.0)
+    semaphore = asyncio.Semaphore(voice.pool_size)
+    # One gain for the whole stream, taken from the first sentence, so the level does not jump
+    normalizer = StreamNormalizer() if normalize else None
+
+    async def synthesize_one(phoneme_ids):
+        async with semaphore:
+            return await asyncio.to_thread(voice.synthesize_ids, phoneme_ids, length_scale=length_scale)
+
+    sentences = await asyncio.to_thread(voice.sentence_ids, text)
+    tasks = [asyncio.create_task(synthesize_one(phoneme_ids)) for phoneme_ids in sentences]
+    chunks = []
+    try:
+        for idx, task in enumerate(tasks):
+            pcm = await task
+            chunk = normalizer(pcm) if normalizer else pcm
+            chunks.append(chunk)
+            yield chunk
+            logger.debug(f"Streamed sentence {idx + 1} of {len(tasks)}")
+        if cache_key:
+            await asyncio.to_thread(audio_cache.put, cache_key, STREAM_CACHE_FORMAT, b"".join(chunks))
+    except Exception as e:
+        # The status line is already sent; aborting the body tells the client the audio is incomplete
+        logger.error(f"Error during streaming synthesis: {str(e)}")
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        cmd = [
-            "python3",
-            "-m",
-            "piper",
-            "--model",
-            model_path,
-            "--output_file",
-            tmp_wav_file.name,
-        ]
-        if use_cuda:
-            cmd.append("--cuda")
 
-        subprocess.run(cmd, input=text.encode("utf-8"), check=True)
+class BatchSynthesisRequest(BaseModel):
+    scripts: List[str]
+    model_character: str = "default_man_en"
+    output_format: str = "wav"
+    sample_rate: Optional[int] = None
+    tempo: float = 1.0
+    normalize: bool = True
 
-        input_file = tmp_wav_file.name
 
-        if is_portuguese:
-            tmp_slow_wav = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-            temp_files.append(tmp_slow_wav.name)
+@app.post("/synthesize-batch")
+async def synthesize_batch(request: BatchSynthesisRequest):
+    """
+    Synthesize several scripts in parallel and stream them back as ``multipart/mixed``.
 
-            slow_cmd = ["ffmpeg", "-y", "-i", input_file, "-filter:a", "atempo=0.9", tmp_slow_wav.name]
-            subprocess.run(slow_cmd, check=True)
-            input_file = tmp_slow_wav.name
+    Parts are sent in completion order, each one carrying the position of its script in
+    ``X-Script-Index`` and a ``Content-Length``. A script that fails is answered with an
+    ``application/json`` part holding the error instead of audio.
+    """
+    output_format = request.output_format.lower()
+    if request.model_character not in MODELS_LOCATION:
+        raise HTTPException(status_code=400, detail=f"Model {request.model_character} not found.")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format {output_format}.")
+    try:
+        voice = engine.get(request.model_character)
+    except KeyError:
+        raise HTTPException(status_code=503, detail=f"Model {request.model_character} is not loaded.")
 
-        if output_format == "mp3":
-            tmp_mp3_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-            temp_files.append(tmp_mp3_file.name)
+    logger.info(f"Received request to synthesize a batch of {len(request.scripts)} scripts")
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(
+        _stream_batch(request, output_format, voice.pool_size, boundary),
+        media_type=f"multipart/mixed; boundary={boundary}",
+    )
 
-            ffmpeg_cmd = ["ffmpeg", "-y", "-i", input_file, "-f", "mp3", tmp_mp3_file.name]
-            subprocess.run(ffmpeg_cmd, check=True)
-            final_file = tmp_mp3_file.name
-        else:
-            final_file = input_file
 
-        with open(final_file, "rb") as f:
-            audio_data = f.read()
+async def _stream_batch(request: BatchSynthesisRequest, output_format: str, concurrency: int, boundary: str):
+    semaphore = asyncio.Semaphore(concurrency)
 
-        return audio_data
+    async def synthesize_one(idx: int, text: str):
+        async with semaphore:
+            try:
+                audio_data = await asyncio.to_thread(
+                    perform_cached_synthesis, text, request.model_character, output_format,
+                    request.sample_rate, request.tempo, request.normalize,
+                )
+                return idx, audio_data, None
+            except Exception as e:
+                logger.error(f"Error during synthesis of script {idx}: {str(e)}")
+                return idx, None, str(e)
 
-    except subprocess.CalledProcessError as e:
-        error_message = e.stderr.decode("utf-8") if e.stderr else str(e)
-        logger.error(f"Subprocess error: {error_message}")
-        raise RuntimeError(error_message)
+    tasks = [asyncio.create_task(synthesize_one(idx, text)) for idx, text in enumerate(request.scripts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            idx, audio_data, error = await next_done
+            if error is None:
+                content_type = media_type(output_format)
+                body = audio_data
+            else:
+                content_type = "application/json"
+                body = json.dumps({"error": error}).encode("utf-8")
+            headers = (
+                f"--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Disposition: attachment; filename=\"audio_{idx}.{output_format}\"\r\n"
+                f"X-Script-Index: {idx}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            )
+            yield headers.encode("utf-8") + body + b"\r\n"
+        yield f"--{boundary}--\r\n".encode("utf-8")
     finally:
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
+        for task in tasks:
+            task.cancel()
+
+
+def _cache_key(text: str, model_character: str, output_format: str, sample_rate: Optional[int],
+               tempo: float, normalize: bool) -> Optional[str]:
+    if audio_cache is None or model_character not in engine.voices:
+        return None
+    voice = engine.get(model_character)
+    return AudioCache.make_key(
+        voice.model_hash,
+        text,
+        output_format=output_format,
+        sample_rate=sample_rate,
+        tempo=tempo,
+        normalize=normalize,
+        length_scale=voice.length_scale * LENGTH_SCALES.get(model_character, 1.0),
+    )
+
+
+def perform_cached_synthesis(text: str, model_character: str, output_format: str, sample_rate: Optional[int] = None,
+                             tempo: float = 1.0, normalize: bool = True) -> bytes:
+    """
+    ``perform_synthesis`` behind the audio cache, for callers that need the bytes themselves.
+    """
+    cache_key = _cache_key(text, model_character, output_format, sample_rate, tempo, normalize)
+    if cache_key:
+        cached_path = audio_cache.get(cache_key, output_format)
+        if cached_path:
+            try:
+                with open(cached_path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+
+    audio_data = perform_synthesis(text, model_character, output_format, sample_rate, tempo, normalize)
+    if cache_key:
+        audio_cache.put(cache_key, output_format, audio_data)
+    return audio_data
+
+
+def perform_synthesis(text: str, model_character: str, output_format: str, sample_rate: Optional[int] = None,
+                      tempo: float = 1.0, normalize: bool = True) -> bytes:
+    """
+    Synthesise the text with the warm voice of ``model_character`` and post-process and
+    encode it, entirely in memory.
+    """
+    voice = engine.get(model_character)
+    length_scale = voice.length_scale * LENGTH_SCALES.get(model_character, 1.0)
+    pcm = voice.synthesize_pcm(text, length_scale=length_scale)
+    return process_pcm(pcm, voice.sample_rate, output_format, tempo, sample_rate, normalize)
 
 
 @app.post("/upload")
@@ -369,6 +567,10 @@ async def upload_audio(file: UploadFile = File(...)):
 @app.get("/health")
 async def health_check():
     """
-    Health check endpoint.
+    Health check endpoint, with the loaded voices, their session pools and the audio cache.
     """
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "voices": engine.stats(),
+        "cache": await asyncio.to_thread(audio_cache.stats) if audio_cache else None,
+    }
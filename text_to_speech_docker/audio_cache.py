@@ -0,0 +1,153 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+LOCK_FILE = ".lock"
+# Entries used this recently are never evicted, so a file being served is not deleted under it
+EVICTION_GRACE_SECONDS = 60
+
+
+class AudioCache:
+    def __init__(self, cache_dir: str, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        """
+        Content-addressed cache of synthesised audio files, shared by every worker and
+        container that mounts ``cache_dir``.
+
+        Entries are written to a temporary file and moved into place with ``os.replace``, so
+        readers only ever see complete files. Eviction is least recently used by total bytes:
+        a hit refreshes the file's mtime, and the oldest files are removed while holding an
+        exclusive ``flock`` on the cache's lock file, so only one process evicts at a time.
+
+        :param cache_dir: Directory of the cache, e.g. on the shared ``./data`` volume.
+        :param max_bytes: Maximum total size of the cached audio.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_path = os.path.join(cache_dir, LOCK_FILE)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def make_key(model_hash: str, text: str, **params) -> str:
+        """
+        Content address of an utterance: the voice model file, the text and every
+        parameter that changes the produced audio (tempo, format, rate...).
+        """
+        payload = json.dumps({"model": model_hash, "text": text, **params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{extension}")
+
+    def get(self, key: str, extension: str) -> Optional[str]:
+        """
+        Path of the cached file for ``key``, or None on a miss.
+        """
+        path = self._path(key, extension)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._stats_lock:
+                self.misses += 1
+            return None
+        with self._stats_lock:
+            self.hits += 1
+        return path
+
+    def put(self, key: str, extension: str, data: bytes) -> str:
+        path = self._path(key, extension)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        self.evict()
+        return path
+
+    @contextmanager
+    def _exclusive(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entries(self):
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        with self._exclusive():
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            if total <= self.max_bytes:
+                return
+
+            now = time.time()
+            evicted = 0
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes or now - mtime < EVICTION_GRACE_SECONDS:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+
+        if evicted:
+            with self._stats_lock:
+                self.evicted += evicted
+            logger.info(f"Evicted {evicted} entries from the audio cache, {total} bytes left")
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+            }
+
+
+def create_cache_from_env() -> Optional[AudioCache]:
+    if not TTS_CACHE_DIR:
+        return None
+    return AudioCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
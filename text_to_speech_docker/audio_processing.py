@@ -0,0 +1,144 @@
+import io
+import logging
+import os
+import subprocess
+from typing import Optional
+
+import librosa
+import numpy as np
+import soundfile
+
+logger = logging.getLogger(__name__)
+
+TARGET_DBFS = float(os.getenv("TTS_TARGET_DBFS", "-20.0"))
+PEAK_DBFS = -1.0
+
+# Opus only runs at these rates; other rates are resampled to 48 kHz before encoding
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+OUTPUT_FORMATS = {
+    "wav": ("WAV", "PCM_16", "audio/wav"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "audio/mpeg"),
+    "opus": ("OGG", "OPUS", "audio/ogg"),
+}
+
+
+def pcm_to_float(pcm: bytes) -> np.ndarray:
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def change_tempo(audio: np.ndarray, tempo: float) -> np.ndarray:
+    """
+    Speed the audio up (tempo > 1) or slow it down (tempo < 1) without changing its pitch,
+    like ffmpeg's ``atempo`` filter.
+    """
+    if tempo == 1.0 or audio.size == 0:
+        return audio
+    return librosa.effects.time_stretch(audio, rate=tempo)
+
+
+def resample(audio: np.ndarray, sample_rate: int, target_rate: int) -> np.ndarray:
+    if sample_rate == target_rate or audio.size == 0:
+        return audio
+    return librosa.resample(audio, orig_sr=sample_rate, target_sr=target_rate)
+
+
+def loudness_gain(audio: np.ndarray, target_dbfs: float = TARGET_DBFS, peak_dbfs: float = PEAK_DBFS) -> Optional[float]:
+    """
+    Gain that brings the audio to an RMS level of ``target_dbfs`` without letting peaks go
+    above ``peak_dbfs``, or None for silence.
+    """
+    rms = float(np.sqrt(np.mean(np.square(audio)))) if audio.size else 0.0
+    if rms <= 1e-6:
+        return None
+    gain = 10 ** (target_dbfs / 20) / rms
+    peak = float(np.max(np.abs(audio)))
+    return min(gain, 10 ** (peak_dbfs / 20) / peak)
+
+
+def normalize_loudness(audio: np.ndarray, target_dbfs: float = TARGET_DBFS, peak_dbfs: float = PEAK_DBFS) -> np.ndarray:
+    """
+    Scale the audio to an RMS level of ``target_dbfs``, without letting peaks go above ``peak_dbfs``.
+    """
+    gain = loudness_gain(audio, target_dbfs, peak_dbfs)
+    return audio if gain is None else audio * gain
+
+
+def float_to_pcm(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+
+class StreamNormalizer:
+    def __init__(self):
+        """
+        Loudness normalisation of audio that is streamed in chunks, e.g. sentence by sentence.
+
+        The gain is taken from the first chunk that is not silent and applied unchanged to
+        every chunk after it, so the level does not jump between sentences. Peaks of later
+        chunks above full scale are clipped.
+        """
+        self.gain: Optional[float] = None
+
+    def __call__(self, pcm: bytes) -> bytes:
+        audio = pcm_to_float(pcm)
+        if self.gain is None:
+            self.gain = loudness_gain(audio)
+            if self.gain is None:
+                return pcm
+        return float_to_pcm(audio * self.gain)
+
+
+def encode(audio: np.ndarray, sample_rate: int, output_format: str) -> bytes:
+    """
+    Encode float audio in memory as WAV, MP3 or Opus (in an Ogg container).
+    """
+    container, subtype, _ = OUTPUT_FORMATS[output_format]
+    if output_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+        audio = resample(audio, sample_rate, 48000)
+        sample_rate = 48000
+
+    buffer = io.BytesIO()
+    try:
+        soundfile.write(buffer, np.clip(audio, -1.0, 1.0), sample_rate, format=container, subtype=subtype)
+    except (soundfile.LibsndfileError, ValueError) as e:
+        if output_format == "wav":
+            raise
+        # libsndfile older than 1.1 cannot write MP3; fall back to piping through ffmpeg
+        logger.warning(f"libsndfile cannot encode {output_format} ({e}), falling back to ffmpeg")
+        return _encode_with_ffmpeg(audio, sample_rate, output_format)
+    return buffer.getvalue()
+
+
+def _encode_with_ffmpeg(audio: np.ndarray, sample_rate: int, output_format: str) -> bytes:
+    wav = encode(audio, sample_rate, "wav")
+    codec = ["-f", "mp3"] if output_format == "mp3" else ["-c:a", "libopus", "-f", "ogg"]
+    process = subprocess.run(
+        ["ffmpeg", "-y", "-f", "wav", "-i", "pipe:0", *codec, "pipe:1"],
+        input=wav, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.decode("utf-8", errors="replace"))
+    return process.stdout
+
+
+def process_pcm(pcm: bytes, sample_rate: int, output_format: str = "wav", tempo: float = 1.0,
+                target_rate: Optional[int] = None, normalize: bool = True) -> bytes:
+    """
+    Post-process 16-bit mono PCM entirely in memory and return the encoded audio.
+
+    :param tempo: Playback speed factor, e.g. 0.9 for the ``atempo=0.9`` slow-down.
+    :param target_rate: Output sample rate, defaults to the voice's rate.
+    :param normalize: Normalise the loudness to ``TARGET_DBFS``.
+    """
+    audio = pcm_to_float(pcm)
+    audio = change_tempo(audio, tempo)
+    if target_rate:
+        audio = resample(audio, sample_rate, target_rate)
+        sample_rate = target_rate
+    if normalize:
+        audio = normalize_loudness(audio)
+    return encode(audio, sample_rate, output_format)
+
+
+def media_type(output_format: str) -> str:
+    return OUTPUT_FORMATS[output_format][2]
@@ -0,0 +1,247 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import wave
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import onnxruntime
+from piper_phonemize import phonemize_codepoints, phonemize_espeak
+
+logger = logging.getLogger(__name__)
+
+BOS = "^"
+EOS = "$"
+PAD = "_"
+
+SAMPLE_WIDTH = 2  # 16-bit PCM
+CHANNELS = 1
+
+SESSION_THREADS = int(os.getenv("TTS_SESSION_THREADS", "2"))
+SESSION_POOL_SIZE = int(os.getenv("TTS_SESSION_POOL_SIZE", "0"))  # 0 sizes the pool to the cores
+SENTENCE_SILENCE = float(os.getenv("TTS_SENTENCE_SILENCE", "0.0"))
+
+
+class PiperVoice:
+    def __init__(self, name: str, model_path: str, use_cuda: bool = False,
+                 pool_size: int = 0, session_threads: int = SESSION_THREADS):
+        """
+        A Piper voice loaded once and kept warm: its configuration is parsed a single time
+        and a pool of ONNX Runtime sessions is created up front, so synthesis only costs the
+        phonemisation and the inference itself.
+
+        :param model_path: Path of the ``.onnx`` model; its ``.onnx.json`` config sits next to it.
+        :param pool_size: Number of sessions, i.e. sentences synthesised in parallel. 0 sizes
+                          the pool to the available cores divided by ``session_threads``.
+        :param session_threads: Intra-op threads of every session.
+        """
+        self.name = name
+        self.model_path = model_path
+        self.model_hash = file_sha256(model_path)
+
+        with open(f"{model_path}.json", "r", encoding="utf-8") as config_file:
+            self.config = json.load(config_file)
+        self.sample_rate = self.config["audio"]["sample_rate"]
+        self.num_speakers = self.config.get("num_speakers", 1)
+        self.phoneme_id_map: Dict[str, List[int]] = self.config["phoneme_id_map"]
+        inference = self.config.get("inference", {})
+        self.noise_scale = inference.get("noise_scale", 0.667)
+        self.length_scale = inference.get("length_scale", 1.0)
+        self.noise_w = inference.get("noise_w", 0.8)
+
+        if pool_size <= 0:
+            pool_size = max(1, (os.cpu_count() or 1) // max(1, session_threads))
+        self.pool_size = pool_size
+
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if use_cuda else ["CPUExecutionProvider"]
+        self._sessions: "queue.Queue[onnxruntime.InferenceSession]" = queue.Queue()
+        for _ in range(pool_size):
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = session_threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self._sessions.put(onnxruntime.InferenceSession(model_path, sess_options=options, providers=providers))
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.busy = 0
+        self.inference_seconds = 0.0
+        self.audio_seconds = 0.0
+
+    @contextmanager
+    def _session(self) -> Iterator[onnxruntime.InferenceSession]:
+        session = self._sessions.get()
+        with self._lock:
+            self.busy += 1
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self.busy -= 1
+            self._sessions.put(session)
+
+    def phonemize(self, text: str) -> List[List[str]]:
+        """
+        Split the text into sentences of phonemes.
+        """
+        if self.config.get("phoneme_type", "espeak") == "text":
+            return phonemize_codepoints(text)
+        return phonemize_espeak(text, self.config["espeak"]["voice"])
+
+    def phonemes_to_ids(self, phonemes: List[str]) -> List[int]:
+        ids = list(self.phoneme_id_map[BOS])
+        for phoneme in phonemes:
+            if phoneme not in self.phoneme_id_map:
+                logger.warning(f"Missing phoneme from id map: {phoneme}")
+                continue
+            ids.extend(self.phoneme_id_map[phoneme])
+            ids.extend(self.phoneme_id_map[PAD])
+        ids.extend(self.phoneme_id_map[EOS])
+        return ids
+
+    def synthesize_ids(self, phoneme_ids: List[int], speaker_id: Optional[int] = None,
+                       length_scale: Optional[float] = None) -> bytes:
+        """
+        Run one sentence through the model and return it as 16-bit mono PCM.
+        """
+        inputs = {
+            "input": np.expand_dims(np.array(phoneme_ids, dtype=np.int64), 0),
+            "input_lengths": np.array([len(phoneme_ids)], dtype=np.int64),
+            "scales": np.array(
+                [self.noise_scale, length_scale or self.length_scale, self.noise_w], dtype=np.float32
+            ),
+        }
+        if self.num_speakers > 1:
+            inputs["sid"] = np.array([speaker_id or 0], dtype=np.int64)
+
+        started = time.perf_counter()
+        with self._session() as session:
+            audio = session.run(None, inputs)[0].squeeze()
+        elapsed = time.perf_counter() - started
+
+        pcm = _float_to_int16(audio)
+        with self._lock:
+            self.inference_seconds += elapsed
+            self.audio_seconds += len(pcm) / self.sample_rate
+        return pcm.tobytes()
+
+    def sentence_ids(self, text: str) -> List[List[int]]:
+        """
+        Phoneme ids of every sentence of the text, ready for ``synthesize_ids``.
+        """
+        with self._lock:
+            self.requests += 1
+        return [self.phonemes_to_ids(phonemes) for phonemes in self.phonemize(text) if phonemes]
+
+    def synthesize_sentences(self, text: str, speaker_id: Optional[int] = None,
+                             length_scale: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Yield the PCM of every sentence of the text as soon as it is synthesised.
+        """
+        for phoneme_ids in self.sentence_ids(text):
+            yield self.synthesize_ids(phoneme_ids, speaker_id, length_scale)
+
+    def synthesize_pcm(self, text: str, speaker_id: Optional[int] = None,
+                       length_scale: Optional[float] = None, sentence_silence: float = SENTENCE_SILENCE) -> bytes:
+        """
+        Synthesise the whole text into a single 16-bit mono PCM buffer.
+        """
+        silence = bytes(int(self.sample_rate * sentence_silence) * SAMPLE_WIDTH)
+        return silence.join(self.synthesize_sentences(text, speaker_id, length_scale))
+
+    def synthesize_wav(self, text: str, speaker_id: Optional[int] = None,
+                       length_scale: Optional[float] = None) -> bytes:
+        return pcm_to_wav(self.synthesize_pcm(text, speaker_id, length_scale), self.sample_rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "model_path": self.model_path,
+                "sample_rate": self.sample_rate,
+                "pool_size": self.pool_size,
+                "busy_sessions": self.busy,
+                "requests": self.requests,
+                "inference_seconds": round(self.inference_seconds, 3),
+                "audio_seconds": round(self.audio_seconds, 3),
+                "real_time_factor": round(self.inference_seconds / self.audio_seconds, 4)
+                if self.audio_seconds else None,
+            }
+
+
+class SynthesisEngine:
+    def __init__(self, models_location: Dict[str, str], use_cuda: bool = False, pool_size: int = SESSION_POOL_SIZE):
+        """
+        Holds one warm ``PiperVoice`` per entry of ``models_location``.
+        """
+        self.models_location = models_location
+        self.use_cuda = use_cuda
+        self.pool_size = pool_size
+        self.voices: Dict[str, PiperVoice] = {}
+
+    def load(self):
+        for name, model_path in self.models_location.items():
+            if not os.path.exists(model_path):
+                logger.warning(f"Voice {name} not found at {model_path}, skipping.")
+                continue
+            started = time.perf_counter()
+            self.voices[name] = PiperVoice(name, model_path, use_cuda=self.use_cuda, pool_size=self.pool_size)
+            logger.info(
+                f"Loaded voice {name} with {self.voices[name].pool_size} sessions "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+
+    def get(self, name: str) -> PiperVoice:
+        voice = self.voices.get(name)
+        if voice is None:
+            raise KeyError(f"Model {name} not found.")
+        return voice
+
+    def stats(self) -> dict:
+        return {name: voice.stats() for name, voice in self.voices.items()}
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _float_to_int16(audio: np.ndarray) -> np.ndarray:
+    audio = audio * (32767 / max(0.01, float(np.max(np.abs(audio)))))
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """
+    Wrap 16-bit mono PCM in a WAV container, in memory.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(CHANNELS)
+        wav_file.setsampwidth(SAMPLE_WIDTH)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def streaming_wav_header(sample_rate: int) -> bytes:
+    """
+    WAV header for a stream of unknown length: the RIFF and data sizes are set to their
+    maximum, which players and decoders read as "until the end of the stream".
+    """
+    byte_rate = sample_rate * CHANNELS * SAMPLE_WIDTH
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, CHANNELS, sample_rate, byte_rate, CHANNELS * SAMPLE_WIDTH, SAMPLE_WIDTH * 8,
+        b"data", 0xFFFFFFFF,
+    )